@@ -305,4 +305,19 @@ class MaskAdmin(admin.ModelAdmin):
 
 
 
-        
\ No newline at end of file
+        
+
+
+
+@admin.register(Artifact)
+class ArtifactAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'refs', 'size', 'stored_size', 'time_created',)
+    search_fields = ('id', 'path',)
+
+
+
+
+@admin.register(TaskLease)
+class TaskLeaseAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'task_method', 'attempts', 'expires_at', 'time_created',)
+    search_fields = ('resource_id', 'task_id',)
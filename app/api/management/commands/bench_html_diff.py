@@ -0,0 +1,173 @@
+from ...utils.differ import TokenStream, similarity, diff_html
+from django.core.management.base import BaseCommand, CommandError
+from difflib import SequenceMatcher
+import random, re, time, requests, os, glob
+
+
+
+
+
+
+# benchmarking the html diff engine against the previous
+# SequenceMatcher & list membership implementation.
+# pass real-world pages via --url (fetched twice) or
+# --pre & --post (local paths or urls), otherwise the
+# checked-in real-world pairs in ./fixtures/html_diff
+# (rustdoc pages, <name>.pre.html & <name>.post.html)
+# and a large synthetic page are used. --check runs only the
+# checked-in pairs & fails if `similarity()` drifts more than
+# --tolerance from the legacy SequenceMatcher ratio.
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'html_diff')
+
+
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', default=[])
+        parser.add_argument('--pre', type=str, default=None)
+        parser.add_argument('--post', type=str, default=None)
+        parser.add_argument('--size', type=int, default=20000)
+        parser.add_argument('--changes', type=int, default=200)
+        parser.add_argument('--legacy', action='store_true')
+        parser.add_argument('--check', action='store_true')
+        parser.add_argument('--tolerance', type=float, default=0.01)
+
+    def handle(self, *args, **options):
+
+        # regression check against the legacy ratio
+        if options['check']:
+            self.check(checked_in_pages(), options['tolerance'])
+            return None
+
+        # build fixtures
+        fixtures = []
+        for url in options['url']:
+            fixtures.append((url, load(url), load(url)))
+        if options['pre'] and options['post']:
+            fixtures.append((
+                f"{options['pre']} -> {options['post']}",
+                load(options['pre']), load(options['post'])
+            ))
+        if not fixtures:
+            fixtures += checked_in_pages()
+            pre, post = synthetic_pages(options['size'], options['changes'])
+            fixtures.append((f"synthetic ({options['size']} lines)", pre, post))
+
+        for name, pre, post in fixtures:
+            print(f'\n--- {name} ---')
+
+            # tokenize
+            start = time.perf_counter()
+            pre_stream = TokenStream.from_lines(pre.splitlines())
+            post_stream = TokenStream.from_lines(post.splitlines())
+            print(f'tokens          : {len(pre_stream)} / {len(post_stream)} ({elapsed(start)})')
+
+            # new engine
+            start = time.perf_counter()
+            score = similarity(pre_stream.hashes, post_stream.hashes)
+            print(f'similarity      : {round(score, 4)} ({elapsed(start)})')
+            start = time.perf_counter()
+            data = diff_html(pre_stream, post_stream)
+            print(
+                f'diff_html       : {len(data["delta_html_pre"])} pre / '
+                f'{len(data["delta_html_post"])} post ({elapsed(start)})'
+            )
+
+            # previous implementation
+            if options['legacy']:
+                pre_tokens = list(pre_stream)
+                post_tokens = list(post_stream)
+                start = time.perf_counter()
+                score = SequenceMatcher(None, pre_tokens, post_tokens).ratio()
+                print(f'legacy ratio    : {round(score, 4)} ({elapsed(start)})')
+                start = time.perf_counter()
+                delta_post = [t for t in post_tokens if t not in pre_tokens]
+                delta_pre = [t for t in pre_tokens if t not in post_tokens]
+                legacy_micro(delta_pre, delta_post)
+                legacy_micro(delta_post, delta_pre)
+                print(f'legacy delta    : {len(delta_pre)} pre / {len(delta_post)} post ({elapsed(start)})')
+
+            pre_stream.close()
+            post_stream.close()
+
+
+
+
+    def check(self, fixtures: list, tolerance: float) -> None:
+        # compare similarity() to the legacy ratio on each pair
+        if not fixtures:
+            raise CommandError(f'no fixtures found in {FIXTURES_DIR}')
+        failed = []
+        for name, pre, post in fixtures:
+            pre_stream = TokenStream.from_lines(pre.splitlines())
+            post_stream = TokenStream.from_lines(post.splitlines())
+            score = similarity(pre_stream.hashes, post_stream.hashes)
+            legacy = SequenceMatcher(None, list(pre_stream), list(post_stream)).ratio()
+            pre_stream.close()
+            post_stream.close()
+            ok = abs(score - legacy) <= tolerance
+            print(f'{name:<24}: {round(score, 4)} vs legacy {round(legacy, 4)} {"ok" if ok else "FAILED"}')
+            if not ok:
+                failed.append(name)
+        if failed:
+            raise CommandError(f'similarity outside {tolerance} of legacy ratio: {", ".join(failed)}')
+
+
+
+
+def elapsed(start: float) -> str:
+    return f'{round(time.perf_counter() - start, 3)}s'
+
+
+
+
+def load(source: str) -> str:
+    # read a local file or fetch a url
+    if source.startswith('http'):
+        return requests.get(source, timeout=30).text
+    with open(source, 'r', errors='ignore') as f:
+        return f.read()
+
+
+
+
+def checked_in_pages() -> list:
+    # real-world page pairs from FIXTURES_DIR
+    pairs = []
+    for pre_path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.pre.html'))):
+        post_path = pre_path.replace('.pre.html', '.post.html')
+        if os.path.exists(post_path):
+            name = os.path.basename(pre_path).replace('.pre.html', '')
+            pairs.append((name, load(pre_path), load(post_path)))
+    return pairs
+
+
+
+
+def synthetic_pages(size: int, changes: int) -> tuple:
+    # generate a large page & a copy with random edits
+    r = random.Random(size)
+    lines = ['<!DOCTYPE html>', '<html>', '<head><title>bench</title></head>', '<body>']
+    for i in range(size):
+        lines.append(
+            f'<div class="row r{r.randint(0, 99)}"><p>item {r.randint(0, 9999)}</p>'
+            f'<a href="/path/{i}">link {i}</a><img src="/img/{r.randint(0, 500)}.png"></div>'
+        )
+    lines.append('</body></html>')
+    edited = list(lines)
+    for i in range(changes):
+        edited[r.randrange(4, len(edited) - 1)] = f'<section id="s{i}"><span>changed {i}</span></section>'
+    return '\n'.join(lines), '\n'.join(edited)
+
+
+
+
+def legacy_micro(primary: list, secondary: list) -> list:
+    # 8 char chunk substring search of the previous implementation
+    secondary_str = ''.join(secondary)
+    chunks = []
+    for line in primary:
+        chunks += re.findall('.{1,8}', line)
+    return [c for c in chunks if c and c not in secondary_str]
@@ -0,0 +1,114 @@
+from ...models import *
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import timedelta
+import time
+
+
+
+
+
+
+# benchmarking the hot query shapes (get_scans, get_page_metrics,
+# Reporter.get_lookback_*, redeliver_failed_tasks) and printing
+# their plans. pass --page to choose the fixture (defaults to the
+# page of the latest Scan). --before drops the Meta.indexes inside
+# a rolled back transaction to show the plans without them; this
+# takes exclusive locks, so only run it against a staging copy.
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=str, default=None)
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--analyze', action='store_true')
+        parser.add_argument('--before', action='store_true')
+
+    def handle(self, *args, **options):
+
+        # get fixture
+        if options['page']:
+            page = Page.objects.get(id=options['page'])
+        else:
+            scan = Scan.objects.order_by('-time_created').first()
+            if scan is None:
+                print('no scans found')
+                return None
+            page = scan.page
+        site = page.site
+        window_start = timezone.now() - timedelta(days=options['days'])
+
+        queries = get_queries(page, site, window_start)
+
+        if options['before']:
+            with transaction.atomic():
+                drop_indexes()
+                print('\n===== without indexes =====')
+                run(queries, options['analyze'])
+                transaction.set_rollback(True)
+
+        print('\n===== with indexes =====')
+        run(queries, options['analyze'])
+
+
+
+
+def get_queries(page: object, site: object, window_start: object) -> list:
+    # mirrors the filters used in services.py,
+    # reporter.py & tasks.py
+    page_ids = list(Page.objects.filter(site=site).values_list('id', flat=True))
+    scoped_ids = [str(site.id)] + [str(i) for i in page_ids]
+    return [
+        ('get_scans',
+            Scan.objects.filter(page=page).order_by('-time_created')[:10]),
+        ('get_page_metrics (scans)',
+            Scan.objects.filter(page_id=page.id, time_completed__gte=window_start).order_by('-time_created')),
+        ('get_page_metrics (tests)',
+            Test.objects.filter(page_id=page.id, time_completed__gte=window_start).order_by('-time_created')),
+        ('get_lookback_scans',
+            Scan.objects.filter(site=site).exclude(time_completed=None)
+            .filter(time_completed__gte=window_start).order_by('-time_completed')),
+        ('get_lookback_tests',
+            Test.objects.filter(site=site).exclude(time_completed=None)
+            .filter(time_completed__gte=window_start).order_by('-time_completed')),
+        ('get_lookback_caseruns',
+            CaseRun.objects.filter(site=site, account=site.account).exclude(time_completed=None)
+            .filter(time_completed__gte=window_start).order_by('-time_completed')),
+        ('get_lookback_issues',
+            Issue.objects.filter(account=site.account, affected__id__in=scoped_ids, time_created__gte=window_start)
+            .order_by('-time_created').distinct()),
+        ('redeliver_failed_tasks (scans)',
+            Scan.objects.filter(time_completed=None)),
+        ('redeliver_failed_tasks (tests)',
+            Test.objects.filter(time_completed=None).exclude(post_scan__time_completed=None)),
+        ('redeliver_failed_tasks (flowruns)',
+            FlowRun.objects.filter(time_completed=None)),
+    ]
+
+
+
+
+def drop_indexes() -> None:
+    # drop every index declared in Meta.indexes
+    models = [Scan, Test, CaseRun, Issue, FlowRun, Schedule, Process, Log]
+    with connection.cursor() as cursor:
+        for model in models:
+            for index in model._meta.indexes:
+                cursor.execute(f'DROP INDEX IF EXISTS "{index.name}"')
+
+
+
+
+def run(queries: list, analyze: bool) -> None:
+    for name, queryset in queries:
+        print(f'\n--- {name} ---')
+        start = time.perf_counter()
+        count = len(list(queryset))
+        print(f'rows            : {count} ({elapsed(start)})')
+        print(queryset.explain(analyze=analyze, buffers=analyze))
+
+
+
+
+def elapsed(start: float) -> str:
+    return f'{round((time.perf_counter() - start) * 1000, 2)} ms'
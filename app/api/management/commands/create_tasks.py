@@ -19,6 +19,18 @@ class Command(BaseCommand):
                 'name': 'Redeliver Failed Tasks',
                 'task': 'api.tasks.redeliver_failed_tasks'
             },
+            {
+                'every': 1,
+                'period': IntervalSchedule.MINUTES,
+                'name': 'Dispatch Parked Tasks',
+                'task': 'api.tasks.dispatch_ready_tasks'
+            },
+            {
+                'every': 1,
+                'period': IntervalSchedule.MINUTES,
+                'name': 'Flush Meter Events',
+                'task': 'api.tasks.flush_meter_events'
+            },
             {
                 'every': 1,
                 'period': IntervalSchedule.DAYS,
@@ -31,6 +43,12 @@ class Command(BaseCommand):
                 'name': 'Reset Account Usage',
                 'task': 'api.tasks.reset_account_usage'
             },
+            {
+                'every': 6,
+                'period': IntervalSchedule.HOURS,
+                'name': 'Delete Orphaned Artifacts',
+                'task': 'api.tasks.delete_orphaned_artifacts'
+            },
         ]
 
         # loop through and create 
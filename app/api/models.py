@@ -1,4 +1,8 @@
 from django.db import models
+from django.db.models import Q, F
+from django.db.models.fields.json import KeyTransform
+from django.db.models.functions import Upper
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.utils import timezone
 from django.contrib.auth.models import User
 from cursion import settings
@@ -474,6 +478,11 @@ class Site(models.Model):
     def __str__(self):
         return f'{self.site_url}'
 
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(Upper('site_url'), name='gin_trgm_ops'), name='site_site_url_trgm'),
+        ]
+
 
 
 
@@ -490,6 +499,11 @@ class Page(models.Model):
     def __str__(self):
         return f'{self.page_url}'
 
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(Upper('page_url'), name='gin_trgm_ops'), name='page_page_url_trgm'),
+        ]
+
 
 
 
@@ -515,6 +529,16 @@ class Scan(models.Model):
     def __str__(self):
         return f'{self.id}__scan'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['page', '-time_created'], name='scan_page_created_idx'),
+            models.Index(fields=['page', 'time_completed'], name='scan_page_completed_idx'),
+            models.Index(fields=['site', '-time_completed'], name='scan_site_completed_idx'),
+            models.Index(fields=['time_created'], name='scan_created_idx'),
+            models.Index(fields=['time_created'], condition=Q(time_completed=None), name='scan_incomplete_idx'),
+            GinIndex(fields=['tags'], name='scan_tags_gin'),
+        ]
+
 
 
 
@@ -545,6 +569,16 @@ class Test(models.Model):
     def __str__(self):
         return f'{self.id}_test'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['page', '-time_created'], name='test_page_created_idx'),
+            models.Index(fields=['page', 'time_completed'], name='test_page_completed_idx'),
+            models.Index(fields=['site', '-time_completed'], name='test_site_completed_idx'),
+            models.Index(fields=['time_created'], name='test_created_idx'),
+            models.Index(fields=['time_created'], condition=Q(time_completed=None), name='test_incomplete_idx'),
+            GinIndex(fields=['tags'], name='test_tags_gin'),
+        ]
+
 
 
 
@@ -564,6 +598,11 @@ class Case(models.Model):
     def __str__(self):
         return f'{self.title}' if self.title else str(id)
 
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(Upper('title'), name='gin_trgm_ops'), name='case_title_trgm'),
+        ]
+
 
 
 
@@ -583,6 +622,14 @@ class CaseRun(models.Model):
     def __str__(self):
         return f'{self.title}_caserun'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['site', '-time_completed'], name='caserun_site_completed_idx'),
+            models.Index(fields=['account', 'status'], name='caserun_account_status_idx'),
+            models.Index(fields=['account', '-time_created'], name='caserun_account_created_idx'),
+            models.Index(fields=['time_created'], name='caserun_created_idx'),
+        ]
+
 
 
 
@@ -622,6 +669,16 @@ class Issue(models.Model):
     def __str__(self):
         return f'{self.title if self.title is not None else self.id}_issue'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'status'], name='issue_account_status_idx'),
+            models.Index(fields=['account', '-time_created'], name='issue_account_created_idx'),
+            models.Index(F('account'), KeyTransform('id', 'affected'), name='issue_account_affected_idx'),
+            models.Index(fields=['time_created'], name='issue_created_idx'),
+            GinIndex(fields=['affected'], name='issue_affected_gin'),
+            GinIndex(OpClass(Upper('title'), name='gin_trgm_ops'), name='issue_title_trgm'),
+        ]
+
 
 
 
@@ -638,6 +695,11 @@ class Flow(models.Model):
     def __str__(self):
         return f'{self.title if self.title is not None else self.id}_flow'
 
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(Upper('title'), name='gin_trgm_ops'), name='flow_title_trgm'),
+        ]
+
 
 
 
@@ -659,6 +721,14 @@ class FlowRun(models.Model):
     def __str__(self):
         return f'{self.flow.title if self.flow.title is not None else self.id}_flowrun'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'status'], name='flowrun_account_status_idx'),
+            models.Index(fields=['account', '-time_created'], name='flowrun_account_created_idx'),
+            models.Index(fields=['time_created'], name='flowrun_created_idx'),
+            models.Index(fields=['time_created'], condition=Q(time_completed=None), name='flowrun_incomplete_idx'),
+        ]
+
 
 
 
@@ -686,6 +756,13 @@ class Schedule(models.Model):
     def __str__(self):
         return f'{self.account.name}_{self.task_type}'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'status'], name='schedule_account_status_idx'),
+            GinIndex(fields=['resources'], name='schedule_resources_gin'),
+            GinIndex(fields=['tags'], name='schedule_tags_gin'),
+        ]
+
 
 
 
@@ -748,6 +825,12 @@ class Process(models.Model):
     def __str__(self):
         return f'{self.id}_process'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', '-time_created'], name='process_account_created_idx'),
+            models.Index(fields=['time_created'], name='process_created_idx'),
+        ]
+
 
 
 
@@ -764,6 +847,12 @@ class Log(models.Model):
     def __str__(self):
         return f'{self.status}_{self.request_type}_{self.path}'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-time_created'], name='log_user_created_idx'),
+            models.Index(fields=['time_created'], name='log_created_idx'),
+        ]
+
 
 
 
@@ -776,3 +865,50 @@ class Coupon(models.Model):
 
     def __str__(self):
         return f'{self.code}'
+
+
+
+
+class Artifact(models.Model):
+    id = models.CharField(primary_key=True, max_length=64, editable=False)
+    time_created = models.DateTimeField(default=timezone.now, serialize=True)
+    time_updated = models.DateTimeField(default=timezone.now, serialize=True)
+    path = models.CharField(max_length=1000, serialize=True)
+    content_type = models.CharField(max_length=100, serialize=True, null=True, blank=True)
+    size = models.BigIntegerField(serialize=True, default=0)
+    stored_size = models.BigIntegerField(serialize=True, default=0)
+    refs = models.IntegerField(serialize=True, default=0)
+
+    def __str__(self):
+        return f'{self.id}_artifact'
+
+
+
+
+
+class TaskLease(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    time_created = models.DateTimeField(default=timezone.now, serialize=True)
+    resource_type = models.CharField(max_length=50, serialize=True)
+    resource_id = models.CharField(max_length=100, serialize=True)
+    component = models.CharField(max_length=50, serialize=True)
+    task_id = models.CharField(max_length=255, serialize=True, null=True, blank=True)
+    task_method = models.CharField(max_length=100, serialize=True)
+    kwargs = models.JSONField(serialize=True, null=True, blank=True)
+    attempts = models.IntegerField(serialize=True, default=0)
+    location = models.CharField(max_length=50, serialize=True, null=True, blank=True)
+    expires_at = models.DateTimeField(default=timezone.now, serialize=True)
+
+    def __str__(self):
+        return f'{self.resource_type}_{self.resource_id}_{self.component}_lease'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['resource_type', 'resource_id', 'component'], 
+                name='tasklease_resource_component_uniq'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['location', 'expires_at'], name='tasklease_location_expires_idx'),
+        ]
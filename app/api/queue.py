@@ -1,12 +1,13 @@
 from __future__ import annotations
 
-from celery import Task
+from celery import Task, current_app
 from celery.utils.log import get_task_logger
 from contextlib import contextmanager
 from django.apps import apps
+from django.core.cache import cache
 from redis import Redis
 from cursion import settings
-import time, random, secrets
+import time, secrets, json
 
 
 
@@ -51,61 +52,229 @@ def apply_async_in_queue(task, *, kwargs: dict, queue: str, task_id: str | None
     )
 
 
+# per account slots (held ZSET, scored by expiry) and ready 
+# lists of parked tasks. A task takes a slot if it already holds 
+# one (reserved by the dispatcher) or if one is free and nothing 
+# of the account is parked ahead of it
 _ACCT_SEMAPHORE_SCRIPT = redis_client.register_script(
     """
     local held_key = KEYS[1]
-    local pending_key = KEYS[2]
+    local ready_key = KEYS[2]
     local token = ARGV[1]
     local now_ms = tonumber(ARGV[2])
     local ttl_ms = tonumber(ARGV[3])
     local limit = tonumber(ARGV[4])
-    local pending_max_age_ms = tonumber(ARGV[5])
 
     redis.call('ZREMRANGEBYSCORE', held_key, '-inf', now_ms)
-    redis.call('ZREMRANGEBYSCORE', pending_key, '-inf', now_ms - pending_max_age_ms)
-
-    -- ensure token is in pending with enqueue time; don't overwrite if exists
-    if redis.call('ZSCORE', pending_key, token) == false then
-      redis.call('ZADD', pending_key, now_ms, token)
+    local waiting = tonumber(redis.call('LLEN', ready_key))
+
+    -- slot reserved for this token by the dispatcher
+    if redis.call('ZSCORE', held_key, token) == false then
+      if waiting > 0 then
+        return {0, waiting}
+      end
+      if tonumber(redis.call('ZCARD', held_key)) >= limit then
+        return {0, waiting}
+      end
     end
 
-    local rank = redis.call('ZRANK', pending_key, token)
-    if rank == false then
-      rank = 0
+    redis.call('ZADD', held_key, now_ms + ttl_ms, token)
+    redis.call('PEXPIRE', held_key, ttl_ms + 60000)
+    return {1, waiting}
+    """
+)
+
+
+# parks a task in its account's ready list & registers the 
+# account with the dispatcher at the current virtual time.
+# ready lists never expire (a parked task is only removed by
+# the dispatcher), the meta hash is dropped once it empties.
+# the task's resource is counted in the parked hash so the
+# lease sweeper leaves it alone (see `parked_resources()`)
+_PARK_SCRIPT = redis_client.register_script(
+    """
+    local ready_key = KEYS[1]
+    local meta_key = KEYS[2]
+    local accounts_key = KEYS[3]
+    local vtime_key = KEYS[4]
+    local parked_key = KEYS[5]
+    local item = ARGV[1]
+    local account_id = ARGV[2]
+    local limit = ARGV[3]
+    local weight = ARGV[4]
+    local resource = ARGV[5]
+    local front = ARGV[6]
+
+    if front == '1' then
+      redis.call('LPUSH', ready_key, item)
+    else
+      redis.call('RPUSH', ready_key, item)
+    end
+    if resource ~= '' then
+      redis.call('HINCRBY', parked_key, resource, 1)
     end
+    redis.call('HSET', meta_key, 'limit', limit, 'weight', weight)
+    if redis.call('ZSCORE', accounts_key, account_id) == false then
+      local vtime = tonumber(redis.call('GET', vtime_key) or '0')
+      redis.call('ZADD', accounts_key, vtime, account_id)
+    end
+    return tonumber(redis.call('LLEN', ready_key))
+    """
+)
+
+
+# releases the next parked task of one account if it has a free
+# slot, reserving the slot until the task starts, & advances the
+# account's virtual time by 1/weight. `dispatch_ready_tasks()`
+# calls it for the account with the lowest virtual time first
+# (weighted round-robin). Every key is passed in KEYS, so on a 
+# Redis Cluster the fair share keys must share one hash slot
+_DISPATCH_SCRIPT = redis_client.register_script(
+    """
+    local accounts_key = KEYS[1]
+    local vtime_key = KEYS[2]
+    local ready_key = KEYS[3]
+    local held_key = KEYS[4]
+    local meta_key = KEYS[5]
+    local parked_key = KEYS[6]
+    local account_id = ARGV[1]
+    local now_ms = tonumber(ARGV[2])
+    local reserve_ms = tonumber(ARGV[3])
 
-    -- FIFO gating: only the first `limit` pending tokens are eligible to run
-    if rank >= limit then
-      return {0, rank}
+    -- nothing parked
+    if tonumber(redis.call('LLEN', ready_key)) == 0 then
+      redis.call('ZREM', accounts_key, account_id)
+      redis.call('DEL', meta_key)
+      return {0}
     end
 
-    local count = tonumber(redis.call('ZCARD', held_key))
-    if count >= limit then
-      return {0, rank}
+    -- no free slot
+    redis.call('ZREMRANGEBYSCORE', held_key, '-inf', now_ms)
+    local limit = tonumber(redis.call('HGET', meta_key, 'limit') or '2')
+    if tonumber(redis.call('ZCARD', held_key)) >= limit then
+      return {1}
     end
 
-    redis.call('ZREM', pending_key, token)
-    redis.call('ZADD', held_key, now_ms + ttl_ms, token)
-    redis.call('PEXPIRE', held_key, ttl_ms + 60000)
-    redis.call('PEXPIRE', pending_key, pending_max_age_ms + 60000)
-    return {1, rank}
+    local score = redis.call('ZSCORE', accounts_key, account_id)
+    if score == false then
+      score = redis.call('GET', vtime_key) or '0'
+    end
+    score = tonumber(score)
+
+    local item = redis.call('LPOP', ready_key)
+    local decoded = cjson.decode(item)
+    local token = decoded['task_id']
+    local resource = decoded['resource']
+    if type(resource) == 'string' and resource ~= '' then
+      if tonumber(redis.call('HINCRBY', parked_key, resource, -1)) <= 0 then
+        redis.call('HDEL', parked_key, resource)
+      end
+    end
+    redis.call('ZADD', held_key, now_ms + reserve_ms, token)
+    redis.call('PEXPIRE', held_key, reserve_ms + 60000)
+
+    local weight = tonumber(redis.call('HGET', meta_key, 'weight') or '1')
+    if tonumber(redis.call('LLEN', ready_key)) == 0 then
+      redis.call('ZREM', accounts_key, account_id)
+      redis.call('DEL', meta_key)
+    else
+      redis.call('ZADD', accounts_key, score + (1 / math.max(weight, 1)), account_id)
+    end
+    redis.call('SET', vtime_key, score)
+    return {2, item}
     """
 )
 
 
+_FAIR_SHARE_PREFIX = 'semaphore:account:'
+_FAIR_SHARE_ACCOUNTS = 'fairshare:accounts'
+_FAIR_SHARE_VTIME = 'fairshare:vtime'
+_FAIR_SHARE_PARKED = 'fairshare:parked'
+
+
 def _account_semaphore_key(account_id: str) -> str:
-    return f"semaphore:account:{account_id}:held"
+    return f"{_FAIR_SHARE_PREFIX}{account_id}:held"
 
 
-def _account_pending_key(account_id: str) -> str:
-    return f"semaphore:account:{account_id}:pending"
+def _account_ready_key(account_id: str) -> str:
+    return f"{_FAIR_SHARE_PREFIX}{account_id}:ready"
 
 
-def _get_account_concurrency_limit(account_id: str) -> int:
+def _account_meta_key(account_id: str) -> str:
+    return f"{_FAIR_SHARE_PREFIX}{account_id}:meta"
+
+
+def _account_limits_key(account_id: str) -> str:
+    return f"account_cache:limits:{account_id}"
+
+
+def _account_lookup_key(resource_type: str, resource_id: str) -> str:
+    return f"account_cache:{resource_type}:{resource_id}"
+
+
+def _cache_get(key: str):
     try:
+        return cache.get(key)
+    except Exception:
+        return None
+
+
+def _cache_set(key: str, value, ttl: int) -> None:
+    try:
+        cache.set(key, value, ttl)
+    except Exception:
+        pass
+
+
+def get_account_limits(account_id: str) -> dict | None:
+    """
+    Cached snapshot of the account's plan: {'type', 'usage', 
+    'admin'}. Kept for ACCOUNT_CACHE_TTL and dropped whenever 
+    the `Account` is saved or deleted (see `invalidate_account`), 
+    so concurrency gating & usage checks don't hit the db.
+    """
+    key = _account_limits_key(account_id)
+    data = _cache_get(key)
+    if data is None:
         Account = apps.get_model('api', 'Account')
-        account = Account.objects.get(id=account_id)
-        return int((account.usage or {}).get('concurrency', 2))
+        account = Account.objects.select_related('user').filter(id=account_id).first()
+        if account is None:
+            return None
+        data = {
+            'type': account.type,
+            'usage': account.usage or {},
+            'admin': account.user.username == 'admin',
+        }
+        _cache_set(key, data, settings.ACCOUNT_CACHE_TTL)
+    return data
+
+
+def invalidate_account(account_id: str) -> None:
+    try:
+        cache.delete(_account_limits_key(account_id))
+    except Exception:
+        pass
+
+
+def _cached_account_id(resource_type: str, resource_id: str, lookup) -> str | None:
+    # resources never change accounts, so only a TTL applies
+    key = _account_lookup_key(resource_type, resource_id)
+    account_id = _cache_get(key)
+    if account_id is None:
+        try:
+            account_id = lookup()
+        except Exception:
+            account_id = None
+        if account_id is None:
+            return None
+        account_id = str(account_id)
+        _cache_set(key, account_id, settings.ACCOUNT_LOOKUP_TTL)
+    return account_id
+
+
+def _get_account_concurrency_limit(account_id: str) -> int:
+    try:
+        return int((get_account_limits(account_id) or {}).get('usage', {}).get('concurrency', 2))
     except Exception:
         return 2
 
@@ -120,12 +289,10 @@ def account_concurrency_slot(self_task, *, account_id: str, ttl_seconds: int = 2
     token = str(getattr(self_task.request, 'id', None) or secrets.token_hex(16))
     now_ms      = int(time.time() * 1000)
     ttl_ms      = int(ttl_seconds * 1000)
-    pending_max_age_ms = int(6 * 60 * 60 * 1000)
     held_key = _account_semaphore_key(account_id)
-    pending_key = _account_pending_key(account_id)
     result = _ACCT_SEMAPHORE_SCRIPT(
-        keys=[held_key, pending_key],
-        args=[token, now_ms, ttl_ms, limit, pending_max_age_ms],
+        keys=[held_key, _account_ready_key(account_id)],
+        args=[token, now_ms, ttl_ms, limit],
     )
     acquired = bool(result and int(result[0]) == 1)
     rank = int(result[1]) if result and len(result) > 1 else 0
@@ -137,71 +304,200 @@ def account_concurrency_slot(self_task, *, account_id: str, ttl_seconds: int = 2
                 redis_client.zrem(held_key, token)
             except Exception:
                 pass
+            # hand the freed slot to the next parked task
+            dispatch_ready_tasks()
 
 
-def _reschedule_due_to_concurrency(self_task, *, rank: int) -> None:
-    base            = 2.0
-    per_position    = 4.0
-    max_wait        = 240.0
-    jitter          = random.uniform(0.5, 2.5)
-    countdown       = min(max_wait, base + (max(0, int(rank)) * per_position) + jitter)
-
+def park_task(self_task, *, account_id: str) -> None:
+    """
+    Parks a task which could not get an account slot in the 
+    account's ready list instead of re-publishing it with a 
+    countdown. `dispatch_ready_tasks()` publishes it again 
+    (same task_id & kwargs) once the account has a free slot
+    & gives its leases the queue expiry again. While parked 
+    the resource's expired leases are not redelivered.
+    """
+    limit           = _get_account_concurrency_limit(account_id)
     delivery_info   = getattr(self_task.request, 'delivery_info', {}) or {}
     queue           = delivery_info.get('routing_key') or getattr(settings, 'CELERY_TASK_DEFAULT_QUEUE', CELERY_QUEUE_SCHEDULED)
     kwargs          = getattr(self_task.request, 'kwargs', {}) or {}
-
-    self_task.apply_async(
-        kwargs=kwargs,
-        countdown=countdown,
-        queue=queue,
-        routing_key=queue,
-        task_id=str(getattr(self_task.request, 'id', '') or secrets.token_hex(16)),
+    item = json.dumps({
+        'task': self_task.name,
+        'task_id': str(getattr(self_task.request, 'id', '') or secrets.token_hex(16)),
+        'kwargs': kwargs,
+        'queue': queue,
+        'resource': _parked_resource(self_task.name, kwargs),
+    })
+    waiting = _park(item, account_id, limit)
+    logger.info(f'parked task for account {account_id} ({waiting} waiting)')
+
+    # a slot may have been freed while parking
+    dispatch_ready_tasks()
+
+
+def _parked_resource(task_name: str, kwargs: dict) -> str:
+    # 'scan:<id>' or 'test:<id>', matching the resource's TaskLeases
+    if str(task_name).endswith('run_test') and kwargs.get('test_id'):
+        return f"test:{kwargs['test_id']}"
+    if kwargs.get('scan_id'):
+        return f"scan:{kwargs['scan_id']}"
+    return ''
+
+
+def _park(item: str, account_id: str, limit: int, front: bool = False) -> int:
+    return _PARK_SCRIPT(
+        keys=[
+            _account_ready_key(account_id), _account_meta_key(account_id),
+            _FAIR_SHARE_ACCOUNTS, _FAIR_SHARE_VTIME, _FAIR_SHARE_PARKED,
+        ],
+        args=[
+            item, str(account_id), max(limit, 1), max(limit, 1),
+            json.loads(item).get('resource') or '', '1' if front else '0',
+        ],
     )
 
 
-def _get_account_id_from_scan_id(scan_id: str) -> str | None:
+def parked_resources(resources: list) -> set:
+    """
+    Returns the resources ('scan:<id>', 'test:<id>') of `resources` 
+    with a task parked in a ready list. Their TaskLeases may expire
+    while parked, so `redeliver_failed_tasks` skips them.
+    """
+    resources = list(resources or [])
+    if not resources:
+        return set()
     try:
-        Scan = apps.get_model('api', 'Scan')
-        scan = Scan.objects.select_related('page', 'page__account').get(id=scan_id)
-        return str(scan.page.account.id) if scan.page and scan.page.account else None
-    except Exception:
+        counts = redis_client.hmget(_FAIR_SHARE_PARKED, resources)
+    except Exception as e:
+        logger.info(f'parked lookup failed -> {e}')
+        return set()
+    return {r for r, c in zip(resources, counts) if c is not None and int(c) > 0}
+
+
+def _resume_leases(resource: str) -> None:
+    # a dispatched task waits in the queue again, give 
+    # its resource's leases the queue expiry
+    if not resource:
         return None
+    try:
+        from .utils.leases import extend_leases
+        resource_type, resource_id = resource.split(':', 1)
+        extend_leases(resource_type, resource_id, seconds=settings.TASK_LEASE_QUEUE_TTL)
+    except Exception as e:
+        logger.info(f'lease resume failed for {resource} -> {e}')
+    return None
 
 
-def _get_account_id_from_test_id(test_id: str) -> str | None:
+def dispatch_ready_tasks(max_items: int | None = None) -> int:
+    """
+    Publishes parked tasks for accounts with free slots, in 
+    weighted round-robin order across accounts (weighted by 
+    each account's concurrency). Called whenever a slot is 
+    released and periodically as a safety net for slots that 
+    expired without a release.
+    """
+    max_items = int(max_items or settings.FAIR_SHARE_DISPATCH_BATCH)
+    items = []
+    full = set()
     try:
-        Test = apps.get_model('api', 'Test')
-        test = Test.objects.select_related('page', 'page__account').get(id=test_id)
-        return str(test.page.account.id) if test.page and test.page.account else None
-    except Exception:
-        return None
+        while len(items) < max_items:
+            # accounts by virtual time, lowest first
+            released = None
+            for account_id in redis_client.zrange(_FAIR_SHARE_ACCOUNTS, 0, -1):
+                account_id = account_id.decode() if isinstance(account_id, bytes) else account_id
+                if account_id in full:
+                    continue
+                result = _DISPATCH_SCRIPT(
+                    keys=[
+                        _FAIR_SHARE_ACCOUNTS, _FAIR_SHARE_VTIME,
+                        _account_ready_key(account_id), _account_semaphore_key(account_id),
+                        _account_meta_key(account_id), _FAIR_SHARE_PARKED,
+                    ],
+                    args=[
+                        account_id, int(time.time() * 1000),
+                        int(settings.FAIR_SHARE_RESERVE_TTL * 1000),
+                    ],
+                )
+                if result and int(result[0]) == 2:
+                    released = result[1]
+                    break
+                if result and int(result[0]) == 1:
+                    full.add(account_id)
+            if released is None:
+                break
+            items.append(released)
+    except Exception as e:
+        logger.info(f'fair share dispatch failed -> {e}')
+
+    for raw in items:
+        item = json.loads(raw)
+        try:
+            current_app.send_task(
+                item['task'],
+                kwargs=item['kwargs'],
+                queue=item['queue'],
+                routing_key=item['queue'],
+                task_id=item['task_id'],
+            )
+            _resume_leases(item.get('resource'))
+        except Exception as e:
+            # put it back at the front of the line
+            logger.info(f'fair share publish failed -> {e}')
+            account_id = _get_account_id_from_kwargs(item['kwargs'])
+            if account_id:
+                _park(
+                    raw.decode() if isinstance(raw, bytes) else raw, 
+                    account_id, _get_account_concurrency_limit(account_id), front=True
+                )
+    return len(items)
+
+
+def _get_account_id_from_kwargs(kwargs: dict) -> str | None:
+    # resolve the account of a parked task from its kwargs
+    if kwargs.get('scan_id'):
+        return _get_account_id_from_scan_id(str(kwargs['scan_id']))
+    if kwargs.get('test_id'):
+        return _get_account_id_from_test_id(str(kwargs['test_id']))
+    if kwargs.get('caserun_id'):
+        return _get_account_id_from_caserun_id(str(kwargs['caserun_id']))
+    if kwargs.get('site_id'):
+        return _get_account_id_from_site_id(str(kwargs['site_id']))
+    return None
+
+
+def _get_account_id_from_scan_id(scan_id: str) -> str | None:
+    Scan = apps.get_model('api', 'Scan')
+    return _cached_account_id('scan', scan_id, lambda: (
+        Scan.objects.filter(id=scan_id).values_list('page__account_id', flat=True).first()
+    ))
+
+
+def _get_account_id_from_test_id(test_id: str) -> str | None:
+    Test = apps.get_model('api', 'Test')
+    return _cached_account_id('test', test_id, lambda: (
+        Test.objects.filter(id=test_id).values_list('page__account_id', flat=True).first()
+    ))
 
 
 def _get_account_id_from_caserun_id(caserun_id: str) -> str | None:
-    try:
-        CaseRun = apps.get_model('api', 'CaseRun')
-        caserun = CaseRun.objects.select_related('account').get(id=caserun_id)
-        return str(caserun.account.id) if caserun.account else None
-    except Exception:
-        return None
+    CaseRun = apps.get_model('api', 'CaseRun')
+    return _cached_account_id('caserun', caserun_id, lambda: (
+        CaseRun.objects.filter(id=caserun_id).values_list('account_id', flat=True).first()
+    ))
 
 
 def _get_account_id_from_page_id(page_id: str) -> str | None:
-    try:
-        Page = apps.get_model('api', 'Page')
-        page = Page.objects.select_related('account').get(id=page_id)
-        return str(page.account.id) if page.account else None
-    except Exception:
-        return None
+    Page = apps.get_model('api', 'Page')
+    return _cached_account_id('page', page_id, lambda: (
+        Page.objects.filter(id=page_id).values_list('account_id', flat=True).first()
+    ))
 
 
 def _get_account_id_from_site_id(site_id: str) -> str | None:
-    try:
-        Site = apps.get_model('api', 'Site')
-        site = Site.objects.select_related('account').get(id=site_id)
-        return str(site.account.id) if site.account else None
-    except Exception:
-        return None
+    Site = apps.get_model('api', 'Site')
+    return _cached_account_id('site', site_id, lambda: (
+        Site.objects.filter(id=site_id).values_list('account_id', flat=True).first()
+    ))
 
 
 
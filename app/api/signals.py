@@ -1,9 +1,10 @@
 import threading
-from django.db.models.signals import post_save
-from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_migrate
+from django.db import transaction, connections
 from django.dispatch import receiver
 from .utils.flowr import Flowr
 from .utils.agent import Agent
+from .queue import invalidate_account
 from .tasks import case_pre_run_bg
 from .models import *
 from cursion import settings
@@ -13,6 +14,39 @@ from cursion import settings
 
 
 
+@receiver(pre_migrate)
+def create_extensions(sender, app_config, using, **kwargs):
+
+    # the trigram search indexes (gin_trgm_ops) 
+    # need pg_trgm before api migrations run
+    if app_config.label != 'api':
+        return None
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    
+    # return None
+    return None
+
+
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def account_changed(sender, instance, **kwargs):
+
+    # drop the cached plan used by 
+    # the queue layer & usage checks
+    invalidate_account(str(instance.id))
+
+    # return None
+    return None
+
+
+
+
 @receiver(post_save, sender=FlowRun)
 def flowrun_created(sender, instance, created, **kwargs):
     
@@ -99,6 +133,3 @@ def chat_updated(sender, instance, created, **kwargs):
     
     # return None
     return None
-
-
-
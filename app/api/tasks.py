@@ -1,6 +1,5 @@
 from celery.utils.log import get_task_logger
 from celery import shared_task
-from cursion import celery
 from .utils.crawler import Crawler
 from .utils.scanner import Scanner as S
 from .utils.tester import Tester as T
@@ -11,31 +10,37 @@ from .utils.autocaser import AutoCaser
 from .utils.issuer import Issuer
 from .utils.exporter import create_and_send_report_export
 from .utils.scanner import (
-    _html_and_logs, _vrt, _lighthouse, _security
+    _html_and_logs, _vrt, _lighthouse, _security,
+    _browser, get_browser_components
 )
 from .utils.alerts import *
 from .utils.updater import update_flowrun
-from .utils.meter import meter_account
+from .utils.meter import meter_account, flush_meter_events as flush_meter
+from .utils.usage import has_allowance, increment_usage, reset_usage as reset_counters
 from .utils.manager import record_task
+from .utils.leases import lease_heartbeat, is_finished, seed_leases
+from .utils.retention import delete_expired, drop_expired_partitions
+from .utils.storage import (
+    delete_prefixes, release_scan_artifacts,
+    delete_orphaned_artifacts as delete_orphaned
+)
 from .queue import (
-    BaseTaskWithRetry, redis_client, 
-    CELERY_QUEUE_SCHEDULED, CELERY_QUEUE_ON_DEMAND,
-    account_concurrency_slot, _always_acquired, 
-    _reschedule_due_to_concurrency, task_lock, 
+    BaseTaskWithRetry, account_concurrency_slot, _always_acquired, 
+    park_task, dispatch_ready_tasks as dispatch_ready, task_lock, 
     _get_account_id_from_scan_id, _get_account_id_from_test_id,
     _get_account_id_from_caserun_id, get_task_queue, 
-    apply_async_in_queue,
+    apply_async_in_queue, get_account_limits, parked_resources,
     _get_account_id_from_site_id
 )
 from .models import *
 from functools import reduce
-from django.db.models import Q
+from django.db.models import Q, F
+from django.db import transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import datetime, timedelta, timezone as tz
-from kombu.utils.encoding import bytes_to_str
 from cursion import settings
-import boto3, time, requests, operator, \
+import time, requests, operator, \
 json, stripe, inspect, random, secrets 
 
 
@@ -72,24 +77,12 @@ def _flow_obj(
     }
 
 
-# setting s3 instance
-def s3():
-    s3 = boto3.resource('s3', 
-        aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-        aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-        region_name=str(settings.AWS_S3_REGION_NAME), 
-        endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
-    )
-    return s3
-
-
-
-
 def check_and_increment_resource(account_id: str, resource: str) -> bool:
     """ 
     Adds 1 to the Account.usage.{resource} if 
     {resource}_allowed has not been reached or 
-    if account.type is 'cloud'.
+    if account.type is 'cloud'. Counters are updated 
+    atomically (see `utils.usage`).
 
     Args:
         'account_id'  : <str>,
@@ -99,53 +92,41 @@ def check_and_increment_resource(account_id: str, resource: str) -> bool:
         bool, True if resource was incremented.
     """
 
-    # get account
-    account = Account.objects.get(id=account_id)
-
     # define defaults
     success = False
     charge_list = ['caseruns', 'scans', 'tests']
     cloud_types = ['cloud', 'team', 'business']
 
+    # get account plan (cached)
+    plan = get_account_limits(str(account_id))
+    if plan is None:
+        raise Account.DoesNotExist(f'account {account_id} not found')
+
     # handle non-paid, cloud accounts
-    if account.type not in cloud_types:
+    if plan['type'] not in cloud_types:
 
-        # check allowance
-        if (int(account.usage[f'{resource}']) + 1) <= int(account.usage[f'{resource}_allowed']):
-            
-            # increment and update success
-            account.usage[f'{resource}'] = 1 + int(account.usage[f'{resource}'])
-            account.save()
-            success = True
+        # check allowance & increment
+        if has_allowance(account_id, resource):
+            success = increment_usage(account_id, resource, limit=True) is not None
     
     # handle paid, cloud accounts
-    if account.type in cloud_types:
+    if plan['type'] in cloud_types:
 
         # increment chargable resources
         if resource in charge_list:
+            usage = increment_usage(account_id, resource)
 
-            # check chargablility
-            if (int(account.usage[f'{resource}'])) >= int(account.usage[f'{resource}_allowed']):
-
-                # meter resource
-                meter_account(account.id, 1)
-            
-            # increment and update success
-            account.usage[f'{resource}'] = 1 + int(account.usage[f'{resource}'])
-            account.save()
-            success = True
+            # meter resource if over allowance
+            if usage and usage['value'] > usage['allowed']:
+                meter_account(str(account_id), 1)
+            success = usage is not None
 
-        
         # increment non-chargable resources
         if resource not in charge_list:
             
-            # check allowance
-            if (int(account.usage[f'{resource}']) + 1) <= int(account.usage[f'{resource}_allowed']):
-                
-                # increment and update success
-                account.usage[f'{resource}'] = 1 + int(account.usage[f'{resource}'])
-                account.save()
-                success = True
+            # check allowance & increment
+            if has_allowance(account_id, resource):
+                success = increment_usage(account_id, resource, limit=True) is not None
 
     # return response
     return success
@@ -197,6 +178,32 @@ def update_schedule(task_id: str=None) -> None:
 
 
 
+def get_shared_browser_components(scan_type: list=[]) -> list:
+    """
+    Helper function to decide which `Scan` components should
+    run together in a single browser session via `run_browser_bg`.
+
+    Args:
+        'scan_type': list
+    
+    Returns:
+        list of components (empty if each should run separately)
+    """
+
+    # check settings
+    if not settings.SCAN_SINGLE_BROWSER:
+        return []
+
+    # only combine when more than one component needs a browser
+    components = get_browser_components(scan_type)
+    if len(components) < 2:
+        return []
+
+    return components
+
+
+
+
 def add_scan_system_data(scan: object=None, kwargs: dict={}) -> dict:
     """
     Helper function to build system for passed `Scan`.
@@ -208,13 +215,17 @@ def add_scan_system_data(scan: object=None, kwargs: dict={}) -> dict:
         `Scan`
     """
 
+    # components sharing one browser session
+    shared = get_shared_browser_components(scan.type)
+
     # build system data
     system = {
         "tasks": [
             {
                 "kwargs": kwargs,
                 "task_id": (
-                    f"lock:html_and_logs_bg_{scan.id}" if t == 'html'
+                    f"lock:browser_bg_{scan.id}" if t in shared
+                    else f"lock:html_and_logs_bg_{scan.id}" if t == 'html'
                     else (f"lock:vrt_bg_{scan.id}" if t == 'images' else f"lock:{t}_bg_{scan.id}")
                 ),
                 "attempts": 0,
@@ -231,6 +242,9 @@ def add_scan_system_data(scan: object=None, kwargs: dict={}) -> dict:
     # save to scan
     scan.system = system
     scan.save()
+
+    # lease each component until its task records itself
+    seed_leases(scan, 'scan')
     return scan
 
 
@@ -261,15 +275,143 @@ def call_local_task_by_name(
 
 
 
+def _complete_stale_scan(scan: object=None, kwargs: dict=None) -> None:
+    """ 
+    Marks a `Scan` whose component tasks are all finished 
+    or out of attempts as complete, then updates its Site 
+    & Page and queues `run_test()` for any pending `Test`.
+
+    Args:
+        'scan'      : `Scan` <obj>,
+        'kwargs'    : dict, saved task kwargs
+
+    Returns: None
+    """
+
+    # claim completion (a component may be finishing it)
+    claimed = Scan.objects.filter(id=scan.id, time_completed=None).update(
+        time_completed=timezone.now()
+    )
+    if not claimed:
+        return None
+
+    logger.info(f'marking scan as complete')
+    kwargs      = kwargs or {}
+    test_id     = kwargs.get('test_id')
+    track_id    = kwargs.get('track_id')
+    queue       = get_task_queue(kwargs=kwargs)
+
+    # try to get test_id
+    if not test_id or test_id == 'None':
+        test = Test.objects.filter(post_scan=scan, time_completed=None).first()
+        test_id = test.id if test else None
+
+    # update site and page with most recent data
+    update_site_and_page_info(
+        resource='scan',
+        page_id=str(scan.page_id)
+    )
+
+    # execute `run_test()` if test_id present
+    if test_id:
+        logger.info(f'executing run_test() from `post_scan` in `retry_tasks`')
+
+        # preserve object identity for FlowRun merging
+        if track_id is None:
+            try:
+                _test = Test.objects.get(id=test_id)
+                _task_kwargs = (((_test.system or {}).get('tasks') or [{}])[0].get('kwargs') or {})
+                track_id = _task_kwargs.get('track_id') or str(test_id)
+            except Exception:
+                track_id = str(test_id)
+
+        # lease the Test while run_test waits in the queue
+        _test = Test.objects.filter(id=test_id).first()
+        if _test is not None:
+            seed_leases(_test, 'test')
+
+        apply_async_in_queue(
+            run_test,
+            kwargs={
+                'test_id': str(test_id),
+                'alert_id': kwargs.get('alert_id'),
+                'flowrun_id': kwargs.get('flowrun_id'),
+                'node_index': kwargs.get('node_index'),
+                'track_id': track_id,
+                '_queue': queue,
+            },
+            queue=queue,
+            task_id=f'lock:run_test_{test_id}',
+        )
+
+    return None
+
+
+
+
+def _mark_test_incomplete(test: object=None) -> None:
+    """ 
+    Marks a `Test` whose `run_test()` is out of 
+    attempts as 'incomplete' and updates its 
+    Site, Page & FlowRun.
+
+    Args:
+        'test' : `Test` <obj>
+
+    Returns: None
+    """
+
+    # claim completion
+    claimed = Test.objects.filter(id=test.id, time_completed=None).update(
+        time_completed=timezone.now(),
+        status='incomplete'
+    )
+    if not claimed:
+        return None
+
+    # update site and page with most recent data
+    update_site_and_page_info(
+        resource='test',
+        page_id=str(test.page.id)
+    )
+
+    # get flowrun info
+    first_task  = ((test.system or {}).get('tasks') or [{}])[0]
+    kwargs      = first_task.get('kwargs') or {}
+    flowrun_id  = kwargs.get('flowrun_id')
+    node_index  = kwargs.get('node_index')
+    track_id    = kwargs.get('track_id') or str(test.id)
+    
+    # update FlowRun if present
+    if flowrun_id and flowrun_id != 'None':
+        update_flowrun(**{
+            'flowrun_id': str(flowrun_id),
+            'node_index': node_index,
+            'message': (
+                f'test for {test.page.page_url} completed with status: '+
+                f'⏺️ INCOMPLETE | test_id: {str(test.id)}'
+            ),
+            'objects': [_flow_obj(
+                parent=str(test.page.id),
+                obj_id=str(test.id),
+                source_id=str(test.id),
+                track_id=track_id,
+                status='incomplete'
+            )]
+        })
+
+    return None
+
+
+
+
 @shared_task()
-def redeliver_failed_tasks() -> None:
+def dispatch_ready_tasks() -> None:
     """ 
-    Check each un-completed resource (Scans & Tests) 
-    for any celery tasks which are no longer executing & 
-    associated resource.component is null. Once found, 
-    re-run those specific tasks with saved kwargs. If 
-    resource appears complete but is not marked as such, 
-    update `.time_completed` with `timezone.now()`
+    Publishes parked tasks of accounts with free 
+    concurrency slots. Slots are normally handed over 
+    on release; this catches slots that expired 
+    (e.g. a lost worker) without one.
 
     Args:
         None
@@ -277,239 +419,136 @@ def redeliver_failed_tasks() -> None:
     Returns:
         None
     """
+    dispatched = dispatch_ready()
+    logger.info(f'dispatched {dispatched} parked tasks')
+    return None
 
-    # get uncompleted Scans & Tests
-    scans       = Scan.objects.filter(time_completed=None)
-    tests       = Test.objects.filter(time_completed=None).exclude(post_scan__time_completed=None)
-    flowruns    = FlowRun.objects.filter(time_completed=None)
-    types       = ['html_and_logs_bg', 'lighthouse_bg', 'vrt_bg', 'security_bg']
-
-    # inspect Celery workers
-    i = celery.app.control.inspect()
-
-    # fetch active, reserved, scheduled (ETA), & queues tasks
-    reserved    = i.reserved() or {}
-    active      = i.active() or {}
-    scheduled   = i.scheduled() or {}
-    broker_queues = list(
-        {
-            'celery',
-            CELERY_QUEUE_SCHEDULED,
-            CELERY_QUEUE_ON_DEMAND,
-            getattr(settings, 'CELERY_TASK_DEFAULT_QUEUE', CELERY_QUEUE_SCHEDULED),
-        }
-    )
-    queued = []
-    for q in broker_queues:
-        try:
-            queued += redis_client.lrange(str(q), 0, -1)
-        except Exception:
-            continue
-    all_tasks   = []
-
-    # gather task IDs from reserved queue
-    for replica, tasks in reserved.items():
-        for task in tasks:
-            all_tasks.append(task['id'])
-
-    # gather task IDs from active tasks
-    for replica, tasks in active.items():
-        for task in tasks:
-            all_tasks.append(task['id'])
-
-    # gather task IDs from scheduled/ETA tasks
-    for replica, tasks in scheduled.items():
-        for task in tasks:
-            req = task.get('request') or {}
-            if req.get('id'):
-                all_tasks.append(req['id'])
-
-    # gather redis_ids from queued tasks
-    for item in queued:
-        try:
-            decoded = json.loads(bytes_to_str(item))
-            all_tasks.append(decoded['headers']['id'])
-        except Exception as e:
-            print(f"Failed to decode task: {e}")
-
-    # iterate through each scan and re-run 
-    # any failed, non-pending jobs
-    for scan in scans:
-
-        # check for localization
-        if scan.configs.get('location', 'us') != settings.LOCATION:
-            continue
-
-        # check each task in system['tasks']
-        retried_tasks   = 0
-        pending_tasks   = 0 
-        test_id         = None
-        alert_id        = None
-        flowrun_id      = None
-        node_index      = None
-        track_id        = None
-        queue           = None
-        components      = []
-        for task in (scan.system or {}).get('tasks', []):
-
-            # get task_id
-            task_id = task.get('task_id')
-
-            # get scan.{component} data
-            if task['component'] == 'lighthouse':
-                component = scan.lighthouse.get('audits', None)
-            if task['component'] in ['images', 'vrt']:
-                component = scan.images
-            if task['component'] == 'html':
-                component = scan.html
-            if task['component'] == 'security':
-                component = scan.security.get('audits', None)
-            
-            # record components
-            components.append(task['component'])
-
-            # try to get args
-            test_id     = task['kwargs'].get('test_id')     or test_id
-            alert_id    = task['kwargs'].get('alert_id')    or alert_id
-            flowrun_id  = task['kwargs'].get('flowrun_id')  or flowrun_id
-            node_index  = task['kwargs'].get('node_index')  or node_index 
-            track_id    = task['kwargs'].get('track_id')    or track_id
-            queue = get_task_queue(kwargs=task.get('kwargs') or {}) or queue
-            
-            # re-run task if task is not "running", "pending", 
-            # or reached "max_attempts".
-            if component is None:
-
-                # check if task is "pending" (has task_id in queue)
-                if task_id in all_tasks:
-                    pending_tasks += 1
-
-                # check for max attempts
-                elif task.get('attempts', 0) < settings.MAX_ATTEMPTS:
-                    task_id = f"lock:{task['task_method'].replace('run_', '')}_{scan.id}"
-                    call_local_task_by_name(task["task_method"], task["kwargs"], task_id)
-                    retried_tasks += 1
-
-        # try to get test_id
-        if not test_id and Test.objects.filter(post_scan=scan, time_completed=None).exists():
-            test_id = Test.objects.filter(post_scan=scan, time_completed=None)[0].id
-        
-        # mark scan complete if checks pass
-        if retried_tasks == 0 and pending_tasks == 0:
-            logger.info(f'marking scan as complete')
-            scan.time_completed = timezone.now()
-            scan.save()
-
-            # update site and page with most recent data
-            update_site_and_page_info(
-                resource='scan',
-                page_id=str(scan.page.id)
-            )
 
-            # execute `run_test()` if test_id present
-            if test_id:
-                logger.info(f'executing run_test() from `post_scan` in `retry_tasks`')
-                queue = queue or get_task_queue(kwargs={'_queue': None})
 
-                # preserve object identity for FlowRun merging
-                if track_id is None:
-                    try:
-                        _test = Test.objects.get(id=test_id)
-                        _task_kwargs = (((_test.system or {}).get('tasks') or [{}])[0].get('kwargs') or {})
-                        track_id = _task_kwargs.get('track_id') or str(test_id)
-                    except Exception:
-                        track_id = str(test_id)
 
-                apply_async_in_queue(
-                    run_test,
-                    kwargs={
-                        'test_id': str(test_id),
-                        'alert_id': alert_id,
-                        'flowrun_id': flowrun_id,
-                        'node_index': node_index,
-                        'track_id': track_id,
-                        '_queue': queue,
-                    },
-                    queue=queue,
-                    task_id=f'lock:run_test_{test_id}',
-                )
-        
-    # iterate through each test and re-run if failed
-    for test in tests:
+@shared_task()
+def redeliver_failed_tasks() -> None:
+    """ 
+    Check the expired `TaskLeases` of this location, 
+    i.e. Scan & Test tasks whose worker stopped renewing 
+    them. Leases of finished components are released, 
+    unfinished components are re-run with their saved 
+    kwargs until MAX_ATTEMPTS (unless parked for a fair 
+    share slot, see `park_task`). Scans left without leases 
+    are marked complete (queuing any pending `Test`) and 
+    Tests out of attempts are marked 'incomplete'.
+
+    Only expired leases are read (at most 
+    TASK_LEASE_SWEEP_LIMIT per run, through the 
+    location/expires_at index), so the cost does not 
+    depend on queue lengths or in-flight resources.
 
-        # check for localization
-        if test.post_scan.configs.get('location', 'us') != settings.LOCATION:
-            continue
+    Args:
+        None
+    
+    Returns:
+        None
+    """
 
-        # check each task in system['tasks']
-        retried_tasks = 0
-        pending_tasks = 0
-        for task in (test.system or {}).get('tasks', []):
+    # get expired leases
+    now = timezone.now()
+    leases = list(
+        TaskLease.objects.filter(location=settings.LOCATION, expires_at__lte=now)
+        .order_by('expires_at')[:settings.TASK_LEASE_SWEEP_LIMIT]
+    )
+    if not leases:
+        return None
 
-            # define task_id
-            task_id = task.get('task_id') 
+    # load leased Scans & Tests in bulk
+    scans = {
+        str(k): v for k, v in Scan.objects.in_bulk(
+            [l.resource_id for l in leases if l.resource_type == 'scan']
+        ).items()
+    }
+    tests = {
+        str(k): v for k, v in Test.objects.select_related('page').in_bulk(
+            [l.resource_id for l in leases if l.resource_type == 'test']
+        ).items()
+    }
 
-            # check if task is "pending" (has task_id in queue)
-            if task_id in all_tasks:
-                pending_tasks += 1
+    # post_scans still running (live leases)
+    running_scans = set(
+        TaskLease.objects.filter(
+            resource_type='scan', 
+            resource_id__in={str(t.post_scan_id) for t in tests.values() if t.post_scan_id},
+            expires_at__gt=now
+        ).values_list('resource_id', flat=True)
+    )
 
-            # check for post_scan related task_ids in all_tasks
-            elif any(f'lock:{t}_{test.post_scan.id}' in all_tasks for t in types):
-                pending_tasks += 1
-            
-            # check for max attempts
-            elif task.get('attempts', 0) < settings.MAX_ATTEMPTS:
-                task_id = f'lock:run_test_{test.id}'
-                call_local_task_by_name(task["task_method"], task["kwargs"], task_id)
-                retried_tasks += 1
-        
-        # mark test incomplete if checks pass
-        if retried_tasks == 0 and pending_tasks == 0:
-            test.time_completed = timezone.now()
-            test.status         = 'incomplete'
-            test.save()
-
-            # update site and page with most recent data
-            update_site_and_page_info(
-                resource='test',
-                page_id=str(test.page.id)
-            )
+    # resources with a task parked for a fair share slot
+    parked = parked_resources({f'{l.resource_type}:{l.resource_id}' for l in leases})
+
+    released    = []
+    retried     = []
+    waiting     = []
+    stale_scans = {}
+    for lease in leases:
+        resource = scans.get(lease.resource_id) if lease.resource_type == 'scan' \
+            else tests.get(lease.resource_id)
+
+        # resource deleted or component finished
+        if is_finished(lease, resource):
+            released.append(lease.id)
+            if lease.resource_type == 'scan' and resource is not None and resource.time_completed is None:
+                stale_scans[lease.resource_id] = (resource, lease.kwargs)
+            continue
 
-            # get flowrun info
-            first_task  = ((test.system or {}).get('tasks') or [{}])[0]
-            kwargs      = first_task.get('kwargs') or {}
-            flowrun_id  = kwargs.get('flowrun_id')
-            node_index  = kwargs.get('node_index')
-            track_id    = kwargs.get('track_id') or str(test.id)
-            
-            # update FlowRun if present
-            if flowrun_id and flowrun_id != 'None':
-                update_flowrun(**{
-                    'flowrun_id': str(flowrun_id),
-                    'node_index': node_index,
-                    'message': (
-                        f'test for {test.page.page_url} completed with status: '+
-                        f'⏺️ INCOMPLETE | test_id: {str(test.id)}'
-                    ),
-                    'objects': [_flow_obj(
-                        parent=str(test.page.id),
-                        obj_id=str(test.id),
-                        source_id=str(test.id),
-                        track_id=track_id,
-                        status='incomplete'
-                    )]
-                })
+        # task parked until its account has a free slot
+        if f'{lease.resource_type}:{lease.resource_id}' in parked:
+            waiting.append(lease.id)
+            continue
 
-        # iterate through each FlowRun 
-        for flowrun in flowruns:
+        # Test waiting on its post_scan
+        if lease.resource_type == 'test' and str(resource.post_scan_id) in running_scans:
+            waiting.append(lease.id)
+            continue
 
-            # get last recorded log
-            print(f'flowrun incomplete ID: {flowrun.id}')
+        # re-run task if under max attempts
+        if lease.attempts < settings.MAX_ATTEMPTS:
+            if lease.resource_type == 'test':
+                task_id = f'lock:run_test_{lease.resource_id}'
+            else:
+                task_id = f"lock:{lease.task_method.replace('run_', '')}_{lease.resource_id}"
+            call_local_task_by_name(lease.task_method, lease.kwargs, task_id)
+            retried.append(lease.id)
+            continue
 
-            # check the objects of the current working node and confirm their status.
-            
+        # out of attempts
+        released.append(lease.id)
+        if lease.resource_type == 'test':
+            _mark_test_incomplete(resource)
+        else:
+            stale_scans[lease.resource_id] = (resource, lease.kwargs)
+
+    # update leases (re-sent tasks wait in the queue again
+    # & count an attempt in case the message is lost again)
+    TaskLease.objects.filter(id__in=released).delete()
+    TaskLease.objects.filter(id__in=retried).update(
+        attempts=F('attempts') + 1,
+        expires_at=now + timedelta(seconds=settings.TASK_LEASE_QUEUE_TTL)
+    )
+    TaskLease.objects.filter(id__in=waiting).update(
+        expires_at=now + timedelta(seconds=settings.TASK_LEASE_TTL)
+    )
 
+    # complete Scans with no leases left
+    leased_scans = set(
+        TaskLease.objects.filter(resource_type='scan', resource_id__in=stale_scans.keys())
+        .values_list('resource_id', flat=True)
+    )
+    for scan_id, (scan, kwargs) in stale_scans.items():
+        if scan_id not in leased_scans:
+            _complete_stale_scan(scan, kwargs)
 
+    logger.info(
+        f'redelivery: {len(retried)} retried, {len(released)} released, '+
+        f'{len(waiting)} waiting of {len(leases)} expired leases'
+    )
     return None
 
 
@@ -888,9 +927,29 @@ def scan_page_bg(
     scan = Scan.objects.get(id=scan_id)
 
     queue = get_task_queue(self.request, kwargs={'_queue': _queue} if _queue else None)
+
+    # components sharing one browser session
+    shared = get_shared_browser_components(scan.type)
     
-    # run each scan component in parallel
-    if 'html' in scan.type or 'logs' in scan.type or 'full' in scan.type:
+    # run browser components in a single session
+    if shared:
+        apply_async_in_queue(
+            run_browser_bg,
+            kwargs={
+                'scan_id'   : scan_id,
+                'test_id'   : test_id,
+                'alert_id'  : alert_id,
+                'flowrun_id': flowrun_id,
+                'node_index': node_index,
+                'components': shared,
+                '_queue'    : queue,
+            },
+            queue=queue,
+            task_id=f'lock:browser_bg_{scan_id}',
+        )
+
+    # run each remaining scan component in parallel
+    if ('html' in scan.type or 'logs' in scan.type or 'full' in scan.type) and 'html' not in shared:
         apply_async_in_queue(
             run_html_and_logs_bg,
             kwargs={
@@ -918,7 +977,7 @@ def scan_page_bg(
             queue=queue,
             task_id=f'lock:lighthouse_bg_{scan_id}',
         )
-    if 'images' in scan.type or 'vrt' in scan.type or 'full' in scan.type:
+    if ('images' in scan.type or 'vrt' in scan.type or 'full' in scan.type) and 'images' not in shared:
         apply_async_in_queue(
             run_vrt_bg,
             kwargs={
@@ -932,7 +991,7 @@ def scan_page_bg(
             queue=queue,
             task_id=f'lock:vrt_bg_{scan_id}',
         )
-    if 'security' in scan.type or 'full' in scan.type:
+    if ('security' in scan.type or 'full' in scan.type) and 'security' not in shared:
         apply_async_in_queue(
             run_security_bg,
             kwargs={
@@ -1232,12 +1291,9 @@ def run_html_and_logs_bg(
     with (account_concurrency_slot(self, account_id=account_id) if account_id else _always_acquired()) as slot:
         acquired, rank = slot
         if not acquired:
-            _reschedule_due_to_concurrency(self, rank=rank)
+            park_task(self, account_id=account_id)
             return None
 
-        # sleeping random for DB
-        time.sleep(random.uniform(2, 6))
-        
         # check redis task lock
         lock_name = f"lock:html_and_logs_bg_{scan_id}"
         with task_lock(lock_name) as lock_acquired:
@@ -1268,7 +1324,8 @@ def run_html_and_logs_bg(
                 return None
             
             # run html and logs component
-            _html_and_logs(scan_id, test_id, alert_id, flowrun_id, node_index)
+            with lease_heartbeat('scan', scan_id, ['html']):
+                _html_and_logs(scan_id, test_id, alert_id, flowrun_id, node_index)
 
     logger.info('ran html & logs component')
     return None
@@ -1312,12 +1369,9 @@ def run_vrt_bg(
     with (account_concurrency_slot(self, account_id=account_id) if account_id else _always_acquired()) as slot:
         acquired, rank = slot
         if not acquired:
-            _reschedule_due_to_concurrency(self, rank=rank)
+            park_task(self, account_id=account_id)
             return None
 
-        # sleeping random for DB
-        time.sleep(random.uniform(2, 6))
-
         # check redis task lock
         lock_name = f"lock:vrt_bg_{scan_id}"
         with task_lock(lock_name) as lock_acquired:
@@ -1348,7 +1402,8 @@ def run_vrt_bg(
                 return None
 
             # run VRT component
-            _vrt(scan_id, test_id, alert_id, flowrun_id, node_index)
+            with lease_heartbeat('scan', scan_id, ['images']):
+                _vrt(scan_id, test_id, alert_id, flowrun_id, node_index)
 
     logger.info('ran vrt component')
     return None
@@ -1392,12 +1447,9 @@ def run_lighthouse_bg(
     with (account_concurrency_slot(self, account_id=account_id) if account_id else _always_acquired()) as slot:
         acquired, rank = slot
         if not acquired:
-            _reschedule_due_to_concurrency(self, rank=rank)
+            park_task(self, account_id=account_id)
             return None
 
-        # sleeping random for DB
-        time.sleep(random.uniform(2, 6))
-       
         # check redis task lock
         lock_name = f"lock:lighthouse_bg_{scan_id}"
         with task_lock(lock_name) as lock_acquired:
@@ -1428,7 +1480,8 @@ def run_lighthouse_bg(
                 return None
 
             # run lighthouse component
-            _lighthouse(scan_id, test_id, alert_id, flowrun_id, node_index)
+            with lease_heartbeat('scan', scan_id, ['lighthouse']):
+                _lighthouse(scan_id, test_id, alert_id, flowrun_id, node_index)
 
     logger.info('ran lighthouse component')
     return None
@@ -1472,12 +1525,9 @@ def run_security_bg(
     with (account_concurrency_slot(self, account_id=account_id) if account_id else _always_acquired()) as slot:
         acquired, rank = slot
         if not acquired:
-            _reschedule_due_to_concurrency(self, rank=rank)
+            park_task(self, account_id=account_id)
             return None
 
-        # sleeping random for DB
-        time.sleep(random.uniform(2, 6))
-
         # check redis task lock
         lock_name = f"lock:security_bg_{scan_id}"
         with task_lock(lock_name) as lock_acquired:
@@ -1508,7 +1558,8 @@ def run_security_bg(
                 return None
 
             # run security component
-            _security(scan_id, test_id, alert_id, flowrun_id, node_index)
+            with lease_heartbeat('scan', scan_id, ['security']):
+                _security(scan_id, test_id, alert_id, flowrun_id, node_index)
 
     logger.info('ran security component')
     return None
@@ -1516,6 +1567,100 @@ def run_security_bg(
 
 
 
+@shared_task(bind=True, base=BaseTaskWithRetry)
+def run_browser_bg(
+        self,
+        scan_id: str=None,
+        test_id: str=None,
+        alert_id: str=None,
+        flowrun_id: str=None,
+        node_index: str=None,
+        components: list=None,
+        **kwargs
+    ) -> None:
+    """
+    Runs the html & logs, vrt, and security components 
+    of the passed `Scan` using a single browser session
+
+    Args:
+        scan_id     : str,
+        test_id     : str,
+        alert_id    : str,
+        flowrun_id  : str,
+        node_index  : str,
+        components  : list ('html', 'images', 'security'),
+        **kwargs
+
+    Returns: None
+    """
+
+    # get kwargs data if no scan_id
+    if scan_id is None:
+        scan_id = kwargs.get('scan_id')
+        test_id = kwargs.get('test_id')
+        alert_id = kwargs.get('alert_id')
+        flowrun_id = kwargs.get('flowrun_id')
+        node_index = kwargs.get('node_index')
+        components = kwargs.get('components')
+
+    # task_method recorded for each component so 
+    # `redeliver_failed_tasks` can retry them separately
+    methods = {
+        'html': 'run_html_and_logs_bg',
+        'images': 'run_vrt_bg',
+        'security': 'run_security_bg',
+    }
+
+    account_id = _get_account_id_from_scan_id(str(scan_id)) if scan_id else None
+    with (account_concurrency_slot(self, account_id=account_id) if account_id else _always_acquired()) as slot:
+        acquired, rank = slot
+        if not acquired:
+            park_task(self, account_id=account_id)
+            return None
+
+        # check redis task lock
+        lock_name = f"lock:browser_bg_{scan_id}"
+        with task_lock(lock_name) as lock_acquired:
+
+            # checking if task is already running
+            if not lock_acquired:
+                logger.info('task is already running, skipping execution.')
+                return None
+
+            # save & check sys data for each component
+            to_run = []
+            for component in (components or get_browser_components(Scan.objects.get(id=scan_id).type)):
+                max_reached = record_task(
+                    resource_type='scan',
+                    resource_id=str(scan_id),
+                    task_id=str(self.request.id),
+                    task_method=methods[component],
+                    kwargs={
+                        'scan_id': str(scan_id) if scan_id is not None else None,
+                        'test_id': str(test_id) if test_id is not None else None,
+                        'alert_id': str(alert_id) if alert_id is not None else None,
+                        'flowrun_id': str(flowrun_id) if flowrun_id is not None else None,
+                        'node_index': str(node_index) if node_index is not None else None
+                    }
+                )
+                if not max_reached:
+                    to_run.append(component)
+
+            # return early if max_attempts reached
+            if not to_run:
+                logger.info('max attempts reach for browser components')
+                return None
+
+            # run browser components
+            with lease_heartbeat('scan', scan_id, to_run):
+                _browser(scan_id, test_id, alert_id, flowrun_id, node_index, to_run)
+
+    logger.info('ran browser components')
+    return None
+
+
+
+
 @shared_task(bind=True, base=BaseTaskWithRetry)
 def run_test(
         self, 
@@ -1551,12 +1696,9 @@ def run_test(
     with (account_concurrency_slot(self, account_id=account_id) if account_id else _always_acquired()) as slot:
         acquired, rank = slot
         if not acquired:
-            _reschedule_due_to_concurrency(self, rank=rank)
+            park_task(self, account_id=account_id)
             return None
 
-        # sleeping random for DB
-        time.sleep(random.uniform(2, 6))
-        
         # check redis task lock
         lock_name = f"lock:run_test_{test_id}"
         with task_lock(lock_name) as lock_acquired:
@@ -1605,7 +1747,6 @@ def run_test(
 
             # update flowrun
             if flowrun_id and flowrun_id != 'None':
-                time.sleep(random.uniform(0.1, 5))
                 update_flowrun(**{
                     'flowrun_id': str(flowrun_id),
                     'node_index': node_index,
@@ -1615,7 +1756,8 @@ def run_test(
 
             # execute test
             logger.info('\n---------------\nStarting Test...\n---------------\n')
-            test = T(test=test).run_test()
+            with lease_heartbeat('test', test_id):
+                test = T(test=test).run_test()
 
             # update FlowRun if passed
             if flowrun_id and flowrun_id != 'None':
@@ -1880,6 +2022,9 @@ def create_test(
     created_test.system     = test_system
     created_test.save()
 
+    # lease the Test until run_test records itself
+    seed_leases(created_test, 'test')
+
     # check if pre and post scan are complete and start test if True
     if pre_scan.time_completed is not None and post_scan.time_completed is not None:
         apply_async_in_queue(
@@ -2160,7 +2305,7 @@ def create_report(
     with (account_concurrency_slot(self, account_id=account_id) if account_id else _always_acquired()) as slot:
         acquired, rank = slot
         if not acquired:
-            _reschedule_due_to_concurrency(self, rank=rank)
+            park_task(self, account_id=account_id)
             return None
 
         # get site
@@ -2506,7 +2651,7 @@ def run_case(
     with (account_concurrency_slot(self, account_id=account_id) if account_id else _always_acquired()) as slot:
         acquired, rank = slot
         if not acquired:
-            _reschedule_due_to_concurrency(self, rank=rank)
+            park_task(self, account_id=account_id)
             return None
 
         # get caserun
@@ -3070,8 +3215,7 @@ def delete_site_s3_bg(site_id: str) -> None:
 
     # deleting s3 objects
     try:
-        bucket = s3().Bucket(settings.AWS_STORAGE_BUCKET_NAME)
-        bucket.objects.filter(Prefix=str(f'static/sites/{site_id}/')).delete()
+        delete_prefixes([f'static/sites/{site_id}/'])
     except:
         pass
 
@@ -3096,8 +3240,7 @@ def delete_page_s3_bg(page_id: str, site_id: str) -> None:
 
     # deleting s3 objects
     try:
-        bucket = s3().Bucket(settings.AWS_STORAGE_BUCKET_NAME)
-        bucket.objects.filter(Prefix=str(f'static/sites/{site_id}/{page_id}/')).delete()
+        delete_prefixes([f'static/sites/{site_id}/{page_id}/'])
     except:
         pass
     
@@ -3123,8 +3266,7 @@ def delete_scan_s3_bg(scan_id: str, site_id: str, page_id: str) -> None:
 
     # deleting s3 objects
     try:
-        bucket = s3().Bucket(settings.AWS_STORAGE_BUCKET_NAME)
-        bucket.objects.filter(Prefix=str(f'static/sites/{site_id}/{page_id}/{scan_id}/')).delete()
+        delete_prefixes([f'static/sites/{site_id}/{page_id}/{scan_id}/'])
     except:
         pass
     
@@ -3150,8 +3292,7 @@ def delete_test_s3_bg(test_id: str, site_id: str, page_id: str) -> None:
 
     # deleting s3 objects
     try:
-        bucket = s3().Bucket(settings.AWS_STORAGE_BUCKET_NAME)
-        bucket.objects.filter(Prefix=str(f'static/sites/{site_id}/{page_id}/{test_id}/')).delete()
+        delete_prefixes([f'static/sites/{site_id}/{page_id}/{test_id}/'])
     except:
         pass
     
@@ -3175,8 +3316,7 @@ def delete_caserun_s3_bg(caserun_id: str) -> None:
 
     # deleting s3 objects
     try:
-        bucket = s3().Bucket(settings.AWS_STORAGE_BUCKET_NAME)
-        bucket.objects.filter(Prefix=str(f'static/caserun/{caserun_id}/')).delete()
+        delete_prefixes([f'static/caserun/{caserun_id}/'])
     except:
         pass
 
@@ -3205,8 +3345,7 @@ def delete_report_s3_bg(report_id: str) -> None:
             logger.info('No site found for report; skipping report s3 delete')
             return None
 
-        bucket = s3().Bucket(settings.AWS_STORAGE_BUCKET_NAME)
-        bucket.objects.filter(Prefix=str(f'static/sites/{site.id}/reports/{report_id}.pdf')).delete()
+        delete_prefixes([f'static/sites/{site.id}/reports/{report_id}.pdf'])
     except:
         pass
 
@@ -3230,8 +3369,7 @@ def delete_case_s3_bg(case_id: str) -> None:
 
     # deleting s3 objects
     try:
-        bucket = s3().Bucket(settings.AWS_STORAGE_BUCKET_NAME)
-        bucket.objects.filter(Prefix=str(f'static/cases/{case_id}/')).delete()
+        delete_prefixes([f'static/cases/{case_id}/'])
     except:
         pass
 
@@ -3291,15 +3429,16 @@ def reset_account_usage(account_id: str=None) -> None:
 
     # helper reset method
     def reset_usage(account):
-        account.usage.update({
-            'scans': 0,
-            'tests': 0,
-            'caseruns': 0,
-            'flowruns': 0
-        })
-        account.meta = account.meta or {}
-        account.meta['last_usage_reset'] = today.isoformat()
-        account.save()
+        reset_counters(
+            account.id,
+            values={
+                'scans': 0,
+                'tests': 0,
+                'caseruns': 0,
+                'flowruns': 0
+            },
+            meta={'last_usage_reset': today.isoformat()}
+        )
         logger.info(f'Reset usage for account: {account.name}')
 
     for account in accounts:
@@ -3358,6 +3497,24 @@ def reset_account_usage(account_id: str=None) -> None:
 
 
 
+@shared_task
+def flush_meter_events() -> None:
+    """ 
+    Sends the batched Stripe `MeterEvents` 
+    queued by `meter_account()`
+
+    Args:
+        None
+    
+    Returns: None
+    """
+    sent = flush_meter()
+    logger.info(f'sent {sent} meter events')
+    return None
+
+
+
+
 @shared_task
 def update_sub_price(account_id: str=None, sites_allowed: int=None) -> None:
     """ 
@@ -3448,6 +3605,45 @@ def update_sub_price(account_id: str=None, sites_allowed: int=None) -> None:
 
 
 
+def _retention_hook(label: str=None) -> callable:
+    """
+    Builds the `before_delete` hook of `delete_expired()` for
+    the resource type. Each chunk's s3 objects are deleted 
+    (in parallel batches) before its rows, so a run resumed 
+    from its checkpoint never leaves objects behind.
+
+    Args:
+        'label' : str (tests, scans, caseruns, ...)
+
+    Returns:
+        callable or None
+    """
+    if label not in ['tests', 'scans', 'caseruns']:
+        return None
+
+    def hook(chunk: object) -> None:
+        if label == 'caseruns':
+            prefixes = [
+                f'static/caserun/{obj_id}/' 
+                for obj_id in chunk.values_list('id', flat=True)
+            ]
+            deleted = delete_prefixes(prefixes)
+        else:
+            # list each page once for all of its expired rows
+            prefixes = {}
+            for obj_id, site_id, page_id in chunk.values_list('id', 'site_id', 'page_id'):
+                prefixes.setdefault(f'static/sites/{site_id}/{page_id}/', set()).add(str(obj_id))
+            deleted = delete_prefixes(children=prefixes)
+        logger.info(f'Deleted {deleted} s3 objects of {label} under {len(prefixes)} prefixes')
+        if label == 'scans':
+            release_scan_artifacts(chunk)
+        return None
+
+    return hook
+
+
+
+
 @shared_task
 def delete_old_resources(account_id: str=None, days_to_live: int=30) -> None:
     """ 
@@ -3474,11 +3670,11 @@ def delete_old_resources(account_id: str=None, days_to_live: int=30) -> None:
         processes = Process.objects.filter(account__id=account_id, time_created__lte=max_proc_date)
         issues = Issue.objects.filter(account__id=account_id, time_created__lte=max_proc_date)
         
-        # get all old Logs
-        members = Member.objects.filter(account__id=account_id)
-        logs = []
-        for member in members:
-            logs += Log.objects.filter(user=member.user, time_created__lte=max_proc_date)
+        # get all old Logs of the account's members
+        logs = Log.objects.filter(
+            user__in=Member.objects.filter(account__id=account_id).values('user'),
+            time_created__lte=max_proc_date
+        )
 
     # get all resoruces if no account_id
     else:
@@ -3490,24 +3686,23 @@ def delete_old_resources(account_id: str=None, days_to_live: int=30) -> None:
         logs = Log.objects.filter(time_created__lte=max_proc_date)
         issues = Issue.objects.filter(time_created__lte=max_proc_date)
 
-    # delete each resource in each type
-    for test in tests:
-        delete_test_s3_bg.delay(test.id, test.site.id, test.page.id)
-        test.delete()
-    for scan in scans:
-        delete_scan_s3_bg.delay(scan.id, scan.site.id, scan.page.id)
-        scan.delete()
-    for caserun in caseruns:
-        delete_caserun_s3_bg.delay(caserun.id)
-        caserun.delete()
-    for flowrun in flowruns:
-        flowrun.delete()
-    for process in processes:
-        process.delete()
-    for issue in issues:
-        issue.delete()
-    for log in logs:
-        log.delete()
+    # delete each resource type in chunks, oldest first,
+    # removing each chunk's s3 objects (& releasing the
+    # scans' shared artifacts) right before its rows
+    scope = str(account_id) if account_id is not None else None
+    for label, queryset, cutoff in [
+            ('tests', tests, max_date),
+            ('scans', scans, max_date),
+            ('caseruns', caseruns, max_date),
+            ('flowruns', flowruns, max_date),
+            ('processes', processes, max_proc_date),
+            ('issues', issues, max_proc_date),
+            ('logs', logs, max_proc_date),
+        ]:
+        delete_expired(
+            queryset, label=label, scope=scope, max_date=cutoff,
+            before_delete=_retention_hook(label)
+        )
     
     logger.info('Cleaned up resources')
     return None
@@ -3535,6 +3730,11 @@ def data_retention() -> None:
             account_id=account.id,
             days_to_live=account.usage['retention_days']
         )
+
+    # drop whole partitions in one global pass, as 
+    # partitions span accounts
+    if settings.RETENTION_PARTITIONED_TABLES:
+        drop_old_partitions.delay()
     
     logger.info('Requested resource cleanup')
     return None
@@ -3542,6 +3742,49 @@ def data_retention() -> None:
 
 
 
+@shared_task
+def drop_old_partitions() -> None:
+    """ 
+    Unscoped retention pass for the tables listed in 
+    RETENTION_PARTITIONED_TABLES, dropping partitions 
+    which are expired for every account: `FlowRuns` use 
+    the longest retention_days of all accounts, `Processes`,
+    `Issues` & `Logs` 1 day (as in `delete_old_resources()`).
+    Rows left in the remaining partitions are deleted by 
+    the scoped runs. `Tests`, `Scans` & `CaseRuns` are never
+    dropped whole, as their s3 objects & artifacts are 
+    removed per chunk.
+
+    Returns: None
+    """
+
+    # longest retention of any account
+    days = [
+        int((usage or {}).get('retention_days') or 30)
+        for usage in Account.objects.values_list('usage', flat=True)
+    ]
+    max_date = timezone.now() - timedelta(days=max(days or [30]))
+    max_proc_date = timezone.now() - timedelta(days=1)
+
+    # cutoff of each partitionable table
+    cutoffs = {FlowRun._meta.db_table: max_date}
+    cutoffs.update({model._meta.db_table: max_proc_date for model in [Process, Issue, Log]})
+
+    for table in settings.RETENTION_PARTITIONED_TABLES:
+        if table not in cutoffs:
+            logger.info(f'no retention cutoff for partitioned table {table}')
+            continue
+        try:
+            dropped = drop_expired_partitions(table, cutoffs[table])
+            logger.info(f'Dropped {len(dropped)} partitions of {table}')
+        except Exception as e:
+            logger.info(f'partition drop failed for {table} -> {e}')
+
+    return None
+
+
+
+
 @shared_task
 def delete_admin_sites(days_to_live: int=1) -> None:
     """ 
@@ -3560,10 +3803,13 @@ def delete_admin_sites(days_to_live: int=1) -> None:
     # filter sites by max_date and admin 
     sites = Site.objects.filter(time_created__lte=max_date, user__username='admin')
 
-    # delete each site
+    # delete each site & its s3 objects in one batch
+    prefixes = [f'static/sites/{site_id}/' for site_id in sites.values_list('id', flat=True)]
     for site in sites:
-        delete_site_s3_bg.delay(site.id)
-        site.delete()
+        with transaction.atomic():
+            release_scan_artifacts(Scan.objects.filter(site=site))
+            site.delete()
+    delete_prefixes(prefixes)
     
     logger.info('Cleaned up admin sites')
     return None
@@ -3571,6 +3817,27 @@ def delete_admin_sites(days_to_live: int=1) -> None:
 
 
 
+@shared_task
+def delete_orphaned_artifacts(limit: int=1000) -> None:
+    """ 
+    Deletes content-addressed artifacts (html, audits) 
+    which are no longer referenced by any `Scan`
+
+    Args:
+        'limit': int 
+    
+    Returns: None
+    """
+
+    # delete unreferenced blobs past the grace period
+    deleted = delete_orphaned(limit=limit)
+    
+    logger.info(f'Deleted {deleted} orphaned artifacts')
+    return None
+
+
+
+
 @shared_task
 def create_prospect(user_email: str=None) -> None:
     """ 
@@ -1,11 +1,13 @@
-from .driver import driver_init, driver_wait, quit_driver
+from .driver import driver_wait
+from .pool import lease_driver, release_driver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from .llm import llm_json
+from .storage import upload_bytes, upload_json
 from ..models import Case
 from cursion import settings
-import time, os, json, uuid, random, boto3
+import time, uuid, random
 
 
 
@@ -62,11 +64,12 @@ class AutoCaser():
         self.final_start_elements = []
         self.feedback = []
 
-        # starting driver
-        self.driver = driver_init(
+        # starting a dedicated driver (secrets are used)
+        self.driver = lease_driver(
             browser=self.configs.get('browser'),
             window_size=self.configs.get('window_size'),
             device=self.configs.get('device'),
+            pooled=False
         )
 
         # setting selector script
@@ -206,14 +209,6 @@ class AutoCaser():
         # setting blacklist for input types to ignore
         self.blacklist = ['file', 'hidden', 'image', 'reset']
 
-        # setup boto3 configurations
-        self.s3 = boto3.client(
-            's3', aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-            aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-            region_name=str(settings.AWS_S3_REGION_NAME), 
-            endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
-        )
-        
 
 
 
@@ -288,20 +283,12 @@ class AutoCaser():
         # setup ids
         pic_id = uuid.uuid4()
 
-        # take screenshot
-        self.driver.save_screenshot(f'{pic_id}.png')
-        image = os.path.join(settings.BASE_DIR, f'{pic_id}.png')
-
-        # setup paths
+        # take screenshot & upload from memory
         remote_path = f'static/sites/{self.site.id}/images/{pic_id}.png'
-        root_path = settings.AWS_S3_URL_PATH
-        image_url = f'{root_path}/{remote_path}'
-    
-        # upload to s3
-        with open(image, 'rb') as data:
-            self.s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME), 
-                remote_path, ExtraArgs={'ACL': 'public-read', 'ContentType': "image/png"}
-            )
+        image_url = upload_bytes(
+            self.driver.get_screenshot_as_png(), 
+            remote_path, content_type='image/png'
+        )
         
         # return url
         return image_url
@@ -1452,7 +1439,7 @@ class AutoCaser():
             self.update_process(current=iterations, total=len(self.final_start_elements))
 
         # quit driver session
-        quit_driver(self.driver)
+        release_driver(self.driver)
 
         # return elements
         return self.elements
@@ -1576,24 +1563,9 @@ class AutoCaser():
             # create .json file for steps and upload to s3
             case_id = uuid.uuid4()
 
-            # saving as json file temporarily
-            with open(f'{case_id}.json', 'w') as fp:
-                json.dump(steps, fp)
-            
-            # seting up paths
-            steps_file  = os.path.join(settings.BASE_DIR, f'{case_id}.json')
+            # upload from memory
             remote_path = f'static/cases/{case_id}.json'
-            root_path   = settings.AWS_S3_URL_PATH
-            steps_url   = f'{root_path}/{remote_path}'
-        
-            # upload to s3
-            with open(steps_file, 'rb') as data:
-                self.s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME), 
-                    remote_path, ExtraArgs={'ACL': 'public-read', 'ContentType': "application/json"}
-                )
-
-            # remove local copy
-            os.remove(steps_file)
+            steps_url   = upload_json(steps, remote_path)
 
             # save new Case
             Case.objects.create(
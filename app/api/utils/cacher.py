@@ -0,0 +1,417 @@
+from cursion import settings
+from redis import Redis
+from hashlib import sha256
+import os, io, json, uuid, time, threading, numpy
+
+
+
+
+
+
+# bump to invalidate all cached artifacts
+# when their derivation changes
+CACHE_VERSION = 1
+
+
+# size of each block streamed to & from the cache
+BLOCK_SIZE = 1024 * 1024
+
+
+# disk eviction runs every ARTIFACT_CACHE_EVICT_EVERY
+# puts or ARTIFACT_CACHE_EVICT_INTERVAL seconds (per process)
+_evict_lock = threading.Lock()
+_evict_state = {'puts': 0, 'time': 0.0}
+
+
+
+
+class Cacher():
+    """
+    Content-addressed cache for artifacts derived from
+    a `Scan` (cleaned html tokens, log fingerprints,
+    decoded images). Entries are keyed by scan id,
+    component & source (e.g. the s3 url) so they never
+    need invalidation, and evicted LRU.
+
+    Backends:
+        'disk'  : files in ARTIFACT_CACHE_DIR, evicted by
+                  oldest access time past ARTIFACT_CACHE_MAX_MB
+                  (checked periodically, see `maybe_evict()`)
+        'redis' : keys with ARTIFACT_CACHE_TTL, evicted by
+                  the server's maxmemory policy
+        'none'  : disabled
+
+    Args:
+        'backend' : str (defaults to ARTIFACT_CACHE_BACKEND)
+
+    Returns:
+        `Cacher` object
+    """
+
+
+
+
+    def __init__(self, backend: str=None):
+        self.backend = backend or settings.ARTIFACT_CACHE_BACKEND
+        self.root = settings.ARTIFACT_CACHE_DIR
+        self.max_bytes = settings.ARTIFACT_CACHE_MAX_MB * 1024 * 1024
+        self.ttl = settings.ARTIFACT_CACHE_TTL
+        self.redis = None
+
+        if self.backend == 'disk':
+            os.makedirs(self.root, exist_ok=True)
+        if self.backend == 'redis':
+            self.redis = Redis.from_url(settings.ARTIFACT_CACHE_REDIS_URL)
+
+
+
+
+    def key(self, scan_id: str=None, component: str=None, source: str=None) -> str:
+        """
+        Builds the content address for the artifact.
+
+        Args:
+            'scan_id'   : str,
+            'component' : str,
+            'source'    : str
+
+        Returns:
+            str
+        """
+        raw = f'{CACHE_VERSION}:{scan_id}:{component}:{source or ""}'
+        return sha256(raw.encode('utf-8')).hexdigest()
+
+
+
+
+    def get(self, scan_id: str=None, component: str=None, source: str=None) -> bytes:
+        """
+        Returns the cached bytes or None.
+        """
+        key = self.key(scan_id, component, source)
+        try:
+            if self.backend == 'disk':
+                path = os.path.join(self.root, key)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                # mark as recently used
+                os.utime(path, None)
+                return data
+            if self.backend == 'redis':
+                return self.redis.get(f'artifact:{key}')
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f'artifact cache read failed -> {e}')
+        return None
+
+
+
+
+    def put(self, scan_id: str=None, component: str=None, source: str=None, data: bytes=None) -> None:
+        """
+        Stores the bytes, evicting old entries if needed.
+        """
+        if data is None:
+            return None
+        key = self.key(scan_id, component, source)
+        try:
+            if self.backend == 'disk':
+                if len(data) > self.max_bytes:
+                    return None
+                # write atomically so readers never see partial files
+                path = os.path.join(self.root, key)
+                temp = f'{path}.{uuid.uuid4().hex}.tmp'
+                with open(temp, 'wb') as f:
+                    f.write(data)
+                os.replace(temp, path)
+                self.maybe_evict()
+            if self.backend == 'redis':
+                self.redis.set(f'artifact:{key}', data, ex=self.ttl)
+        except Exception as e:
+            print(f'artifact cache write failed -> {e}')
+        return None
+
+
+
+
+    def evict(self) -> None:
+        """
+        Removes least recently used files until the
+        disk cache is under max_bytes.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.root):
+            if not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return None
+        for mtime, size, path in sorted(entries):
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+            if total <= self.max_bytes:
+                break
+        return None
+
+
+
+
+    def get_stream(
+            self, 
+            scan_id: str=None, 
+            component: str=None, 
+            source: str=None, 
+            read: callable=None
+        ) -> object:
+        """
+        Streams the cached entry into `read(f)` (f is a
+        binary file object) without loading it whole.
+
+        Returns:
+            the result of `read(f)`, or None if not cached
+        """
+        key = self.key(scan_id, component, source)
+        try:
+            if self.backend == 'disk':
+                path = os.path.join(self.root, key)
+                with open(path, 'rb') as f:
+                    result = read(f)
+                # mark as recently used
+                os.utime(path, None)
+                return result
+            if self.backend == 'redis':
+                name = f'artifact:{key}'
+                if not self.redis.exists(name):
+                    return None
+                return read(RedisReader(self.redis, name))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f'artifact cache read failed -> {e}')
+        return None
+
+
+
+
+    def put_stream(
+            self, 
+            scan_id: str=None, 
+            component: str=None, 
+            source: str=None, 
+            write: callable=None
+        ) -> None:
+        """
+        Stores whatever `write(f)` writes to the binary
+        file object f, streaming it to the backend.
+        """
+        key = self.key(scan_id, component, source)
+        temp = None
+        try:
+            if self.backend == 'disk':
+                # write atomically so readers never see partial files
+                path = os.path.join(self.root, key)
+                temp = f'{path}.{uuid.uuid4().hex}.tmp'
+                with open(temp, 'wb') as f:
+                    write(f)
+                if os.path.getsize(temp) > self.max_bytes:
+                    os.remove(temp)
+                    return None
+                os.replace(temp, path)
+                self.maybe_evict()
+            if self.backend == 'redis':
+                writer = RedisWriter(self.redis, f'artifact:{key}', self.ttl)
+                temp = writer.temp
+                write(writer)
+                writer.commit()
+        except Exception as e:
+            print(f'artifact cache write failed -> {e}')
+            self.discard(temp)
+        return None
+
+
+
+
+    def discard(self, temp: str=None) -> None:
+        # removes a partially written entry
+        if temp is None:
+            return None
+        try:
+            if self.backend == 'disk':
+                os.remove(temp)
+            if self.backend == 'redis':
+                self.redis.delete(temp)
+        except Exception:
+            pass
+        return None
+
+
+
+
+    def maybe_evict(self) -> None:
+        """
+        Runs `evict()` once every ARTIFACT_CACHE_EVICT_EVERY
+        puts or ARTIFACT_CACHE_EVICT_INTERVAL seconds rather
+        than scanning the directory on each put.
+        """
+        with _evict_lock:
+            _evict_state['puts'] += 1
+            now = time.monotonic()
+            if (_evict_state['puts'] < settings.ARTIFACT_CACHE_EVICT_EVERY and 
+                    now - _evict_state['time'] < settings.ARTIFACT_CACHE_EVICT_INTERVAL):
+                return None
+            _evict_state['puts'] = 0
+            _evict_state['time'] = now
+        self.evict()
+        return None
+
+
+
+
+    def get_json(self, scan_id: str=None, component: str=None, source: str=None) -> object:
+        data = self.get(scan_id, component, source)
+        return json.loads(data) if data is not None else None
+
+
+
+
+    def put_json(self, scan_id: str=None, component: str=None, source: str=None, obj: object=None) -> None:
+        self.put(scan_id, component, source, json.dumps(obj).encode('utf-8'))
+
+
+
+
+    def get_array(self, scan_id: str=None, component: str=None, source: str=None) -> numpy.ndarray:
+        data = self.get(scan_id, component, source)
+        if data is None:
+            return None
+        try:
+            return numpy.load(io.BytesIO(data), allow_pickle=False)
+        except Exception as e:
+            print(e)
+            return None
+
+
+
+
+    def put_array(self, scan_id: str=None, component: str=None, source: str=None, array: numpy.ndarray=None) -> None:
+        if array is None:
+            return None
+        buffer = io.BytesIO()
+        numpy.save(buffer, array, allow_pickle=False)
+        self.put(scan_id, component, source, buffer.getvalue())
+
+
+
+
+class RedisReader():
+    """
+    Read-only binary file object over a redis string,
+    fetched BLOCK_SIZE bytes at a time with GETRANGE.
+
+    Args:
+        'redis' : `Redis` client,
+        'name'  : str, the key
+
+    Returns:
+        `RedisReader` object
+    """
+
+    def __init__(self, redis: Redis, name: str):
+        self.redis = redis
+        self.name = name
+        self.offset = 0
+
+    def read(self, size: int=-1) -> bytes:
+        if size is None or size < 0:
+            blocks = []
+            while True:
+                block = self.read(BLOCK_SIZE)
+                if not block:
+                    return b''.join(blocks)
+                blocks.append(block)
+        if size == 0:
+            return b''
+        data = self.redis.getrange(self.name, self.offset, self.offset + size - 1)
+        self.offset += len(data)
+        return data
+
+
+
+
+class RedisWriter():
+    """
+    Write-only binary file object which APPENDs BLOCK_SIZE
+    blocks to a temp key, renamed onto `name` by `commit()`
+    so readers never see partial entries.
+
+    Args:
+        'redis' : `Redis` client,
+        'name'  : str, the key,
+        'ttl'   : int, seconds
+
+    Returns:
+        `RedisWriter` object
+    """
+
+    def __init__(self, redis: Redis, name: str, ttl: int):
+        self.redis = redis
+        self.name = name
+        self.ttl = ttl
+        self.temp = f'{name}:{uuid.uuid4().hex}.tmp'
+        self.buffer = bytearray()
+        self.written = False
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        if len(self.buffer) >= BLOCK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return None
+        pipe = self.redis.pipeline()
+        pipe.append(self.temp, bytes(self.buffer))
+        # abandoned temp keys expire on their own
+        pipe.expire(self.temp, self.ttl)
+        pipe.execute()
+        self.buffer = bytearray()
+        self.written = True
+        return None
+
+    def commit(self) -> None:
+        self.flush()
+        if not self.written:
+            self.redis.set(self.name, b'', ex=self.ttl)
+            return None
+        pipe = self.redis.pipeline()
+        pipe.rename(self.temp, self.name)
+        pipe.expire(self.name, self.ttl)
+        pipe.execute()
+        return None
+
+
+
+
+def get_cacher() -> Cacher:
+    """
+    Returns a `Cacher` for the configured backend,
+    or None if caching is disabled.
+    """
+    if settings.ARTIFACT_CACHE_BACKEND not in ['disk', 'redis']:
+        return None
+    try:
+        return Cacher()
+    except Exception as e:
+        print(f'artifact cache unavailable -> {e}')
+        return None
@@ -2,14 +2,16 @@ from cryptography.fernet import Fernet
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
-from .driver import driver_init, driver_wait, quit_driver
+from .driver import driver_wait
+from .pool import lease_driver, release_driver
 from .issuer import Issuer
 from .updater import update_flowrun
 from .imager import Imager
+from .storage import upload_bytes, upload_json
 from ..models import * 
 from django.utils import timezone
 from cursion import settings
-import time, uuid, json, boto3, os, requests
+import time, uuid, json, requests
 
 
 
@@ -61,11 +63,12 @@ class Caser():
         self.account = self.case.account if self.case else self.caserun.account
         self.secrets = Secret.objects.filter(account=self.account)
 
-        # init driver
-        self.driver = driver_init(
+        # init a dedicated driver (secrets are used)
+        self.driver = lease_driver(
             browser=self.configs.get('browser', 'chrome'),
             window_size=self.configs.get('window_size'), 
-            device=self.configs.get('device')
+            device=self.configs.get('device'),
+            pooled=False
         )
 
         # init actions
@@ -304,41 +307,23 @@ class Caser():
         # default
         image_url = None
 
-        # setup boto3 configurations
-        s3 = boto3.client(
-            's3', aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-            aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-            region_name=str(settings.AWS_S3_REGION_NAME), 
-            endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
-        )
-
         # setting id for image
         pic_id = uuid.uuid4()
 
         # catch any timeout/detachment errors
         try:
-        
-            # get screenshot
-            self.driver.save_screenshot(f'{pic_id}.png')
-
-            # seting up paths
-            image = os.path.join(settings.BASE_DIR, f'{pic_id}.png')
             
+            # seting up paths
             if run_type == 'run':
                 remote_path = f'static/caseruns/{self.caserun.id}/{pic_id}.png'
             if run_type == 'pre_run':
                 remote_path = f'static/case/{self.case.id}/{pic_id}.png'
 
-            root_path = settings.AWS_S3_URL_PATH
-            image_url = f'{root_path}/{remote_path}'
-        
-            # upload to s3
-            with open(image, 'rb') as data:
-                s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME), 
-                    remote_path, ExtraArgs={'ACL': 'public-read', 'ContentType': "image/png"}
-                )
-            # remove local copy
-            os.remove(image)
+            # get screenshot & upload from memory
+            image_url = upload_bytes(
+                self.driver.get_screenshot_as_png(), 
+                remote_path, content_type='image/png'
+            )
         
         except Exception as e:
             print(e)
@@ -365,37 +350,10 @@ class Caser():
         }
         """
 
-        # setup boto3 configurations
-        s3 = boto3.client(
-            's3', aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-            aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-            region_name=str(settings.AWS_S3_REGION_NAME), 
-            endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
-        )
-
-        # saving as json file temporarily
+        # upload from memory to s3
         steps_id = uuid.uuid4()
-        with open(f'{steps_id}.json', 'w') as fp:
-            json.dump(steps, fp)
-        
-        # seting up paths
-        steps_file = os.path.join(settings.BASE_DIR, f'{steps_id}.json')
         remote_path = f'static/cases/{case_id}/{steps_id}.json'
-        root_path = settings.AWS_S3_URL_PATH
-        steps_url = f'{root_path}/{remote_path}'
-
-        # upload to s3
-        with open(steps_file, 'rb') as data:
-            s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME), 
-                remote_path, ExtraArgs={
-                    'ACL': 'public-read', 
-                    'ContentType': 'application/json',
-                    'CacheControl': 'max-age=0'
-                }
-            )
-
-        # remove local copy
-        os.remove(steps_file)
+        steps_url = upload_json(steps, remote_path, extra={'CacheControl': 'max-age=0'})
 
         # format data
         data = {
@@ -1136,7 +1094,7 @@ class Caser():
         self.update_caserun(
             time_completed=timezone.now()
         )
-        quit_driver(driver=self.driver)
+        release_driver(self.driver)
         print('-- caserun run complete --')
 
         # update flowrun
@@ -1402,7 +1360,7 @@ class Caser():
         self.case.processed = True
         self.case.save()
 
-        quit_driver(driver=self.driver)
+        release_driver(self.driver)
         print('-- case pre_run complete --')
         
         # update process
@@ -1,5 +1,6 @@
 from bs4 import BeautifulSoup
 from .driver import *
+from .pool import lease_driver, release_driver
 
 
 
@@ -29,7 +30,7 @@ class Crawler():
         self.url = url
         self.sitemap = sitemap
         self.max_urls = max_urls
-        self.driver = driver_init()
+        self.driver = lease_driver()
 
 
 
@@ -39,7 +40,7 @@ class Crawler():
         # which are within the same self.url domain
 
         if self.max_urls <= 0:
-            quit_driver(self.driver)
+            release_driver(self.driver)
             return []
 
         follow_urls = []
@@ -185,7 +186,7 @@ class Crawler():
                     crawl_url(url, max_depth=self.max_urls)
 
 
-        # quit driver and return
-        quit_driver(self.driver)
+        # release driver and return
+        release_driver(self.driver)
         return saved_urls
 
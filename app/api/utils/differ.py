@@ -0,0 +1,845 @@
+from collections import Counter, deque
+from tempfile import SpooledTemporaryFile
+from hashlib import blake2b
+from array import array
+from html.parser import HTMLParser
+import requests, struct, json, codecs
+
+
+
+
+
+
+# lines containing any of these are dropped before tokenizing
+HTML_WHITE_LIST = ('csrfmiddlewaretoken', '<!DOCTYPE html>',)
+
+
+# bare tags which are not kept as tokens
+HTML_TAGS = frozenset([
+    '<head', '<script', '<div', '<p', '<h1', '<wbr', '<ul', '<tr', '<u', '<title', '<iframe',
+    '<section', '<source', '<style', '<q', '<option', '<nav', '<menu', '<mark', '<map', '<meta', '<keygen', '<link',
+    '<li', '<legend', '<label', '<input', '<img', '<i', '<hr', '<hgroup', '<h2', '<h3', '<h4', '<h5', '<h6', '<form',
+    '<footer', '<figure', '<fieldset', '<embed', '<em', '<dt', '<dl', '<dialog', '<dfn', '<details', '<del', '<dd',
+    '<datalist', '<data', '<colgroup', '<col', '<code', '<cite', '<caption', '<canvas', '<button', '<body', '<blockquote',
+    '<bdo', '<bdi', '<base', '<pre', '<b', '<br', '<audio', '<aside', '<article', '<area', '<address', '<abbr', '<a',
+    '<!DOCTYPE html>', '</head', '</script', '</div', '</p', '</h1', '</wbr', '</ul', '</tr', '</u', '</title', '</iframe',
+    '</section', '</source', '</style', '</q', '</option', '</nav', '</menu', '</mark', '</map', '</meta', '</keygen', '</link',
+    '</li', '</legend', '</label', '</input', '</img', '</i', '</hr', '</hgroup', '</h2', '</h3', '</h4', '</h5', '</h6', '</form',
+    '</footer', '</figure', '</fieldset', '</embed', '</em', '</dt', '</dl', '</dialog', '</dfn', '</details', '</del', '</dd',
+    '</datalist', '</data', '</colgroup', '</col', '</code', '</cite', '</caption', '</canvas', '</button', '</body', '</blockquote',
+    '</bdo', '</bdi', '</base', '</pre', '</b', '</br', '</audio', '</aside', '</article', '</area', '</address', '</abbr', '</a',
+])
+
+
+# size of each micro delta chunk
+CHUNK_SIZE = 8
+
+
+# in-memory size of each spooled token stream before
+# it rolls over to disk, & size of streamed reads
+SPOOL_MAX_SIZE = 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+# max occurrence pairs of the anchor candidates extended
+# per region by `count_matches()`
+ANCHOR_PAIR_LIMIT = 256
+
+
+# above this many (chunks x chars) substring
+# lookups use a set of substrings instead of `in`
+SUBSTRING_SET_THRESHOLD = 50_000_000
+
+
+
+
+def token_hash(token: str) -> int:
+    """
+    Stable signed 64 bit hash of the token.
+
+    Args:
+        'token' : str
+
+    Returns:
+        int
+    """
+    return int.from_bytes(
+        blake2b(token.encode('utf-8', 'surrogatepass'), digest_size=8).digest(),
+        'big', signed=True
+    )
+
+
+
+
+def stream_lines(url: str, timeout: int=60) -> iter:
+    """
+    Streams the remote document in STREAM_CHUNK_SIZE
+    chunks and yields each line (without line breaks).
+
+    Args:
+        'url'       : str,
+        'timeout'   : int
+
+    Returns:
+        generator of str
+    """
+    with requests.get(url, stream=True, timeout=timeout) as res:
+        res.encoding = res.encoding or 'utf-8'
+        pending = ''
+        for chunk in res.iter_content(chunk_size=STREAM_CHUNK_SIZE, decode_unicode=True):
+            lines = (pending + chunk).splitlines(True)
+            pending = ''
+            # hold back an unterminated (or possibly split \r\n) line
+            if lines and (lines[-1] == lines[-1].splitlines()[0] or lines[-1].endswith('\r')):
+                pending = lines.pop()
+            for line in lines:
+                yield line.splitlines()[0]
+        if pending:
+            yield pending.splitlines()[0]
+
+
+
+
+class TokenStream():
+    """
+    Bounded memory token sequence. Keeps a 64 bit hash
+    per token in memory and spools the token text to a
+    temp file (rolled to disk past SPOOL_MAX_SIZE) so
+    it can be re-read when building deltas.
+
+    Args:
+        'tokens' : iterable of str (optional)
+
+    Use `TokenStream.from_url()` to stream remote html
+
+    Returns:
+        `TokenStream` object
+    """
+
+    def __init__(self, tokens: iter=None):
+        self.hashes = array('q')
+        self.chunks = 0
+        self.spool = SpooledTemporaryFile(
+            max_size=SPOOL_MAX_SIZE, mode='w+', encoding='utf-8', 
+            errors='surrogatepass', newline='\n'
+        )
+        if tokens is not None:
+            self.extend(tokens)
+
+    @classmethod
+    def from_url(cls, url: str) -> object:
+        return cls(tokenize_html(stream_lines(url)))
+
+    @classmethod
+    def from_lines(cls, lines: iter) -> object:
+        return cls(tokenize_html(lines))
+
+    def extend(self, tokens: iter) -> None:
+        self.spool.seek(0, 2)
+        for token in tokens:
+            self.hashes.append(token_hash(token))
+            self.chunks += -(-len(token) // CHUNK_SIZE)
+            self.spool.write(token)
+            self.spool.write('\n')
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def __iter__(self) -> iter:
+        self.spool.seek(0)
+        for line in self.spool:
+            yield line[:-1]
+
+    def dump(self, f: object) -> None:
+        # streams the header (count, chunks), hashes &
+        # token text into the binary file `f`
+        f.write(struct.pack('<QQ', len(self.hashes), self.chunks))
+        self.hashes.tofile(f)
+        self.spool.seek(0)
+        while True:
+            text = self.spool.read(STREAM_CHUNK_SIZE)
+            if not text:
+                break
+            f.write(text.encode('utf-8', errors='surrogatepass'))
+
+    @classmethod
+    def load(cls, f: object) -> object:
+        # reads a stream written by `dump()` from the binary file `f`
+        header = f.read(16)
+        if len(header) < 16:
+            raise ValueError('truncated token stream')
+        count, chunks = struct.unpack('<QQ', header)
+        stream = cls()
+        try:
+            stream.hashes.fromfile(f, count)
+            stream.chunks = chunks
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='surrogatepass')
+            while True:
+                data = f.read(STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                stream.spool.write(decoder.decode(data))
+            stream.spool.write(decoder.decode(b'', final=True))
+        except Exception:
+            stream.close()
+            raise
+        return stream
+
+    def close(self) -> None:
+        self.spool.close()
+
+
+
+
+def tokenize_html(lines: iter) -> iter:
+    """
+    Splits each line of html into '>' terminated tokens,
+    skipping white listed lines and bare tags.
+
+    Args:
+        'lines' : iterable of str
+
+    Returns:
+        generator of str
+    """
+    for line in lines:
+        if any(item in line for item in HTML_WHITE_LIST):
+            continue
+        new_line = line.replace('\t', '').replace('\\', '').replace('""', '')
+        for sub in new_line.split('>'):
+            if sub not in HTML_TAGS:
+                yield sub + '>'
+
+
+
+
+def chunk_token(token: str) -> list:
+    """
+    Splits the token into CHUNK_SIZE char chunks.
+
+    Args:
+        'token' : str
+
+    Returns:
+        list of str
+    """
+    return [token[i:i+CHUNK_SIZE] for i in range(0, len(token), CHUNK_SIZE)]
+
+
+
+
+def micro_delta(primary: list, secondary: list) -> dict:
+    """
+    Splits each primary token into CHUNK_SIZE char chunks
+    and returns the chunks which are not substrings of the
+    joined secondary tokens.
+
+    Args:
+        'primary'   : list of str,
+        'secondary' : list of str
+
+    Returns:
+        'delta_parsed'      : list,
+        'delta_parsed_diff' : list
+    """
+
+    # setting defaults
+    delta_parsed = []
+    delta_parsed_diff = []
+    secondary_str = ''.join(str(i) for i in secondary)
+    found = {}
+
+    # breaking tokens into chunks
+    for token in primary:
+        delta_parsed += chunk_token(token)
+
+    # build substring sets lazily (by length) when
+    # repeated `in` scans would be too expensive
+    use_sets = len(delta_parsed) * len(secondary_str) > SUBSTRING_SET_THRESHOLD
+    substrings = {}
+
+    # checking if each unique chunk is in secondary_str
+    for block in delta_parsed:
+        if block == '':
+            continue
+        present = found.get(block)
+        if present is None:
+            if use_sets:
+                size = len(block)
+                if size not in substrings:
+                    substrings[size] = {
+                        secondary_str[i:i+size]
+                        for i in range(0, len(secondary_str) - size + 1)
+                    }
+                present = block in substrings[size]
+            else:
+                present = block in secondary_str
+            found[block] = present
+        if not present:
+            delta_parsed_diff.append(block)
+
+    # formatting data
+    data = {
+        "delta_parsed": delta_parsed,
+        "delta_parsed_diff": delta_parsed_diff,
+    }
+
+    return data
+
+
+
+
+def count_matches(a: list, b: list) -> int:
+    """
+    Counts the matching elements between sequences a & b
+    using histogram diff: trim common prefix & suffix, then
+    anchor on the longest match around the elements which
+    are least frequent in *both* regions (as git's histogram
+    & patience diffs do), and repeat on each side.
+
+    Args:
+        'a' : list of hashable,
+        'b' : list of hashable
+
+    Returns:
+        int
+    """
+    matches = 0
+    stack = [(0, len(a), 0, len(b))]
+
+    while stack:
+        a0, a1, b0, b1 = stack.pop()
+
+        # trim common prefix & suffix
+        while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+            a0 += 1; b0 += 1; matches += 1
+        while a0 < a1 and b0 < b1 and a[a1-1] == b[b1-1]:
+            a1 -= 1; b1 -= 1; matches += 1
+        if a0 == a1 or b0 == b1:
+            continue
+
+        anchor = find_anchor(a, b, a0, a1, b0, b1)
+        if anchor is None:
+            continue
+        i0, i1, j0, j1 = anchor
+        matches += i1 - i0
+
+        # recurse on each side
+        stack.append((a0, i0, b0, j0))
+        stack.append((i1, a1, j1, b1))
+
+    return matches
+
+
+
+
+def find_anchor(a: list, b: list, a0: int, a1: int, b0: int, b1: int) -> tuple:
+    """
+    Picks the elements common to both regions with the 
+    lowest (max, total) occurrence counts & returns the
+    longest match through any of their occurrence pairs,
+    evaluating at most ANCHOR_PAIR_LIMIT pairs.
+
+    Args:
+        'a', 'b'    : list of hashable,
+        'a0', 'a1'  : int, region of a,
+        'b0', 'b1'  : int, region of b
+
+    Returns:
+        tuple (i0, i1, j0, j1) or None if nothing matches
+    """
+    # histograms of both regions
+    counts_a = Counter(a[a0:a1])
+    counts_b = Counter(b[b0:b1])
+    best = None
+    for item, cb in counts_b.items():
+        ca = counts_a.get(item)
+        if ca:
+            key = (max(ca, cb), ca + cb)
+            if best is None or key < best:
+                best = key
+    if best is None:
+        return None
+    candidates = {
+        item for item, cb in counts_b.items()
+        if counts_a.get(item) and (max(counts_a[item], cb), counts_a[item] + cb) == best
+    }
+
+    # positions of the candidates in a
+    positions = {}
+    for i in range(a0, a1):
+        if a[i] in candidates:
+            positions.setdefault(a[i], []).append(i)
+
+    # longest extended match, skipping pairs which lie 
+    # on a run that was already extended
+    anchor = None
+    runs = {}
+    pairs = 0
+    for j in range(b0, b1):
+        if b[j] not in candidates:
+            continue
+        for i in positions[b[j]]:
+            if any(r0 <= j < r1 for r0, r1 in runs.get(i - j, ())):
+                continue
+            pairs += 1
+            i0, j0 = i, j
+            while i0 > a0 and j0 > b0 and a[i0-1] == b[j0-1]:
+                i0 -= 1; j0 -= 1
+            i1, j1 = i + 1, j + 1
+            while i1 < a1 and j1 < b1 and a[i1] == b[j1]:
+                i1 += 1; j1 += 1
+            runs.setdefault(i - j, []).append((j0, j1))
+            if anchor is None or i1 - i0 > anchor[1] - anchor[0]:
+                anchor = (i0, i1, j0, j1)
+            if pairs >= ANCHOR_PAIR_LIMIT:
+                return anchor
+    return anchor
+
+
+
+
+def similarity(a: list, b: list) -> float:
+    """
+    Ratio of matching elements between a & b,
+    (2 * matches) / (len(a) + len(b)).
+
+    Args:
+        'a' : list of hashable,
+        'b' : list of hashable
+
+    Returns:
+        float (0-1)
+    """
+    total = len(a) + len(b)
+    if total == 0:
+        return 1.0
+    return (2.0 * count_matches(a, b)) / total
+
+
+
+
+def diff_html(pre: TokenStream, post: TokenStream) -> dict:
+    """
+    Builds the `html_delta` data for the passed token streams.
+
+    Args:
+        'pre'   : `TokenStream`,
+        'post'  : `TokenStream`
+
+    Returns:
+        'num_html_delta'    : int,
+        'delta_html_post'   : list,
+        'delta_html_pre'    : list,
+        'num_html_ratio'    : float,
+        'pre_micro_delta'   : dict,
+        'post_micro_delta'  : dict,
+    """
+
+    # calculate macro difference
+    num_html_delta = len(pre) - len(post)
+    num_html_ratio = len(pre) / len(post)
+    if num_html_ratio > 1:
+        num_html_ratio = len(post) / len(pre)
+
+    # membership via hashed sets, re-reading 
+    # the spooled tokens in order
+    pre_set = set(pre.hashes)
+    post_set = set(post.hashes)
+    delta_html_post = [t for t, h in zip(post, post.hashes) if h not in pre_set]
+    delta_html_pre = [t for t, h in zip(pre, pre.hashes) if h not in post_set]
+
+    # formatting data
+    data = {
+        "num_html_delta": num_html_delta,
+        "delta_html_post": delta_html_post,
+        "delta_html_pre": delta_html_pre,
+        "num_html_ratio": num_html_ratio if num_html_ratio >= 0 else 0,
+        "pre_micro_delta": micro_delta(delta_html_pre, delta_html_post),
+        "post_micro_delta": micro_delta(delta_html_post, delta_html_pre),
+    }
+
+    return data
+
+
+
+
+# elements without a closing tag
+VOID_TAGS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen',
+    'link', 'meta', 'param', 'source', 'track', 'wbr',
+])
+
+
+# max items reported in each tree delta list
+TREE_MAX_ITEMS = 500
+
+
+
+
+class Node():
+    """
+    Lightweight DOM node with a Merkle style `hash` covering
+    its tag, sorted attributes, normalized text & children.
+    """
+
+    __slots__ = ('tag', 'attrs', 'text', 'children', 'hash', 'size')
+
+    def __init__(self, tag: str, attrs: tuple=(), text: str=None):
+        self.tag = tag
+        self.attrs = attrs
+        self.text = text
+        self.children = []
+        self.hash = None
+        self.size = 1
+
+    def signature(self) -> tuple:
+        return (self.tag, self.attrs, self.text)
+
+
+
+
+class TreeBuilder(HTMLParser):
+    """
+    Incremental html parser which builds a `Node` tree.
+    Feed it chunks or lines, then call `close_tree()`.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node('#document')
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = tuple(sorted((k, ' '.join((v or '').split())) for k, v in attrs))
+        # skip per-request tokens (see HTML_WHITE_LIST)
+        if any('csrfmiddlewaretoken' in v for k, v in attrs):
+            return
+        node = Node(tag, attrs)
+        self.stack[-1].children.append(node)
+        if tag not in VOID_TAGS:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.stack[-1].tag == tag:
+            self.stack.pop()
+
+    def handle_endtag(self, tag):
+        # close up to the matching open tag, ignoring strays
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                return
+
+    def handle_data(self, data):
+        text = ' '.join(data.split())
+        if text:
+            self.stack[-1].children.append(Node('#text', text=text))
+
+    def close_tree(self) -> Node:
+        self.close()
+        hash_tree(self.root)
+        return self.root
+
+
+
+
+def hash_tree(root: Node) -> None:
+    """
+    Computes `hash` & `size` for every node (post-order).
+
+    Args:
+        'root' : `Node`
+
+    Returns:
+        None
+    """
+    stack = [(root, False)]
+    while stack:
+        node, visited = stack.pop()
+        if not visited:
+            stack.append((node, True))
+            stack += [(child, False) for child in node.children]
+            continue
+        h = blake2b(digest_size=8)
+        h.update(repr(node.signature()).encode('utf-8', 'surrogatepass'))
+        for child in node.children:
+            h.update(child.hash)
+        node.hash = h.digest()
+        node.size = 1 + sum(child.size for child in node.children)
+
+
+
+
+def dump_tree(root: Node) -> bytes:
+    """
+    Serializes the tree as a flat pre-order list of
+    [tag, attrs, text, child count] (no recursion).
+
+    Args:
+        'root' : `Node`
+
+    Returns:
+        bytes
+    """
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append([node.tag, node.attrs, node.text, len(node.children)])
+        stack += reversed(node.children)
+    return json.dumps(nodes, separators=(',', ':')).encode('utf-8', 'surrogatepass')
+
+
+
+
+def load_tree(data: bytes) -> Node:
+    """
+    Rebuilds & re-hashes a tree serialized by `dump_tree()`.
+
+    Args:
+        'data' : bytes
+
+    Returns:
+        `Node`
+    """
+    nodes = json.loads(data.decode('utf-8', 'surrogatepass'))
+    root = None
+    # (parent, remaining children) for open nodes
+    stack = []
+    for tag, attrs, text, count in nodes:
+        node = Node(tag, tuple(tuple(a) for a in attrs), text)
+        if root is None:
+            root = node
+        else:
+            parent = stack[-1]
+            parent[0].children.append(node)
+            parent[1] -= 1
+            if parent[1] == 0:
+                stack.pop()
+        if count:
+            stack.append([node, count])
+    hash_tree(root)
+    return root
+
+
+
+
+def feed_lines(lines: iter, builder: TreeBuilder) -> iter:
+    """
+    Feeds each line to the builder while passing it 
+    through (lets one stream build tokens & a tree).
+
+    Args:
+        'lines'     : iterable of str,
+        'builder'   : `TreeBuilder`
+
+    Returns:
+        generator of str
+    """
+    for line in lines:
+        builder.feed(line + '\n')
+        yield line
+
+
+
+
+def _child_paths(path: str, children: list) -> list:
+    # xpath style paths indexed among same-tag siblings
+    counts = {}
+    paths = []
+    for child in children:
+        counts[child.tag] = counts.get(child.tag, 0) + 1
+        name = 'text()' if child.tag == '#text' else child.tag
+        paths.append(f'{path}/{name}[{counts[child.tag]}]')
+    return paths
+
+
+
+
+def _summary(node: Node, path: str) -> dict:
+    return {
+        'path': path,
+        'tag': node.tag,
+        'size': node.size,
+        'text': node.text[:120] if node.text else None,
+        'hash': node.hash.hex(),
+    }
+
+
+
+
+def _longest_increasing(pairs: list) -> set:
+    # indexes of pairs whose 2nd item forms the longest
+    # increasing subsequence (patience sorting)
+    tails, tails_idx, prev = [], [], [None] * len(pairs)
+    for i, (_, j) in enumerate(pairs):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tails[mid] < j:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(tails):
+            tails.append(j); tails_idx.append(i)
+        else:
+            tails[lo] = j; tails_idx[lo] = i
+        prev[i] = tails_idx[lo - 1] if lo > 0 else None
+    keep = set()
+    i = tails_idx[-1] if tails_idx else None
+    while i is not None:
+        keep.add(i)
+        i = prev[i]
+    return keep
+
+
+
+
+def diff_trees(pre: Node, post: Node) -> dict:
+    """
+    Structural diff of two `Node` trees. Identical subtrees 
+    (equal hashes) are skipped in O(1); remaining children are 
+    aligned by hash, then by tag, and unmatched nodes are 
+    reported as inserted / deleted, or moved when an identical 
+    subtree appears elsewhere in the other document.
+
+    Args:
+        'pre'   : `Node`,
+        'post'  : `Node`
+
+    Returns:
+        'similarity'    : float (0-1),
+        'pre_nodes'     : int,
+        'post_nodes'    : int,
+        'inserted'      : list,
+        'deleted'       : list,
+        'moved'         : list,
+        'changed'       : list,
+        'truncated'     : bool
+    """
+
+    # setting defaults
+    matched = 0
+    inserted = []
+    deleted = []
+    moved = []
+    changed = []
+    stack = [(pre, post, '', '')]
+
+    while stack:
+        a, b, a_path, b_path = stack.pop()
+
+        # identical subtree
+        if a.hash == b.hash:
+            matched += a.size
+            continue
+
+        # the node pair itself
+        if a.signature() == b.signature():
+            matched += 1
+        else:
+            changed.append({
+                'pre_path': a_path or '/',
+                'post_path': b_path or '/',
+                'tag': b.tag,
+                'pre_attrs': dict(a.attrs),
+                'post_attrs': dict(b.attrs),
+                'pre_text': a.text[:120] if a.text else None,
+                'post_text': b.text[:120] if b.text else None,
+            })
+
+        # child paths for this pair
+        a_paths = _child_paths(a_path, a.children)
+        b_paths = _child_paths(b_path, b.children)
+
+        # align children with identical hashes
+        b_by_hash = {}
+        for j, child in enumerate(b.children):
+            b_by_hash.setdefault(child.hash, deque()).append(j)
+        pairs = []
+        for i, child in enumerate(a.children):
+            js = b_by_hash.get(child.hash)
+            if js:
+                pairs.append((i, js.popleft()))
+
+        # out of order identical children are moves
+        keep = _longest_increasing(pairs)
+        a_used, b_used = set(), set()
+        for k, (i, j) in enumerate(pairs):
+            a_used.add(i); b_used.add(j)
+            matched += a.children[i].size
+            if k not in keep:
+                moved.append({
+                    'tag': a.children[i].tag,
+                    'size': a.children[i].size,
+                    'from': a_paths[i],
+                    'to': b_paths[j],
+                    'hash': a.children[i].hash.hex(),
+                })
+
+        # pair the remaining children by tag (in order) & descend
+        b_by_tag = {}
+        for j in range(len(b.children)):
+            if j not in b_used:
+                b_by_tag.setdefault(b.children[j].tag, deque()).append(j)
+        for i, child in enumerate(a.children):
+            if i in a_used:
+                continue
+            js = b_by_tag.get(child.tag)
+            if js:
+                j = js.popleft()
+                b_used.add(j)
+                stack.append((child, b.children[j], a_paths[i], b_paths[j]))
+            else:
+                deleted.append((child, a_paths[i]))
+        for j, child in enumerate(b.children):
+            if j not in b_used:
+                inserted.append((child, b_paths[j]))
+
+    # deleted & inserted identical subtrees are moves
+    inserted_by_hash = {}
+    for k, (node, path) in enumerate(inserted):
+        inserted_by_hash.setdefault(node.hash, deque()).append(k)
+    moved_inserts = set()
+    remaining_deleted = []
+    for node, path in deleted:
+        ks = inserted_by_hash.get(node.hash)
+        if ks:
+            k = ks.popleft()
+            moved_inserts.add(k)
+            matched += node.size
+            moved.append({
+                'tag': node.tag,
+                'size': node.size,
+                'from': path,
+                'to': inserted[k][1],
+                'hash': node.hash.hex(),
+            })
+        else:
+            remaining_deleted.append((node, path))
+    inserted = [
+        _summary(node, path) for k, (node, path) in enumerate(inserted)
+        if k not in moved_inserts
+    ]
+    deleted = [_summary(node, path) for node, path in remaining_deleted]
+
+    # score
+    total = pre.size + post.size
+    score = (2.0 * matched / total) if total else 1.0
+
+    # formatting data
+    truncated = any(len(l) > TREE_MAX_ITEMS for l in (inserted, deleted, moved, changed))
+    data = {
+        'similarity': min(score, 1.0),
+        'pre_nodes': pre.size,
+        'post_nodes': post.size,
+        'inserted': inserted[:TREE_MAX_ITEMS],
+        'deleted': deleted[:TREE_MAX_ITEMS],
+        'moved': moved[:TREE_MAX_ITEMS],
+        'changed': changed[:TREE_MAX_ITEMS],
+        'truncated': truncated,
+    }
+
+    return data
@@ -3,12 +3,84 @@ from selenium.webdriver.common.actions.action_builder import ActionBuilder
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.firefox.firefox_profile import FirefoxProfile
 from .devices import get_device
-from datetime import datetime
+from cursion import settings
 import time, os, sys, tempfile
 
 
 
 
+# in-page readiness probe tracking DOM mutations, long tasks,
+# finished resources, & in-flight fetch/XHR requests
+READINESS_PROBE_SCRIPT = (
+    """
+    (function () {
+        if (window.__cursionReady) return;
+        var r = window.__cursionReady = {
+            inflight: 0, mutation: 0, longtask: 0, 
+            resource: 0, longtasks: 0, resources: 0
+        };
+        var now = function () { return performance.now(); };
+        var done = function () { r.inflight = Math.max(0, r.inflight - 1); r.resource = now(); };
+        try {
+            new MutationObserver(function () { r.mutation = now(); }).observe(
+                document, {subtree: true, childList: true, attributes: true, characterData: true}
+            );
+        } catch (e) {}
+        try {
+            new PerformanceObserver(function (list) {
+                list.getEntries().forEach(function (e) {
+                    r.longtask = Math.max(r.longtask, e.startTime + e.duration); r.longtasks++;
+                });
+            }).observe({type: 'longtask', buffered: true});
+        } catch (e) {}
+        try {
+            new PerformanceObserver(function (list) {
+                list.getEntries().forEach(function (e) {
+                    r.resource = Math.max(r.resource, e.responseEnd || (e.startTime + e.duration)); r.resources++;
+                });
+            }).observe({type: 'resource', buffered: true});
+        } catch (e) {}
+        try {
+            var _fetch = window.fetch;
+            if (_fetch) {
+                window.fetch = function () {
+                    r.inflight++;
+                    return _fetch.apply(this, arguments).then(
+                        function (res) { done(); return res; },
+                        function (err) { done(); throw err; }
+                    );
+                };
+            }
+            var _send = XMLHttpRequest.prototype.send;
+            XMLHttpRequest.prototype.send = function () {
+                r.inflight++;
+                this.addEventListener('loadend', done);
+                return _send.apply(this, arguments);
+            };
+        } catch (e) {}
+    })();
+    """
+)
+READINESS_STATUS_SCRIPT = (
+    """
+    var r = window.__cursionReady;
+    if (!r) return null;
+    var t = performance.now();
+    return {
+        ready: document.readyState,
+        inflight: r.inflight,
+        network_quiet: t - r.resource,
+        cpu_quiet: t - r.longtask,
+        dom_quiet: t - r.mutation,
+        long_tasks: r.longtasks,
+        resources: r.resources
+    };
+    """
+)
+
+
+
+
 
 
 def driver_init(
@@ -131,6 +203,16 @@ def driver_init(
         # init driver
         driver = webdriver.Edge(options=options)
 
+    # registering readiness probe for every new document
+    if browser == 'chrome' or browser == 'edge':
+        try:
+            driver.execute_cdp_cmd(
+                'Page.addScriptToEvaluateOnNewDocument', 
+                {'source': READINESS_PROBE_SCRIPT}
+            )
+        except Exception as e:
+            print(e)
+
     # resizing window
     driver.maximize_window()
     driver.set_window_size(width, height)
@@ -190,9 +272,16 @@ def driver_wait(
         min_wait_time: int=3
     ) -> bool:
     """
-    Expects the driver instance and waits 
-    for either the page to fully load or the max_wait_time
-    to expire before returning.
+    Expects the driver instance and waits until the page 
+    is quiescent (document complete, no in-flight fetch/XHR, 
+    no recent resource loads, long tasks, or DOM mutations) 
+    or the max_wait_time expires before returning. 
+
+    Falls back to polling `document.readyState` every 
+    `interval` after `min_wait_time` when the readiness 
+    probe cannot be used.
+
+    The measurement is stored as `driver.readiness`.
 
     Args:
         'driver'        : object, 
@@ -207,52 +296,100 @@ def driver_wait(
         # simulate mouse movement
         action = ActionBuilder(driver)
         action.pointer_action.move_to_location(0, 0)
-        action.perform()
-        # wait for 1s
-        time.sleep(0.5)
         action.pointer_action.move_to_location(0, 50)
-        action.perform()
-        # wait for 1s
-        time.sleep(0.5)
         action.pointer_action.move_to_location(0, 0)
         action.perform()
         return
 
-    resolved = False
-    page_state = 'loading'
-    wait_time = 0
-
-    # min_wait_time before checking page status
-    time.sleep(int(min_wait_time))
-
-    while int(wait_time) < int(max_wait_time) and page_state != 'complete':
+    def get_status(driver):
+        # read probe state, injecting it if missing
+        status = driver.execute_script(READINESS_STATUS_SCRIPT)
+        if status is None:
+            driver.execute_script(READINESS_PROBE_SCRIPT)
+            status = driver.execute_script(READINESS_STATUS_SCRIPT)
+        return status
 
-        # get current timestamp
-        pre_check_time = datetime.now()
-        
-        # wait 1 sec or <interval:int> sec 
-        time.sleep(int(interval))
+    # setting defaults
+    interval = float(interval or 1)
+    max_wait_time = float(max_wait_time or 30)
+    min_wait_time = float(min_wait_time or 3)
+    quiet_time = settings.READINESS_QUIET_MS / 1000
+    settle_time = settings.READINESS_DOM_SETTLE_TIME
+    poll_time = settings.READINESS_POLL_MS / 1000
+    resolved = False
+    method = 'probe'
+    status = {}
+    complete_at = None
+    start_time = time.monotonic()
 
+    # wait for a quiet window using the in-page probe
+    while (time.monotonic() - start_time) < max_wait_time:
         try:
-            page_state = driver.execute_script('return document.readyState')
+            status = get_status(driver) or {}
         except Exception as e:
             print(e)
+            status = {}
+        
+        # probe unavailable, use readyState polling
+        if not status:
+            method = 'fallback'
+            break
+
+        if status.get('ready') == 'complete':
+            complete_at = complete_at or time.monotonic()
+            network_quiet = (
+                status.get('inflight', 0) == 0 and 
+                status.get('network_quiet', 0) >= quiet_time * 1000
+            )
+            cpu_quiet = status.get('cpu_quiet', 0) >= quiet_time * 1000
+            dom_quiet = (
+                status.get('dom_quiet', 0) >= quiet_time * 1000 or
+                (time.monotonic() - complete_at) >= settle_time
+            )
+            if network_quiet and cpu_quiet and dom_quiet:
+                resolved = True
+                break
+        
+        time.sleep(poll_time)
 
-        # get time after waiting for script
-        post_check_time = datetime.now()
+    # fallback to readyState polling
+    if method == 'fallback':
+        page_state = 'loading'
 
-        # get seconds between checks
-        time_to_add = (post_check_time - pre_check_time).total_seconds()
+        # min_wait_time before checking page status
+        time.sleep(min(min_wait_time, max_wait_time))
 
-        print(f'document state is {page_state}')
-        if page_state == 'complete':
-            resolved = True
-        
-        wait_time += time_to_add
+        while (time.monotonic() - start_time) < max_wait_time and page_state != 'complete':
+            
+            # wait 1 sec or <interval:int> sec 
+            time.sleep(interval)
+
+            try:
+                page_state = driver.execute_script('return document.readyState')
+            except Exception as e:
+                print(e)
+
+            print(f'document state is {page_state}')
+            if page_state == 'complete':
+                resolved = True
     
+    # record measurement on driver
+    driver.readiness = {
+        'resolved': resolved,
+        'method': method,
+        'seconds': round(time.monotonic() - start_time, 3),
+        'timed_out': not resolved,
+        'long_tasks': status.get('long_tasks'),
+        'resources': status.get('resources'),
+    }
+    print(f'page readiness -> {driver.readiness}')
+
     # interacting with page if available
     if resolved:
-        interact_with_page(driver)
+        try:
+            interact_with_page(driver)
+        except Exception as e:
+            print(e)
 
     return resolved
 
@@ -1,8 +1,9 @@
 from .driver import driver_init, driver_wait, quit_driver
 from PIL import Image as I
 from .alerts import sendgrid_email
+from .storage import upload_bytes
 from cursion import settings
-import time, boto3, os
+import time, io
 
 
 
@@ -24,14 +25,6 @@ def create_and_send_report_export(report_id: id, email: str, first_name: str) ->
         'error'   : str any error msg from cursion server
     """
 
-    # setting up s3 client
-    s3 = boto3.client(
-        's3', aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-        aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-        region_name=str(settings.AWS_S3_REGION_NAME), 
-        endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
-    )
-
     # init driver
     driver = driver_init(scale_factor=1)
 
@@ -46,18 +39,14 @@ def create_and_send_report_export(report_id: id, email: str, first_name: str) ->
     full_page_height = driver.execute_script("return document.scrollingElement.scrollHeight;")
     driver.set_window_size(1260, int(full_page_height)) # 1512 x full_page
 
-    # taking screenshot
-    driver.save_screenshot(f'{report_id}.png')
+    # taking screenshot in memory
+    screenshot = driver.get_screenshot_as_png()
 
     # quitting driver
     quit_driver(driver)
 
-    # setting up paths
-    image = os.path.join(settings.BASE_DIR, f'{report_id}.png')
-    pdf = os.path.join(settings.BASE_DIR, f'{report_id}.pdf')
-
     # resizing image to remove excess | expected height => 2353
-    img = I.open(image)
+    img = I.open(io.BytesIO(screenshot))
     width, height = img.size
 
     # Validate crop bounds
@@ -67,26 +56,14 @@ def create_and_send_report_export(report_id: id, email: str, first_name: str) ->
     bottom = max(0, height - 330)
 
     cropped_img = img.crop((left, top, right, bottom))
-    cropped_img.save(image, quality=95)
 
     # Convert to PDF
-    img = I.open(image)
-    pdf_img = img.convert('RGB')
-    pdf_img.save(pdf)
+    pdf = io.BytesIO()
+    cropped_img.convert('RGB').save(pdf, format='PDF')
 
     # uploading to s3
     remote_path = f'static/landing/reports/{report_id}.pdf' # -> .png
-    report_url = f'{settings.AWS_S3_URL_PATH}/{remote_path}'
-
-    # upload to s3
-    with open(pdf, 'rb') as data: # -> image
-        s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME), 
-            remote_path, ExtraArgs={'ACL': 'public-read', 'ContentType': 'application/pdf'}
-        )
-
-    # removing local copies
-    os.remove(image)
-    os.remove(pdf)
+    report_url = upload_bytes(pdf.getvalue(), remote_path, content_type='application/pdf')
     
     # setting up email to prospect
     pre_content = 'The Cursion performance report you requested has finished processing. \
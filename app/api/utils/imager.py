@@ -1,14 +1,23 @@
-from .driver import driver_init, driver_wait, quit_driver
+from .driver import driver_wait
+from .pool import lease_driver, release_driver
 from ..models import Mask
-from skimage.metrics import structural_similarity
 from cursion import settings
-from PIL import Image as I, ImageChops, ImageStat
+from PIL import Image as I
 from datetime import datetime
 from openai import OpenAI
 from pydantic import BaseModel
 from .meter import meter_account
-import time, os, uuid, boto3, \
-    base64, shutil, numpy, cv2, requests
+from .cacher import get_cacher
+from .storage import (
+    upload_bytes, upload_file, upload_many, 
+    download_bytes, download_file
+)
+from .tiler import (
+    decode_image, crop_to_match, compare_images, 
+    draw_boxes, image_hashes, hashes_match, region_boxes
+)
+import time, os, uuid, \
+    base64, shutil, cv2, requests
 
 
 
@@ -52,14 +61,12 @@ class Imager():
         
         # main image_array for scans
         self.image_array = []
+
+        # masked element regions for scans
+        self.mask_regions = []
         
-        # setup boto3 configurations
-        self.s3 = boto3.client(
-            's3', aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-            aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-            region_name=str(settings.AWS_S3_REGION_NAME), 
-            endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
-        )
+        # cache for artifacts derived from each scan
+        self.cacher = get_cacher()
 
         # scripts
         self.pause_video_script = (
@@ -83,6 +90,19 @@ class Imager():
             document.head.appendChild(styleElement);
             """
         )
+        self.mask_script = (
+            """
+            const el = document.getElementById(arguments[0]);
+            if (!el) { return null; }
+            const r = el.getBoundingClientRect();
+            const d = window.devicePixelRatio || 1;
+            el.style.visibility = 'hidden';
+            return {
+                x: (r.left + window.scrollX) * d, y: (r.top + window.scrollY) * d,
+                width: r.width * d, height: r.height * d
+            };
+            """
+        )
         self.pause_stretch = (
             """
             (() => {
@@ -131,27 +151,33 @@ class Imager():
 
 
     
-    def save_image(self, pic_id: str, image: str) -> None:
+    def save_image(self, pic_id: str, image: str=None, data: bytes=None) -> None:
         """
         Upload image to s3, save info as image_obj,
         add image_obj to image_array, & remove image file
 
         Args:
             pic_id: str,
-            image: str
+            image: str (local path, if not passing data),
+            data: bytes (in-memory png)
 
         Returns:
             None
         """
         remote_path = f'static/sites/{self.scan.site.id}/{self.scan.page.id}/{self.scan.id}/{pic_id}.png'
-        root_path = settings.AWS_S3_URL_PATH
-        image_url = f'{root_path}/{remote_path}'
+
+        # hash for the test_vrt() fast path
+        hashes = None
+        try:
+            hashes = image_hashes(decode_image(data if data is not None else image))
+        except Exception as e:
+            print(f'unable to hash image -> {e}')
     
         # upload to s3
-        with open(image, 'rb') as data:
-            self.s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME), 
-                remote_path, ExtraArgs={'ACL': 'public-read', 'ContentType': "image/png"}
-            )
+        if data is not None:
+            image_url = upload_bytes(data, remote_path, content_type='image/png')
+        else:
+            image_url = upload_file(image, remote_path, content_type='image/png')
     
         # create image obj and add to list
         img_obj = {
@@ -159,13 +185,16 @@ class Imager():
             "id": str(pic_id),
             "url": image_url,
             "path": remote_path,
+            "hashes": hashes,
+            "regions": self.mask_regions,
         }
         self.image_array.append(img_obj)
 
         print(f'adding {img_obj["url"]} to image_array')
         
         # remove local copy
-        os.remove(image)
+        if data is None:
+            os.remove(image)
 
         return None
 
@@ -176,15 +205,21 @@ class Imager():
             self, 
             pre_img_id: id=None, 
             post_img_id: id=None, 
-            index: int=0
+            index: int=0,
+            pre_data: bytes=None,
+            post_data: bytes=None
         ) -> dict:
         """ 
-        Saves two images to test.id path in S3 bucket
+        Saves two images to test.id path in S3 bucket, from 
+        memory when `pre_data` & `post_data` are passed or 
+        from the local temp_root otherwise
 
         Args:
             pre_img_id  : uuid,
             post_img_id : uuid,
-            index       : int
+            index       : int,
+            pre_data    : bytes (optional png),
+            post_data   : bytes (optional png)
 
         Returns:
             img_objs : list
@@ -200,25 +235,29 @@ class Imager():
             remote_root = f'static/caseruns/{self.caserun.id}/'
             temp_root = os.path.join(settings.BASE_DIR, f'temp/{self.caserun.id}')
 
+        # upload both images concurrently 
         image_ids = [pre_img_id, post_img_id]
+        image_data = [pre_data, post_data]
+        uploads = []
+        for img_id, data in zip(image_ids, image_data):
+            upload = {
+                'remote_path': f'{remote_root}{img_id}.png',
+                'content_type': 'image/png',
+            }
+            if data is not None:
+                upload['data'] = data
+            else:
+                upload['path'] = os.path.join(temp_root, f'{img_id}.png')
+            uploads.append(upload)
+        urls = upload_many(uploads)
+
+        # building img objs
         img_objs = []
-        for img_id in image_ids:
-            image = os.path.join(temp_root, f'{img_id}.png')
-            remote_path = f'{remote_root}{img_id}.png'
-            root_path = settings.AWS_S3_URL_PATH
-            image_url = f'{root_path}/{remote_path}'
-        
-            # upload to s3
-            with open(image, 'rb') as data:
-                self.s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME), 
-                    remote_path, ExtraArgs={'ACL': 'public-read', 'ContentType': "image/png"}
-                )
-            
-            # building img obj
+        for img_id, upload, url in zip(image_ids, uploads, urls):
             img_objs.append({
                 "id": str(img_id),
-                "url": image_url,
-                "path": remote_path,
+                "url": url,
+                "path": upload['remote_path'],
                 "index": index,
             })
             
@@ -230,16 +269,20 @@ class Imager():
     def download_image(
             self, 
             url: str=None, 
-            temp_root: str=None
+            temp_root: str=None,
+            scan_id: str=None
         ) -> dict:
         """ 
-        Parses image info and downloads image to local temp_root
+        Parses image info and downloads image to local temp_root,
+        reusing the cached bytes when `scan_id` is passed
 
         Args:
             'url'       : str, image url,
-            'temp_root' : str, local temp dir
+            'temp_root' : str, local temp dir,
+            'scan_id'   : str, owning `Scan` (optional)
 
         Returns:
+            'url'           : str, image url,
             'name'          : str, image name,
             'id'            : str, image id,
             'remote_path'   : str, remote path,
@@ -250,15 +293,25 @@ class Imager():
         remote_path = f'static{url.split('static')[1]}'
         local_path = os.path.join(temp_root, image_name)
 
-        with open(local_path, 'wb') as data:
-            self.s3.download_fileobj(
-                settings.AWS_STORAGE_BUCKET_NAME, 
-                remote_path, 
-                data
-            )
+        # checking cache
+        cached = None
+        if scan_id and self.cacher:
+            cached = self.cacher.get(scan_id, 'image', url)
+
+        if cached is not None:
+            with open(local_path, 'wb') as data:
+                data.write(cached)
+        elif scan_id and self.cacher:
+            data = download_bytes(remote_path)
+            with open(local_path, 'wb') as f:
+                f.write(data)
+            self.cacher.put(scan_id, 'image', url, data)
+        else:
+            download_file(remote_path, local_path)
 
         # return data
         return {
+            'url': url,
             'name': image_name,
             'id': image_id,
             'remote_path': remote_path,
@@ -268,153 +321,176 @@ class Imager():
 
 
 
-    def highlight_diffs(
-            self, 
-            temp_root: str=None,
-            pre_img_path: str=None, 
-            post_img_path: str=None, 
-            index: int=None
-        ) -> dict:
+    def gray_image(
+            self,
+            scan_id: str=None,
+            url: str=None,
+            image: object=None
+        ) -> object:
         """
-        Runs SSIM comparision and highlights 
-        differences between two passed images
+        Returns the grayscale array of the decoded (uncropped) 
+        image, reusing the cached array when available
 
         Args:
-            temp_root     : str,
-            pre_img_path  : str,
-            post_img_path : str,
-            index         : int
+            scan_id : str, owning `Scan`,
+            url     : str, image url,
+            image   : numpy.ndarray, decoded BGR image
 
         Returns:
-            img_objs   : dict,
-            ssim_score : float
+            numpy.ndarray or None if caching is disabled
         """
-        # Load the images
-        image1 = cv2.imread(pre_img_path)
-        image2 = cv2.imread(post_img_path)
+        if not self.cacher:
+            return None
+        gray = self.cacher.get_array(scan_id, 'image_gray', url)
+        if gray is None or gray.shape != image.shape[:2]:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            self.cacher.put_array(scan_id, 'image_gray', url, gray)
+        return gray
 
-        # Convert the images to grayscale
-        gray1 = cv2.cvtColor(image1, cv2.COLOR_BGR2GRAY)
-        gray2 = cv2.cvtColor(image2, cv2.COLOR_BGR2GRAY)
 
-        # Compute the SSIM map
-        (ssim_score, diff) = structural_similarity(gray1, gray2, full=True)
 
-        # Highlight the differences
-        diff = (diff * 255).astype("uint8")
 
-        # Threshold the difference map
-        _, thresh = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    def decode_pair(
+            self,
+            pre_img_info: dict=None,
+            post_img_info: dict=None,
+            pre_scan_id: str=None,
+            post_scan_id: str=None
+        ) -> tuple:
+        """
+        Decodes both downloaded images once and crops them to
+        the same size, re-writing any cropped local copy.
+        Grayscale arrays are reused from the cache when the
+        owning `Scan` ids are passed
 
-        # Find contours of the differences
-        contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        Args:
+            pre_img_info  : dict (from download_image()),
+            post_img_info : dict (from download_image()),
+            pre_scan_id   : str (optional),
+            post_scan_id  : str (optional)
 
-        # Draw rectangles around the differences
-        for contour in contours:
-            (x, y, w, h) = cv2.boundingRect(contour)
-            cv2.rectangle(image1, (x, y), (x+w, y+h), (0, 255, 0), 2)
-            cv2.rectangle(image2, (x, y), (x+w, y+h), (0, 255, 0), 2)
+        Returns:
+            tuple (pre_img, post_img, pre_gray, post_gray)
+        """
+        pre_img = decode_image(pre_img_info.get('local_path'))
+        post_img = decode_image(post_img_info.get('local_path'))
+        pre_shape, post_shape = pre_img.shape, post_img.shape
+
+        # grayscale of the uncropped images
+        pre_gray, post_gray = None, None
+        if pre_scan_id:
+            pre_gray = self.gray_image(pre_scan_id, pre_img_info.get('url'), pre_img)
+        if post_scan_id:
+            post_gray = self.gray_image(post_scan_id, post_img_info.get('url'), post_img)
+
+        # check and crop image sizes if necessary
+        pre_img, post_img = crop_to_match(pre_img, post_img)
+        if pre_img.shape != pre_shape:
+            print(f'pre_img is larger, adjusting...')
+            cv2.imwrite(pre_img_info.get('local_path'), pre_img)
+        if post_img.shape != post_shape:
+            print(f'post_img is larger, adjusting...')
+            cv2.imwrite(post_img_info.get('local_path'), post_img)
 
-        # Save the output images
-        img_1_id = uuid.uuid4()
-        img_2_id = uuid.uuid4()
-        cv2.imwrite(temp_root + f"/{img_1_id}.png", image1)
-        cv2.imwrite(temp_root + f"/{img_2_id}.png", image2)                    
-        img_objs = self.save_images(img_1_id, img_2_id, index)
-        
-        data = {
-            "img_objs": img_objs,
-            "ssim_score": ssim_score
-        }
+        h, w = pre_img.shape[:2]
+        if pre_gray is not None:
+            pre_gray = pre_gray[:h, :w]
+        if post_gray is not None:
+            post_gray = post_gray[:h, :w]
 
-        return data
+        return pre_img, post_img, pre_gray, post_gray
 
 
 
 
-    def pil_score(
+    def highlight_diffs(
             self, 
+            temp_root: str=None,
             pre_img: object=None, 
-            post_img: object=None
-        ) -> float:
-        """ 
-        Runs pixel ratio comparison on the two 
-        passed images and returns a score.
+            post_img: object=None, 
+            index: int=None,
+            pre_gray: object=None,
+            post_gray: object=None,
+            masks: list=None
+        ) -> dict:
+        """
+        Runs the tiled SSIM, pixel & ORB comparison (see 
+        utils.tiler) and highlights differences between 
+        two decoded images
 
         Args:
-            pre_img  : object,
-            post_img : object,
+            temp_root : str,
+            pre_img   : numpy.ndarray (decoded BGR),
+            post_img  : numpy.ndarray (decoded BGR),
+            index     : int,
+            pre_gray  : numpy.ndarray (optional, pre-decoded),
+            post_gray : numpy.ndarray (optional, pre-decoded),
+            masks     : list of [x0, y0, x1, y1] to ignore
 
-        Returns: 
-            pil_img_score float
+        Returns:
+            img_objs   : dict,
+            ssim_score : float,
+            pil_score  : float,
+            cv2_score  : float,
+            regions    : list
         """
-        try:
-            if (pre_img.mode != post_img.mode) \
-                    or (pre_img.size != post_img.size) \
-                    or (pre_img.getbands() != post_img.getbands()):
-                raise Exception('images are not comparable')
-
-            # Generate diff image in memory.
-            diff_img = ImageChops.difference(pre_img, post_img)
-
-            # Calculate difference as a ratio.
-            stat = ImageStat.Stat(diff_img)
-            diff_ratio = (sum(stat.mean) / (len(stat.mean) * 255)) * 100
-            pil_img_score = (100 - diff_ratio)
-            # print(f'PIL score -> {pil_img_score}')
-            return pil_img_score
+        # Compare tile by tile
+        results = compare_images(pre_img, post_img, pre_gray, post_gray, masks=masks)
+
+        # Score each tile region
+        regions = []
+        for region in results['regions']:
+            regions.append({
+                "y0": region['y0'],
+                "y1": region['y1'],
+                "masked": region['masked'],
+                "skipped": region['skipped'],
+                "score": self.weighted_score(
+                    region['ssim_score'] * 100, 
+                    region['pil_score'], 
+                    region['cv2_score']
+                ),
+            })
+
+        # Draw rectangles around the merged differences
+        draw_boxes(pre_img, results['boxes'])
+        draw_boxes(post_img, results['boxes'])
+
+        # Encode & upload the output images from memory
+        img_1_id = uuid.uuid4()
+        img_2_id = uuid.uuid4()
+        img_objs = self.save_images(
+            img_1_id, img_2_id, index,
+            pre_data=cv2.imencode('.png', pre_img)[1].tobytes(),
+            post_data=cv2.imencode('.png', post_img)[1].tobytes()
+        )
         
-        except Exception as e:
-            print(e)
+        data = {
+            "img_objs": img_objs,
+            "ssim_score": results['ssim_score'],
+            "pil_score": results['pil_score'],
+            "cv2_score": results['cv2_score'],
+            "regions": regions,
+        }
 
+        return data
 
 
-    
-    def cv2_score(
+
+
+    def weighted_score(
             self, 
-            pre_img: object=None, 
-            post_img: object=None
+            ssim_score: float=None, 
+            pil_score: float=None, 
+            cv2_score: float=None
         ) -> float:
-        """ 
-        Runs cv2 ORB Brute-force comparison on the two 
-        passed images and returns a score.
-
-        Args:
-            pre_img  : object,
-            post_img : object,
+        """
+        Weighted average of the ssim, pixel & ORB scores
 
         Returns:
-            cv2_img_score float
+            float (0 - 100)
         """
-        try:
-            orb = cv2.ORB_create()
-
-            # convert to array
-            pre_img_array = numpy.array(pre_img)
-            post_img_array = numpy.array(post_img)
-
-            # detect keypoints and descriptors
-            kp_a, desc_a = orb.detectAndCompute(pre_img_array, None)
-            kp_b, desc_b = orb.detectAndCompute(post_img_array, None)
-
-            # define the bruteforce matcher object
-            bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-                
-            # perform matches. 
-            matches = bf.match(desc_a, desc_b)
-
-            # Look for similar regions with distance < 20. (from 0 to 100)
-            similar_regions = [i for i in matches if i.distance < 20]  
-            if len(matches) == 0:
-                cv2_img_score = 100
-            else:
-                cv2_img_score = (len(similar_regions) / len(matches)) * 100
-                # print(f'cv2 -> {cv2_img_score}')
-                
-            return cv2_img_score
-
-        except Exception as e:
-            print(e)
+        return ((ssim_score * 2) + (pil_score * 1) + (cv2_score * 5)) / 8
 
 
 
@@ -618,6 +694,7 @@ class Imager():
         # setting defaults
         pic_id  = uuid.uuid4()
         image   = os.path.join(settings.BASE_DIR, f'{pic_id}.png')
+        data    = None
 
         # seting window size to configs before resize
         driver.set_window_size(sizes[0], sizes[1])
@@ -647,9 +724,8 @@ class Imager():
                 "captureBeyondViewport": True,
             })
 
-            # dcecode and save
-            with open(image, "wb") as f:
-                f.write(base64.b64decode(screenshot['data']))
+            # decode in memory
+            data = base64.b64decode(screenshot['data'])
 
         # handle firefox cases
         if browser == 'firefox':
@@ -658,7 +734,7 @@ class Imager():
             driver.get_full_page_screenshot_as_file(image)
 
         # save and upload
-        self.save_image(pic_id, image)
+        self.save_image(pic_id, image=image, data=data)
         
         # return driver
         return driver
@@ -752,16 +828,51 @@ class Imager():
 
 
 
+    def mask_element(self, driver: object=None, id: str=None) -> None:
+        """
+        Hides the element with the passed id and records its
+        region (in screenshot px) so test_vrt() can ignore it
+
+        Args:
+            driver : object,
+            id     : str, element id
+
+        Returns:
+            None
+        """
+        try:
+            rect = driver.execute_script(self.mask_script, id)
+        except Exception:
+            rect = None
+        if rect is None:
+            print(f'cannot find element via id provided -> {id}')
+            return None
+        self.mask_regions.append({
+            "id": id,
+            "x": int(rect['x']),
+            "y": int(rect['y']),
+            "width": int(round(rect['width'])),
+            "height": int(round(rect['height'])),
+        })
+        print('masked an element')
+        return None
+
+
+
+
     def scan_vrt(
             self, 
-            driver: object=None
+            driver: object=None,
+            loaded: bool=False
         ) -> list:
         """
         Grabs full length screenshots of the website and uploads 
         them to s3.
 
         Args:
-            'driver': object
+            'driver': object,
+            'loaded': bool (True if `driver` already has 
+                the page_url loaded & resolved)
 
         Returns:
             self.image_array list
@@ -770,23 +881,24 @@ class Imager():
         # initialize driver if not passed as param
         driver_present = True
         if not driver:
-            driver = driver_init(
+            driver = lease_driver(
                 browser=self.scan.configs.get('browser', 'chrome'),
                 window_size=self.scan.configs.get('window_size', '1920,1080'),
                 device=self.scan.configs.get('device', 'desktop'),
             )
             driver_present = False
 
-        # request page_url 
-        driver.get(self.scan.page.page_url)
+        # request page_url if not already loaded
+        if not loaded:
+            driver.get(self.scan.page.page_url)
 
-        # waiting for network requests to resolve
-        driver_wait(
-            driver=driver, 
-            interval=int(self.scan.configs.get('interval', 5)),  
-            min_wait_time=int(self.scan.configs.get('min_wait_time', 10)),
-            max_wait_time=int(self.scan.configs.get('max_wait_time', 30)),
-        )
+            # waiting for network requests to resolve
+            driver_wait(
+                driver=driver, 
+                interval=int(self.scan.configs.get('interval', 5)),  
+                min_wait_time=int(self.scan.configs.get('min_wait_time', 10)),
+                max_wait_time=int(self.scan.configs.get('max_wait_time', 30)),
+            )
 
         # defining browser demesions
         sizes = self.scan.configs.get('window_size', '1920,1080').split(',')
@@ -809,25 +921,17 @@ class Imager():
             except:
                 print('cannnot pause videos')
 
-        # mask all listed ids        
+        # mask all listed ids & record their regions        
         if self.scan.configs.get('mask_ids') is not None and self.scan.configs.get('mask_ids') != '':
             ids = self.scan.configs.get('mask_ids').split(',')
             for id in ids:
-                try:
-                    driver.execute_script(f"document.getElementById('{id}').style.visibility='hidden';")
-                    print('masked an element')
-                except:
-                    print('cannot find element via id provided')
+                self.mask_element(driver, id.strip())
 
         # mask all Global mask ids that are active
         active_masks = Mask.objects.filter(active=True)
         if len(active_masks) != 0:
             for mask in active_masks:
-                try:
-                    driver.execute_script(f"document.getElementById('{mask.mask_id}').style.visibility='hidden';")
-                    print('masked an element')
-                except:
-                    print('cannot find element via global mask id provided')
+                self.mask_element(driver, mask.mask_id)
 
         # capture auto-height screenshot if requested
         if self.scan.configs.get('auto_height', True):
@@ -849,7 +953,7 @@ class Imager():
 
         # clean up
         if not driver_present:
-            quit_driver(driver)
+            release_driver(driver)
 
         # return images
         return self.image_array
@@ -862,11 +966,14 @@ class Imager():
         Compares each screenshot between the two scans and records 
         a score out of 100%.
 
-        Compairsons used: 
+        Compairsons used (per tile, see utils.tiler): 
             - Structral Similarity Index (ssim)
-            - PIL ImageChop Differences, Ratio
+            - Mean pixel differences, Ratio
             - cv2 ORB Brute-force Matcher, Ratio
 
+        Regions of masked elements in either scan are ignored
+        and each tile's score is returned in "regions".
+
         Args:
             None
 
@@ -884,6 +991,8 @@ class Imager():
         post_img_diff   = None
         summary         = None
         broken          = None
+        regions         = None
+        masks           = None
         images_delta    = {
             "average_score": None,
             "images": None,
@@ -901,54 +1010,77 @@ class Imager():
             shutil.rmtree(temp_root)
             return images_delta
 
-        # download images
-        pre_img_info = self.download_image(self.test.pre_scan.images[0].get('url'), temp_root)
-        post_img_info = self.download_image(self.test.post_scan.images[0].get('url'), temp_root)
-
-        # open images with PIL Image library
-        pre_img = I.open(pre_img_info.get('local_path'))
-        post_img = I.open(post_img_info.get('local_path'))
-        
-        # check and reformat image sizes if necessary
-        pre_img_w, pre_img_h = pre_img.size
-        post_img_w, post_img_h = post_img.size
+        # skip scoring when the screenshots' hashes match
+        pre_hashes = self.test.pre_scan.images[0].get('hashes')
+        post_hashes = self.test.post_scan.images[0].get('hashes')
+        if hashes_match(pre_hashes, post_hashes):
+            print('screenshots match by hash, skipping comparison')
+            shutil.rmtree(temp_root)
+            return {
+                "average_score" : 100,
+                "images"        : [{
+                    "index": 0, 
+                    "pre_img"       : self.test.pre_scan.images[0],
+                    "post_img"      : self.test.post_scan.images[0],
+                    "pre_img_diff"  : None, 
+                    "post_img_diff" : None, 
+                    "score"         : 100,
+                    "regions"       : None,
+                    "masks"         : None,
+                }],
+                "ai_analysis"   : {
+                    "summary"   : None,
+                    "broken"    : None
+                },
+            }
 
-        # pre_img is longer
-        if pre_img_h > post_img_h:
-            print(f'pre_img is larger, adjusting...')
-            new_pre_img = pre_img.crop((0, 0, pre_img_w, post_img_h)).convert(mode=post_img.mode)
-            new_pre_img.save(pre_img_info.get('local_path'), quality=100)
-            pre_img = I.open(pre_img_info.get('local_path'))
-        # post_img is longer
-        if post_img_h > pre_img_h:
-            print(f'post_img is larger, adjusting...')
-            new_post_img = post_img.crop((0, 0, post_img_w, pre_img_h)).convert(mode=pre_img.mode)
-            new_post_img.save(post_img_info.get('local_path'), quality=100)
-            post_img = I.open(post_img_info.get('local_path'))
+        # download images (cached per scan)
+        pre_img_url = self.test.pre_scan.images[0].get('url')
+        post_img_url = self.test.post_scan.images[0].get('url')
+        pre_img_info = self.download_image(pre_img_url, temp_root, self.test.pre_scan.id)
+        post_img_info = self.download_image(post_img_url, temp_root, self.test.post_scan.id)
 
         # test images
         try:
-            # generating new highlighted images and score via ssim
+            # decode each image once (grayscale cached per scan)
+            pre_img, post_img, pre_gray, post_gray = self.decode_pair(
+                pre_img_info, post_img_info, 
+                self.test.pre_scan.id, self.test.post_scan.id
+            )
+
+            # ignore masked regions of either screenshot
+            h, w = pre_img.shape[:2]
+            masks = region_boxes(
+                (self.test.pre_scan.images[0].get('regions') or []) +
+                (self.test.post_scan.images[0].get('regions') or []),
+                width=w, height=h
+            )
+
+            # generating new highlighted images and scores
             ssim_results = self.highlight_diffs(
-                temp_root, 
-                pre_img_info.get('local_path'), 
-                post_img_info.get('local_path'), 
-                i
+                temp_root, pre_img, post_img, i,
+                pre_gray=pre_gray,
+                post_gray=post_gray,
+                masks=masks
             )
+            regions = ssim_results['regions']
             pre_img_diff = ssim_results['img_objs'][0]
             post_img_diff = ssim_results['img_objs'][1]
+
+            # release decoded buffers
+            pre_img = post_img = pre_gray = post_gray = None
             
             # ssim scoring
             ssim_img_score =  ssim_results['ssim_score'] * 100
 
-            # pillow scoring
-            pil_img_score = self.pil_score(pre_img, post_img)
+            # pixel difference scoring
+            pil_img_score = ssim_results['pil_score']
             
-            # pixel perfect scoring
-            cv2_img_score = self.cv2_score(pre_img, post_img)
+            # ORB feature scoring
+            cv2_img_score = ssim_results['cv2_score']
 
             # weighted average
-            img_score = ((ssim_img_score * 2) + (pil_img_score * 1) + (cv2_img_score * 5)) / 8
+            img_score = self.weighted_score(ssim_img_score, pil_img_score, cv2_img_score)
 
             # saving old images to test.id path
             old_imgs = self.save_images(pre_img_info.get('id'), post_img_info.get('id'), i)
@@ -976,6 +1108,7 @@ class Imager():
             post_img_diff   = None
             summary         = None
             broken          = None
+            regions         = None
             
 
         # create img test obj and add to array
@@ -986,6 +1119,8 @@ class Imager():
             "pre_img_diff"  : pre_img_diff, 
             "post_img_diff" : post_img_diff, 
             "score"         : img_score,
+            "regions"       : regions,
+            "masks"         : masks,
         }]
 
         # remove temp dir
@@ -1016,9 +1151,9 @@ class Imager():
         Compares the passed step.screenshot to the case.step.screenshot
         and records a score out of 100%.
 
-        Compairsons used: 
+        Compairsons used (per tile, see utils.tiler): 
             - Structral Similarity Index (ssim)
-            - PIL ImageChop Differences, Ratio
+            - Mean pixel differences, Ratio
             - cv2 ORB Brute-force Matcher, Ratio
 
         Args:
@@ -1065,33 +1200,30 @@ class Imager():
         case_img_info = self.download_image(case_image_url, temp_root)
         caserun_img_info = self.download_image(caserun_image_url, temp_root)
 
-        # open images with PIL Image library
-        pre_img = I.open(case_img_info.get('local_path'))
-        post_img = I.open(caserun_img_info.get('local_path'))
-
         # test images
         try:
-            # generating new highlighted images and score via ssim
-            ssim_results = self.highlight_diffs(
-                temp_root, 
-                case_img_info.get('local_path'), 
-                caserun_img_info.get('local_path'), 
-                step
-            )
+            # decode each image once
+            pre_img, post_img, pre_gray, post_gray = self.decode_pair(case_img_info, caserun_img_info)
+
+            # generating new highlighted images and scores
+            ssim_results = self.highlight_diffs(temp_root, pre_img, post_img, step)
             pre_img_diff = ssim_results['img_objs'][0]
             post_img_diff = ssim_results['img_objs'][1]
+
+            # release decoded buffers
+            pre_img = post_img = None
             
             # ssim scoring
             ssim_img_score =  ssim_results['ssim_score'] * 100
 
-            # pillow scoring
-            pil_img_score = self.pil_score(pre_img, post_img)
+            # pixel difference scoring
+            pil_img_score = ssim_results['pil_score']
             
-            # pixel perfect scoring
-            cv2_img_score = self.cv2_score(pre_img, post_img)
+            # ORB feature scoring
+            cv2_img_score = ssim_results['cv2_score']
 
             # weighted average
-            img_score = ((ssim_img_score * 2) + (pil_img_score * 1) + (cv2_img_score * 5)) / 8
+            img_score = self.weighted_score(ssim_img_score, pil_img_score, cv2_img_score)
 
             # saving old images to caserun.id path
             old_imgs = self.save_images(case_img_info.get('id'), caserun_img_info.get('id'), step)
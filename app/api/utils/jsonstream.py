@@ -0,0 +1,229 @@
+import json, re, codecs
+
+
+
+
+
+
+_WS = re.compile(r'[ \t\r\n]*')
+_SCALAR_END = re.compile(r'[,}\]\s]')
+
+
+
+
+class JsonStream():
+    """
+    Minimal incremental JSON reader over a binary file
+    object (e.g. a subprocess pipe or socket). Values are
+    decoded one at a time with the C decoder as soon as
+    they are complete, and consumed input is released
+    between values, so only the current value is ever
+    held in memory.
+
+    Args:
+        'fp'         : binary file object,
+        'chunk_size' : int
+
+    Returns:
+        `JsonStream` object
+    """
+
+
+
+
+    def __init__(self, fp: object=None, chunk_size: int=65536):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.json = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+
+
+
+    def fill(self, size: int=None) -> bool:
+        # read the next chunk, returns False at EOF
+        if self.eof:
+            return False
+        # read1() returns what is available on pipes & sockets
+        read = getattr(self.fp, 'read1', self.fp.read)
+        data = read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+            self.buf += self.decoder.decode(b'', final=True)
+            return False
+        self.buf += self.decoder.decode(data)
+        return True
+
+
+
+
+    def release(self) -> None:
+        # drop consumed input (only between values)
+        if self.pos > self.chunk_size:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        return None
+
+
+
+
+    def seek(self, marker: str=None) -> None:
+        """
+        Discards input until `marker` (e.g. the start of
+        the JSON document after any log noise).
+        """
+        while True:
+            index = self.buf.find(marker, self.pos)
+            if index >= 0:
+                self.pos = index
+                return None
+            self.pos = max(self.pos, len(self.buf) - len(marker) + 1)
+            self.release()
+            if not self.fill():
+                raise ValueError('marker not found in stream')
+
+
+
+
+    def peek(self) -> str:
+        # next non whitespace char (not consumed)
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError('unexpected end of stream')
+
+
+
+
+    def expect(self, char: str=None) -> None:
+        if self.peek() != char:
+            raise ValueError(f'expected {char} at {self.pos}')
+        self.pos += 1
+        return None
+
+
+
+
+    def decode(self) -> tuple:
+        """
+        Decodes the next value, reading (in growing 
+        chunks) until it is complete.
+
+        Returns:
+            tuple (value, raw str)
+        """
+        # numbers & literals must be followed by a delimiter
+        # so a value split across chunks is never truncated
+        if self.peek() not in '{["':
+            while not _SCALAR_END.search(self.buf, self.pos) and self.fill():
+                pass
+
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buf, self.pos)
+                break
+            except json.JSONDecodeError:
+                if not self.fill(size):
+                    raise
+                size *= 2
+        raw = self.buf[self.pos:end]
+        self.pos = end
+        return value, raw
+
+
+
+
+    def key(self) -> str:
+        # next object key (consumes the ':')
+        key, raw = self.decode()
+        self.expect(':')
+        return key
+
+
+
+
+    def members(self) -> object:
+        """
+        Iterates over the keys of the object at the current
+        position. The caller must consume each value (with
+        `decode()`) before advancing.
+        """
+        self.expect('{')
+        while True:
+            char = self.peek()
+            if char == '}':
+                self.pos += 1
+                return
+            if char == ',':
+                self.pos += 1
+                continue
+            yield self.key()
+            self.release()
+
+
+
+
+def extract_lighthouse(
+        fp: object=None,
+        audit_filter: object=None,
+        marker: str=None
+    ) -> dict:
+    """
+    Reads a Lighthouse report (LHR) from `fp` incrementally
+    and keeps only `categories` and the audits they
+    reference (optionally narrowed by `audit_filter`). All
+    other top level keys (i18n, timing, entities, etc.) and
+    unreferenced audits are dropped as soon as they are read.
+
+    Args:
+        'fp'            : binary file object,
+        'audit_filter'  : callable(auditRef) -> bool,
+        'marker'        : str, start of the report if
+                          preceded by other output
+
+    Returns:
+        dict {'categories': dict, 'audits': dict}
+    """
+    stream = JsonStream(fp)
+    if marker:
+        stream.seek(marker)
+
+    categories = None
+    raw_audits = {}
+
+    def wanted() -> set:
+        ids = set()
+        for category in (categories or {}).values():
+            for ref in category.get('auditRefs') or []:
+                if audit_filter is None or audit_filter(ref):
+                    ids.add(ref['id'])
+        return ids
+
+    for key in stream.members():
+        if key == 'categories':
+            categories, raw = stream.decode()
+        elif key == 'audits':
+            # keep raw text until categories are known
+            ids = wanted() if categories is not None else None
+            for audit_id in stream.members():
+                value, raw = stream.decode()
+                if ids is None or audit_id in ids:
+                    raw_audits[audit_id] = raw
+        else:
+            stream.decode()
+
+    if categories is None:
+        raise ValueError('no categories in lighthouse report')
+
+    # decode only the referenced audits
+    audits = {
+        audit_id: json.loads(raw_audits[audit_id])
+        for audit_id in wanted() if audit_id in raw_audits
+    }
+    return {'categories': categories, 'audits': audits}
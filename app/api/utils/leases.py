@@ -0,0 +1,216 @@
+from ..models import TaskLease, Scan, Test
+from django.db import connection
+from django.utils import timezone
+from contextlib import contextmanager
+from datetime import timedelta
+from cursion import settings
+import threading
+
+
+
+
+
+
+def get_location(resource_type: str=None, resource: object=None) -> str:
+    # location the resource is run from (see check_location)
+    if resource_type == 'scan':
+        return (resource.configs or {}).get('location', 'us')
+    if resource_type == 'test':
+        return (resource.post_scan_configs or {}).get('location', 'us')
+    return None
+
+
+
+
+def seed_leases(resource: object=None, resource_type: str=None, components: list=None) -> None:
+    """
+    Creates (or resets) a `TaskLease` for each task in
+    `resource.system['tasks']` as it is seeded or queued,
+    so a task whose message is lost before any worker
+    picks it up is still redelivered. The lease expires
+    after TASK_LEASE_QUEUE_TTL to allow for time waiting
+    in the queue, then `record_task()` renews it.
+
+    Args:
+        'resource'      : `Scan` or `Test` <obj>,
+        'resource_type' : str (scan, test),
+        'components'    : list (None for all)
+
+    Returns: None
+    """
+    expires_at = timezone.now() + timedelta(seconds=settings.TASK_LEASE_QUEUE_TTL)
+    for task in (resource.system or {}).get('tasks', []):
+        component = 'images' if task.get('component') == 'vrt' else task.get('component')
+        if components and component not in components:
+            continue
+        TaskLease.objects.update_or_create(
+            resource_type=resource_type,
+            resource_id=str(resource.id),
+            component=component,
+            defaults={
+                'task_id': task.get('task_id'),
+                'task_method': task.get('task_method'),
+                'kwargs': task.get('kwargs'),
+                'attempts': task.get('attempts', 0),
+                'location': get_location(resource_type, resource),
+                'expires_at': expires_at,
+            }
+        )
+    return None
+
+
+
+
+def renew_lease(
+        resource: object=None,
+        resource_type: str=None,
+        component: str=None,
+        task: dict=None
+    ) -> int:
+    """
+    Renews the `TaskLease` seeded by `seed_leases()` once
+    `record_task()` records the running task. The lease 
+    expires after TASK_LEASE_TTL unless the worker keeps
+    it alive with `lease_heartbeat()`. Released leases
+    (finished components) are not re-created.
+
+    Args:
+        'resource'      : `Scan` or `Test` <obj>,
+        'resource_type' : str (scan, test),
+        'component'     : str,
+        'task'          : dict, the system['tasks'] entry
+
+    Returns:
+        int, number of leases renewed
+    """
+    return TaskLease.objects.filter(
+        resource_type=resource_type,
+        resource_id=str(resource.id),
+        component=component,
+    ).update(
+        task_id=task.get('task_id'),
+        task_method=task.get('task_method'),
+        kwargs=task.get('kwargs'),
+        attempts=task.get('attempts', 0),
+        expires_at=timezone.now() + timedelta(seconds=settings.TASK_LEASE_TTL),
+    )
+
+
+
+
+def extend_leases(
+        resource_type: str=None,
+        resource_id: str=None,
+        components: list=None,
+        seconds: int=None
+    ) -> int:
+    # push the expiry of the resource's leases
+    leases = TaskLease.objects.filter(resource_type=resource_type, resource_id=str(resource_id))
+    if components:
+        leases = leases.filter(component__in=components)
+    expires_at = timezone.now() + timedelta(seconds=settings.TASK_LEASE_TTL if seconds is None else seconds)
+    return leases.update(expires_at=expires_at)
+
+
+
+
+def is_finished(lease: object=None, resource: object=None) -> bool:
+    """
+    Checks if the leased component no longer needs to
+    run, i.e. the resource was deleted or completed, or
+    the component's data was saved.
+
+    Args:
+        'lease'     : `TaskLease` <obj>,
+        'resource'  : `Scan` or `Test` <obj> (None if deleted)
+
+    Returns:
+        bool
+    """
+    if resource is None or resource.time_completed is not None:
+        return True
+    if lease.resource_type != 'scan':
+        return False
+
+    # get scan.{component} data
+    if lease.component == 'lighthouse':
+        return resource.lighthouse.get('audits', None) is not None
+    if lease.component in ['images', 'vrt']:
+        return resource.images is not None
+    if lease.component == 'html':
+        return resource.html is not None
+    if lease.component == 'security':
+        return resource.security.get('audits', None) is not None
+    return False
+
+
+
+
+def settle_leases(resource_type: str=None, resource_id: str=None, components: list=None) -> None:
+    """
+    Called once a component task returns. Leases of
+    finished components are released, the others expire
+    now so the next `redeliver_failed_tasks` run retries
+    them.
+
+    Args:
+        'resource_type' : str (scan, test),
+        'resource_id'   : str,
+        'components'    : list (None for all)
+
+    Returns: None
+    """
+    leases = TaskLease.objects.filter(resource_type=resource_type, resource_id=str(resource_id))
+    if components:
+        leases = leases.filter(component__in=components)
+
+    model = Scan if resource_type == 'scan' else Test
+    resource = model.objects.filter(id=resource_id).first()
+    for lease in leases:
+        if is_finished(lease, resource):
+            lease.delete()
+        else:
+            lease.expires_at = timezone.now()
+            lease.save(update_fields=['expires_at'])
+    return None
+
+
+
+
+@contextmanager
+def lease_heartbeat(resource_type: str=None, resource_id: str=None, components: list=None):
+    """
+    Keeps the component leases alive (every
+    TASK_LEASE_HEARTBEAT seconds) while the block runs,
+    then settles them. If the block raises, the leases
+    are left to expire so celery's own retry goes first.
+
+    Args:
+        'resource_type' : str (scan, test),
+        'resource_id'   : str,
+        'components'    : list (None for all)
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.TASK_LEASE_HEARTBEAT):
+                try:
+                    extend_leases(resource_type, resource_id, components)
+                except Exception as e:
+                    print(f'lease heartbeat failed -> {e}')
+        finally:
+            # each thread holds its own db connection
+            connection.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    except Exception:
+        stop.set()
+        thread.join()
+        raise
+    stop.set()
+    thread.join()
+    settle_leases(resource_type, resource_id, components)
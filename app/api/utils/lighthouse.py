@@ -1,13 +1,35 @@
 from pathlib import Path
 from .devices import get_device
+from .storage import (
+    upload_json, put_json_artifact, 
+    retain_artifact, release_artifacts
+)
+from .jsonstream import extract_lighthouse
+from django.core.cache import cache
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
 from cursion import settings
-import subprocess, json, uuid, boto3, os, requests, ast
+import subprocess, json, uuid, os, requests, socket, re
 
 
 
 
 
 
+def percentile(values: list=None, q: float=None) -> float:
+    # linear interpolation between closest ranks
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * q
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+
+
 class Lighthouse():
 
     """
@@ -26,6 +48,9 @@ class Lighthouse():
         self.cpu_slowdown = 1
         self.scale_factor = 2
         self.audits_url = ''
+        self.warmed = False
+        self.stats = None
+        self.runs = 1
         self.device = get_device(
             scan.configs['browser'], 
             scan.configs['device']
@@ -51,6 +76,18 @@ class Lighthouse():
             }
         }
 
+        # map internal keys (used by the client) to Lighthouse category keys
+        self.category_key_map = {
+            "best_practices": "best-practices",
+            "crux": "lighthouse-plugin-crux",
+        }
+
+        # allow_list of 0 weighted audits
+        self.allow_list = [
+            'server-response-time', 'cache-insight',
+            'interactive',
+        ]
+
         # initial scores object
         self.scores = {
             "seo": None,
@@ -75,6 +112,13 @@ class Lighthouse():
 
 
 
+    def keep_audit(self, ref: dict=None) -> bool:
+        # weighted audits & the allow_list of 0 weighted audits
+        return int(ref["weight"]) > 0 or ref["id"] in self.allow_list
+
+
+
+
     def create_configs(self):
     
         # custom Lighthouse config
@@ -112,6 +156,228 @@ class Lighthouse():
 
 
     
+    def warm_up(self) -> None:
+        # warm up the page (server & CDN caches)
+        if self.warmed:
+            return None
+        try:
+            requests.get(self.page.page_url, timeout=5)
+        except Exception:
+            pass
+        self.warmed = True
+        return None
+
+
+
+
+    def cache_enabled(self) -> bool:
+        # opt-in per scan via configs.lighthouse_cache
+        return bool(
+            self.configs.get('lighthouse_cache', settings.LIGHTHOUSE_CACHE_DEFAULT) and
+            settings.ARTIFACT_STORE_ENABLED and
+            not self.configs.get('api_priority')
+        )
+
+
+
+
+    def fingerprint(self) -> str:
+        """
+        Cheap content fingerprint of the page: a hash of the
+        html (minus per-request nonces & csrf tokens) plus the
+        ETag / Last-Modified of its key scripts & stylesheets.
+        Also serves as the page warm up.
+
+        Returns: fingerprint (str) or None if the page 
+            could not be fetched
+        """
+        try:
+            res = requests.get(
+                self.page.page_url, timeout=10,
+                headers={'User-Agent': self.device['user_agent']}
+            )
+        except Exception as e:
+            print(f'lighthouse fingerprint failed -> {e}')
+            return None
+        self.warmed = True
+        if not str(res.status_code).startswith('2'):
+            return None
+
+        # normalize values which change on every request
+        html = res.text
+        html = re.sub(r'\snonce="[^"]*"', '', html)
+        html = re.sub(r'(name="csrf[^"]*"\s+content=|name="csrfmiddlewaretoken"\s+value=)"[^"]*"', r'\1""', html)
+        parts = [sha256(html.encode('utf-8')).hexdigest()]
+
+        # key resource validators
+        urls = re.findall(r'<script[^>]+src="([^"]+)"|<link[^>]+rel="stylesheet"[^>]+href="([^"]+)"', html)
+        urls = [requests.compat.urljoin(res.url, a or b) for a, b in urls]
+        urls = urls[:settings.LIGHTHOUSE_CACHE_MAX_RESOURCES]
+
+        def validator(url: str) -> str:
+            try:
+                head = requests.head(url, timeout=3, allow_redirects=True)
+                return head.headers.get('ETag') or head.headers.get('Last-Modified') or head.headers.get('Content-Length') or ''
+            except Exception:
+                return 'error'
+
+        if urls:
+            with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+                parts += [f'{u}={v}' for u, v in zip(urls, executor.map(validator, urls))]
+
+        return sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+
+
+    def cache_key(self, fingerprint: str=None) -> str:
+        # account (entries are never shared across tenants),
+        # page url, device & throttling config and content
+        config = json.dumps({
+            'account': str(self.site.account_id),
+            'url': self.page.page_url,
+            'device': self.device['type'],
+            'user_agent': self.device['user_agent'],
+            'sizes': self.sizes,
+            'cpu_slowdown': self.cpu_slowdown,
+            'speed': self.speed[self.device['type']],
+            'allow_list': self.allow_list,
+            'runs': self.run_count(),
+        }, sort_keys=True)
+        return f'lighthouse:{sha256(config.encode("utf-8")).hexdigest()}:{fingerprint}'
+
+
+
+
+    def get_cached(self, key: str=None) -> dict:
+        """
+        Returns the cached LH data for the key (with a new 
+        reference on its audits artifact) or None on a miss.
+        """
+        try:
+            entry = cache.get(key)
+        except Exception as e:
+            print(f'lighthouse cache read failed -> {e}')
+            return None
+        if not entry:
+            return None
+
+        # share the cached audits artifact
+        previous = (self.scan.lighthouse or {}).get('audits')
+        if previous != entry.get('audits'):
+            if not retain_artifact(entry.get('audits')):
+                return None
+            release_artifacts([previous])
+        data = {
+            "scores": entry['scores'],
+            "audits": entry['audits'],
+            "failed": False,
+        }
+        if entry.get('stats'):
+            data['runs'] = entry.get('runs')
+            data['stats'] = entry.get('stats')
+        data['cache'] = {
+                "hit": True,
+                "time_created": entry.get('time_created'),
+        }
+        return data
+
+
+
+
+    def set_cached(self, key: str=None, data: dict=None) -> None:
+        try:
+            cache.set(key, {
+                'scores': data['scores'],
+                'audits': data['audits'],
+                'runs': data.get('runs'),
+                'stats': data.get('stats'),
+                'time_created': timezone.now().isoformat(),
+            }, timeout=settings.LIGHTHOUSE_CACHE_TTL)
+        except Exception as e:
+            print(f'lighthouse cache write failed -> {e}')
+        return None
+
+
+
+
+    def runner_available(self) -> bool:
+        # true if the local LH runner socket is up
+        return (
+            settings.LIGHTHOUSE_RUNNER_ENABLED and 
+            os.path.exists(settings.LIGHTHOUSE_RUNNER_SOCKET)
+        )
+
+
+
+
+    def runner_flags(self) -> dict:
+        """
+        Builds the LH flags for the runner, mirroring 
+        the arguments passed to the CLI.
+
+        Returns: flags (Dict)
+        """
+        with open('api/utils/configs/extra-headers.json') as f:
+            extra_headers = json.load(f)
+        speed = self.speed[self.device['type']]
+        return {
+            'formFactor': self.device['type'],
+            'screenEmulation': {
+                'width': int(self.sizes[0]),
+                'height': int(self.sizes[1]),
+                'mobile': self.is_mobile == 'true',
+            },
+            'emulatedUserAgent': self.device['user_agent'],
+            'throttlingMethod': 'devtools',
+            'throttling': {
+                'cpuSlowdownMultiplier': self.cpu_slowdown,
+                'downloadThroughputKbps': speed['download'],
+                'uploadThroughputKbps': speed['upload'],
+                'rttMs': speed['rttMs'],
+            },
+            'extraHeaders': extra_headers,
+        }
+
+
+
+
+    def lighthouse_runner(self) -> dict:
+        """ 
+        Sends the audit to the long-lived local LH runner 
+        (api/utils/node/lighthouse-runner.mjs) which reuses
+        a warm Chrome and runs each job in a fresh context.
+
+        Returns: raw LH data (Dict)
+        """
+
+        # warm up the page
+        self.warm_up()
+
+        job = {
+            'id': str(uuid.uuid4()),
+            'url': self.page.page_url,
+            'flags': self.runner_flags(),
+        }
+
+        # send job, wait for the status line & then
+        # parse the report as it is read off the socket
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(settings.LIGHTHOUSE_RUNNER_TIMEOUT)
+            sock.connect(settings.LIGHTHOUSE_RUNNER_SOCKET)
+            sock.sendall(json.dumps(job).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as reader:
+                line = reader.readline()
+                if not line:
+                    raise ConnectionError('lighthouse runner closed the connection')
+                resp = json.loads(line)
+                if not resp.get('ok'):
+                    raise RuntimeError(f'lighthouse runner failed -> {resp.get("error")}')
+                return extract_lighthouse(reader, audit_filter=self.keep_audit)
+
+
+
+
     def lighthouse_cli(self):
         """ 
         Serves as the CLI method for collecting LH metrics.
@@ -120,16 +386,8 @@ class Lighthouse():
         Returns: raw LH data (Dict)
         """
 
-        # warm up the page by curl'ing site
-        try:
-            subprocess.run(
-                ['curl', '-sS', '--max-time', '5', self.page.page_url],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                check=True
-            )
-        except subprocess.CalledProcessError:
-            pass
+        # warm up the page
+        self.warm_up()
 
         # initiating subprocess for LH CLI
         proc = subprocess.Popen([
@@ -157,28 +415,17 @@ class Lighthouse():
             user='app',
         )
 
-        # retrieving data from process
-        stdout_value = proc.communicate()[0]
-        
-        # decode bytes into string
-        stdout_string = stdout_value.decode('iso-8859-1')
-
-        # clean string of any errors
+        # parse the report while reading the pipe, keeping
+        # only categories & the audits process_data() uses
         try:
-            delm = '{\n  "lighthouseVersion"'
-            stdout_string = delm + stdout_string.split(delm)[1]
-        except Exception as e:
-            print(e)
-            
-        # encode back to bytes
-        stdout_value = stdout_string.encode('iso-8859-1')
-        
-        # converting stdout str into Dict
-        try:
-            stdout_json = json.loads(stdout_value)
-        except json.JSONDecodeError:
-            # fallback for Python dict literal debugging payloads
-            stdout_json = ast.literal_eval(stdout_string)
+            stdout_json = extract_lighthouse(
+                proc.stdout, 
+                audit_filter=self.keep_audit, 
+                marker='{\n  "lighthouseVersion"'
+            )
+        finally:
+            proc.stdout.close()
+            proc.wait()
         return stdout_json
 
 
@@ -226,6 +473,112 @@ class Lighthouse():
 
 
 
+    def run_count(self) -> int:
+        # number of runs to aggregate (configs.lighthouse_runs)
+        try:
+            runs = int(self.configs.get('lighthouse_runs', settings.LIGHTHOUSE_RUNS))
+        except (TypeError, ValueError):
+            runs = 1
+        return max(1, min(runs, settings.LIGHTHOUSE_MAX_RUNS))
+
+
+
+
+    def run_once(self) -> dict:
+        # runner when available, otherwise the CLI
+        if self.runner_available():
+            try:
+                return self.lighthouse_runner()
+            except (FileNotFoundError, ConnectionError) as e:
+                # runner down, fall back to the CLI
+                print(f'lighthouse runner unavailable -> {e}')
+        return self.lighthouse_cli()
+
+
+
+
+    def report_scores(self, report: dict=None) -> dict:
+        # category scores (0-100) of a single report
+        scores = {}
+        for cat in self.scores:
+            lh_cat = self.category_key_map.get(cat, cat)
+            category = report["categories"].get(lh_cat)
+            if category is None or category.get("score") is None:
+                continue
+            scores[cat] = round(category["score"] * 100)
+        return scores
+
+
+
+
+    def run_many(self, runs: int=None) -> dict:
+        """ 
+        Runs the audit `runs` times (concurrently on the 
+        runner, sequentially on the CLI), records the 
+        median, p10 & p90 of each category in self.stats 
+        and returns the run closest to the median 
+        performance (used for the audits).
+
+        Returns: raw LH data (Dict)
+        """
+
+        # run the batch
+        workers = runs if self.runner_available() else 1
+        self.warm_up()
+        def _run(i: int) -> dict:
+            try:
+                return self.run_once()
+            except Exception as e:
+                print(f'LIGHTHOUSE run {i} failed --> {e}')
+                return None
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            reports = [r for r in executor.map(_run, range(runs)) if r is not None]
+        if not reports:
+            raise RuntimeError('all lighthouse runs failed')
+
+        # per category stats
+        all_scores = [self.report_scores(r) for r in reports]
+        self.runs = len(reports)
+        self.stats = {}
+        for cat in self.scores:
+            values = [s[cat] for s in all_scores if s.get(cat) is not None]
+            if not values:
+                continue
+            self.stats[cat] = {
+                "median": round(percentile(values, 0.5), 1),
+                "p10": round(percentile(values, 0.1), 1),
+                "p90": round(percentile(values, 0.9), 1),
+                "values": values,
+            }
+
+        # representative run
+        median = (self.stats.get('performance') or {}).get('median')
+        if median is None:
+            return reports[0]
+        index = min(
+            range(len(reports)), 
+            key=lambda i: abs((all_scores[i].get('performance') or 0) - median)
+        )
+        return reports[index]
+
+
+
+
+    def apply_stats(self) -> None:
+        # scores become the per category medians
+        if not self.stats:
+            return None
+        score_queue = []
+        for cat, stat in self.stats.items():
+            self.scores[cat] = round(stat['median'])
+            score_queue.append(self.scores[cat])
+        if score_queue:
+            self.scores['average'] = round(sum(score_queue)/len(score_queue))
+        return None
+
+
+
+
     def process_data(self, stdout_json: dict) -> dict:
         """ 
         Accepts JSON data from either CLI or API method 
@@ -237,26 +590,8 @@ class Lighthouse():
         Returns: formatted LH data <dict> 
         """
 
-        # setup boto3 configurations
-        s3 = boto3.client(
-            's3', aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-            aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-            region_name=str(settings.AWS_S3_REGION_NAME), 
-            endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
-        )
-
-        # allow_list of 0 weighted audits
-        allow_list = [
-            'server-response-time', 'cache-insight',
-            'interactive',
-        ]
-
         try:
-            # Map internal keys (used by the client) to Lighthouse category keys.
-            category_key_map = {
-                "best_practices": "best-practices",
-                "crux": "lighthouse-plugin-crux",
-            }
+            category_key_map = self.category_key_map
 
             # iterating through categories to get relevant lh_audits 
             # and store them in their respective `audits = {}` obj
@@ -268,7 +603,7 @@ class Lighthouse():
                 cat_audits = stdout_json["categories"].get(lh_cat).get("auditRefs")
                 if cat_audits is not None:
                     for a in cat_audits:
-                        if int(a["weight"]) > 0 or a["id"] in allow_list:
+                        if self.keep_audit(a):
                             audit = stdout_json["audits"][a["id"]]
                             self.audits[cat].append(audit)
         
@@ -293,24 +628,16 @@ class Lighthouse():
                 self.scores['average'] = average_score
 
 
-            # save audits data as json file
-            file_id = uuid.uuid4()
-            audit_file = os.path.join(settings.BASE_DIR, f'{file_id}.json')
-            with open(audit_file, 'w') as fp:
-                json.dump(self.audits, fp)
-            
-            # upload to s3 and return url
-            remote_path = f'static/sites/{self.site.id}/{self.page.id}/{self.scan.id}/{file_id}.json'
-            root_path = settings.AWS_S3_URL_PATH
-            self.audits_url = f'{root_path}/{remote_path}'
-        
-            # upload to s3
-            with open(audit_file, 'rb') as data:
-                s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME), 
-                    remote_path, ExtraArgs={'ACL': 'public-read', 'ContentType': "application/json"}
+            # upload audits data from memory to s3, 
+            # deduplicated by content
+            if settings.ARTIFACT_STORE_ENABLED:
+                self.audits_url = put_json_artifact(
+                    self.audits, previous=(self.scan.lighthouse or {}).get('audits')
                 )
-            # remove local copy
-            os.remove(audit_file)
+            else:
+                file_id = uuid.uuid4()
+                remote_path = f'static/sites/{self.site.id}/{self.page.id}/{self.scan.id}/{file_id}.json'
+                self.audits_url = upload_json(self.audits, remote_path)
 
             data = {
                 "scores": self.scores, 
@@ -334,17 +661,37 @@ class Lighthouse():
         failed = True
         attempts = 0
 
+        # reuse a recent result for unchanged content
+        cache_key = None
+        if self.cache_enabled():
+            fingerprint = self.fingerprint()
+            if fingerprint is not None:
+                cache_key = self.cache_key(fingerprint)
+                cached = self.get_cached(cache_key)
+                if cached is not None:
+                    print(f'LIGHTHOUSE cache hit for {self.page.page_url}')
+                    return cached
+
         # trying lighthouse scan untill success or 2 attempts
         while not scan_complete and attempts < 2:
 
             try:
-                # CLI on first attempt if not API Priority
+                # runner or CLI on first attempt if not API Priority
                 if attempts < 1 and not self.configs.get('api_priority'):
-                    raw_data = self.lighthouse_cli()
+                    runs = self.run_count()
+                    if runs > 1:
+                        raw_data = self.run_many(runs)
+                    else:
+                        raw_data = self.run_once()
                     self.process_data(stdout_json=raw_data)
+                    self.apply_stats()
                 
                 # API after first attempt or if API Priority
                 if attempts >= 1 or self.configs.get('api_priority'):
+                    # drop stats of any local runs, the API 
+                    # result is a single run
+                    self.stats = None
+                    self.runs = 1
                     raw_data = self.lighthouse_api()
                     self.process_data(stdout_json=raw_data)
 
@@ -362,6 +709,16 @@ class Lighthouse():
             "audits": self.audits_url if self.audits_url != '' else None,
             "failed": failed
         }
+
+        # record multi-run stats
+        if self.stats and not failed:
+            data['runs'] = self.runs
+            data['stats'] = self.stats
+
+        # store successful runs for later scans
+        if cache_key is not None and not failed and data['audits']:
+            data['cache'] = {"hit": False}
+            self.set_cached(cache_key, data)
             
         # returning final data
         return data
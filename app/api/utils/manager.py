@@ -1,4 +1,6 @@
 from ..models import *
+from .leases import renew_lease
+from django.db import transaction
 from cursion import settings
 
 
@@ -32,52 +34,95 @@ def record_task(
 
     # get resource 
     if resource_type == 'scan':
-        resource = Scan.objects.get(id=resource_id)
+        model = Scan
     if resource_type == 'test':
-        resource = Test.objects.get(id=resource_id)
+        model = Test
     if resource_type == 'caserun':
-        resource = CaseRun.objects.get(id=resource_id)
-
-    # get current resoruce.system.tasks data
-    tasks = (resource.system or {}).get('tasks', [])
-
-    # get component based on task_name
-    component = task_method.replace('run_', '').replace('_bg', '').replace('_and_logs', '')
-    if component == 'vrt':
-        component = 'images'
-
-    # check if task exists
-    i = 0
-    exists = False
-    for task in tasks:
-        task_component = task.get('component')
-        is_images_alias = (
-            (task_component == 'vrt' and component == 'images')
-            or (task_component == 'images' and component == 'vrt')
-        )
-        if task_component == component or is_images_alias:
-            # update existing task
-            max_attempts_reached   = True if (tasks[i]['attempts'] >= settings.MAX_ATTEMPTS) else False
-            tasks[i]['task_id']    = str(task_id)
-            tasks[i]['attempts']   += 1 if not max_attempts_reached else tasks[i]['attempts']
-            tasks[i]['kwargs']     = kwargs.get('kwargs')
-            exists                 = True
-        i += 1
-
-    # append new task data
-    if not exists:
-        tasks.append({
-            'attempts'      : int(1),
-            'task_id'       : str(task_id),
-            'task_method'   : str(task_method),
-            'component'     : str(component),
-            'kwargs'        : kwargs.get('kwargs'),
-        })
-
-    # update resource with new system data
-    resource.system = resource.system or {}
-    resource.system['tasks'] = tasks
-    resource.save()
+        model = CaseRun
+
+    # lock the row so concurrent components do not clobber each other
+    with transaction.atomic():
+        resource = model.objects.select_for_update().get(id=resource_id)
+
+        # get current resoruce.system.tasks data
+        tasks = (resource.system or {}).get('tasks', [])
+
+        # get component based on task_name
+        component = task_method.replace('run_', '').replace('_bg', '').replace('_and_logs', '')
+        if component == 'vrt':
+            component = 'images'
+
+        # check if task exists
+        i = 0
+        exists = False
+        for task in tasks:
+            task_component = task.get('component')
+            is_images_alias = (
+                (task_component == 'vrt' and component == 'images')
+                or (task_component == 'images' and component == 'vrt')
+            )
+            if task_component == component or is_images_alias:
+                # update existing task
+                max_attempts_reached   = True if (tasks[i]['attempts'] >= settings.MAX_ATTEMPTS) else False
+                tasks[i]['task_id']    = str(task_id)
+                tasks[i]['attempts']   += 1 if not max_attempts_reached else tasks[i]['attempts']
+                tasks[i]['kwargs']     = kwargs.get('kwargs')
+                exists                 = True
+                entry                  = tasks[i]
+            i += 1
+
+        # append new task data
+        if not exists:
+            entry = {
+                'attempts'      : int(1),
+                'task_id'       : str(task_id),
+                'task_method'   : str(task_method),
+                'component'     : str(component),
+                'kwargs'        : kwargs.get('kwargs'),
+            }
+            tasks.append(entry)
+
+        # update resource with new system data
+        resource.system = resource.system or {}
+        resource.system['tasks'] = tasks
+        resource.save(update_fields=['system'])
+
+        # renew the component's seeded lease while its task runs
+        if resource_type in ['scan', 'test'] and not max_attempts_reached:
+            renew_lease(resource, resource_type, component, entry)
 
     # return
     return max_attempts_reached
+
+
+
+
+def record_readiness(
+        scan_id: str=None,
+        component: str=None,
+        readiness: dict=None,
+    ) -> None:
+    """ 
+    Records the page readiness measured by `driver_wait` 
+    for the passed component in `Scan.system['readiness']`.
+
+    Args:
+        'scan_id'   : str 
+        'component' : str (html, images, security)
+        'readiness' : dict
+    
+    Returns: None
+    """
+
+    # nothing measured
+    if not readiness:
+        return None
+
+    # lock the row so concurrent components do not clobber each other
+    with transaction.atomic():
+        scan = Scan.objects.select_for_update().get(id=scan_id)
+        scan.system = scan.system or {}
+        scan.system.setdefault('readiness', {})[str(component)] = readiness
+        scan.save(update_fields=['system'])
+
+    return None
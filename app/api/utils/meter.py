@@ -1,20 +1,67 @@
 from ..models import Account
+from ..queue import redis_client
 from cursion import settings
-import stripe
+import stripe, secrets
 
 
 
 
 
 
+# pending meter counts per account (HINCRBY),
+# flushed by `flush_meter_events()`
+METER_PENDING_KEY = 'meter:pending'
+
+
+# batches claimed by a flush (left behind if it crashed)
+# & the lock held while flushing
+METER_BATCH_PREFIX = 'meter:batch:'
+METER_FLUSH_LOCK = 'meter:flush:lock'
+
+
+
+
 def meter_account(account_id: str=None, count: int=1) -> None:
-    """ 
-    Sends a `MeterEvent` request to Stripe to 
+    """
+    Records account usage for Stripe. With
+    METER_BATCH_ENABLED the count is added to the
+    account's pending total in redis & sent with
+    the next `flush_meter_events()`, otherwise a
+    `MeterEvent` is sent right away.
+
+    Expects:
+        'account_id' `<str>` (REQUIRED)
+        'count'      `<int>` (OPTIONAL)
+
+    Returns: None
+    """
+
+    # queue for the next flush
+    if settings.METER_BATCH_ENABLED:
+        try:
+            redis_client.hincrby(METER_PENDING_KEY, str(account_id), int(count))
+            return None
+        except Exception as e:
+            print(f'meter queue failed, sending now -> {e}')
+
+    # send stripe request
+    send_meter_event(account_id, count)
+
+    # return
+    return None
+
+
+
+
+def send_meter_event(account_id: str=None, count: int=1, identifier: str=None) -> None:
+    """
+    Sends a `MeterEvent` request to Stripe to
     track account usage
 
     Expects:
-        'account_id' `<str>` (REQUIRED)   
-        'count'      `<int>` (OPTIONAL)   
+        'account_id' `<str>` (REQUIRED)
+        'count'      `<int>` (OPTIONAL)
+        'identifier' `<str>` (OPTIONAL, dedupes retries)
 
     Returns: None
     """
@@ -26,13 +73,90 @@ def meter_account(account_id: str=None, count: int=1) -> None:
     account = Account.objects.get(id=account_id)
 
     # send stripe request
-    stripe.billing.MeterEvent.create(
-        event_name  = 'tasks',
-        payload     = {
-            'stripe_customer_id': account.cust_id, 
+    event = {
+        'event_name': 'tasks',
+        'payload': {
+            'stripe_customer_id': account.cust_id,
             'value': count
         },
-    )
+    }
+    if identifier:
+        event['identifier'] = identifier
+    stripe.billing.MeterEvent.create(**event)
 
     # return
-    return None
\ No newline at end of file
+    return None
+
+
+
+
+def send_meter_batch(batch_key: str=None) -> int:
+    """
+    Sends one `MeterEvent` per account in the claimed
+    batch hash, adds counts that fail to send back to
+    the pending hash & deletes the batch. Each event's
+    identifier is derived from the batch key, so a batch
+    re-sent after a crash is deduplicated by Stripe.
+
+    Args:
+        'batch_key' : str
+
+    Returns:
+        int, number of events sent
+    """
+    sent = 0
+    for account_id, count in redis_client.hgetall(batch_key).items():
+        account_id = account_id.decode() if isinstance(account_id, bytes) else account_id
+        count = int(count)
+        if count <= 0:
+            continue
+        try:
+            send_meter_event(account_id, count, identifier=f'{batch_key}:{account_id}')
+            sent += 1
+        except Account.DoesNotExist:
+            continue
+        except Exception as e:
+            print(f'meter event failed for {account_id} -> {e}')
+            redis_client.hincrby(METER_PENDING_KEY, account_id, count)
+
+    redis_client.delete(batch_key)
+    return sent
+
+
+
+
+def flush_meter_events() -> int:
+    """
+    Sends one `MeterEvent` per account with the counts
+    queued by `meter_account()` since the last flush.
+    The pending hash is renamed first so new counts
+    keep accumulating. Batches left behind by a flush 
+    that crashed are sent first, and counts that fail
+    to send are added back for the next flush.
+
+    Returns:
+        int, number of events sent
+    """
+
+    # one flush at a time, so any batch found is orphaned
+    if not redis_client.set(METER_FLUSH_LOCK, '1', nx=True, ex=300):
+        return 0
+
+    sent = 0
+    try:
+        # resend orphaned batches
+        for batch_key in redis_client.scan_iter(match=f'{METER_BATCH_PREFIX}*'):
+            batch_key = batch_key.decode() if isinstance(batch_key, bytes) else batch_key
+            sent += send_meter_batch(batch_key)
+
+        # claim the pending counts
+        batch_key = f'{METER_BATCH_PREFIX}{secrets.token_hex(8)}'
+        try:
+            redis_client.rename(METER_PENDING_KEY, batch_key)
+        except Exception:
+            # nothing pending
+            return sent
+        sent += send_meter_batch(batch_key)
+    finally:
+        redis_client.delete(METER_FLUSH_LOCK)
+    return sent
@@ -0,0 +1,176 @@
+// Long-lived Lighthouse runner (see api.utils.lighthouse).
+//
+// Keeps Node & one headless Chrome warm and accepts audit jobs
+// over a unix socket as newline delimited JSON:
+//
+//   -> {"id": "...", "url": "https://...", "flags": {...}}
+//   <- {"id": "...", "ok": true}
+//   <- {...lhr...}
+//   or
+//   <- {"id": "...", "ok": false, "error": "..."}
+//
+// The report follows its status line so the client can
+// parse it incrementally.
+//
+// Up to LIGHTHOUSE_RUNNER_CONCURRENCY jobs run at once, each in
+// a fresh browser context (no shared cache, cookies or storage)
+// which is closed after the run. Chrome is relaunched if it
+// crashes & recycled every LIGHTHOUSE_RUNNER_MAX_RUNS runs.
+
+import net from 'node:net';
+import fs from 'node:fs';
+import path from 'node:path';
+import { execSync } from 'node:child_process';
+import { createRequire } from 'node:module';
+import { pathToFileURL } from 'node:url';
+
+
+const SOCKET = process.env.LIGHTHOUSE_RUNNER_SOCKET || '/tmp/lighthouse-runner.sock';
+const CONCURRENCY = parseInt(process.env.LIGHTHOUSE_RUNNER_CONCURRENCY || '2', 10);
+const MAX_RUNS = parseInt(process.env.LIGHTHOUSE_RUNNER_MAX_RUNS || '100', 10);
+const CHROME_PATH = process.env.LIGHTHOUSE_CHROME_PATH || '/usr/bin/google-chrome';
+const CONFIG_PATH = path.resolve(process.env.LIGHTHOUSE_CONFIG_PATH || 'api/utils/configs/default-config.js');
+
+
+// lighthouse, its plugins & puppeteer-core are installed globally
+const GLOBAL_ROOT = process.env.NODE_GLOBAL_ROOT || execSync('npm root -g').toString().trim();
+const requireGlobal = createRequire(path.join(GLOBAL_ROOT, 'noop.js'));
+const importGlobal = async (name) => import(pathToFileURL(requireGlobal.resolve(name)).href);
+
+const { default: lighthouse } = await importGlobal('lighthouse');
+const puppeteerModule = await importGlobal('puppeteer-core');
+const puppeteer = puppeteerModule.default?.launch ? puppeteerModule.default : puppeteerModule;
+const { default: config } = await import(pathToFileURL(CONFIG_PATH).href);
+
+
+let browser = null;
+let launching = null;
+let runs = 0;
+let active = 0;
+const queue = [];
+
+
+
+
+const isConnected = (b) => b && (typeof b.isConnected === 'function' ? b.isConnected() : b.connected);
+
+
+
+
+async function getBrowser() {
+  // recycle once idle & past MAX_RUNS
+  if (browser && runs >= MAX_RUNS && active <= 1) {
+    await browser.close().catch(() => {});
+    browser = null;
+  }
+  if (isConnected(browser)) {
+    return browser;
+  }
+  if (!launching) {
+    launching = puppeteer.launch({
+      executablePath: CHROME_PATH,
+      headless: true,
+      args: ['--no-sandbox', '--disable-dev-shm-usage'],
+    }).then((b) => {
+      browser = b;
+      runs = 0;
+      return b;
+    }).finally(() => {
+      launching = null;
+    });
+  }
+  return launching;
+}
+
+
+
+
+async function run(job) {
+  const b = await getBrowser();
+  runs += 1;
+
+  // isolate each run in its own context
+  const context = typeof b.createBrowserContext === 'function'
+    ? await b.createBrowserContext()
+    : await b.createIncognitoBrowserContext();
+  try {
+    const page = await context.newPage();
+    const flags = { ...(job.flags || {}), output: 'json', logLevel: 'error' };
+    const result = await lighthouse(job.url, flags, config, page);
+    if (!result || !result.lhr) {
+      throw new Error('lighthouse returned no result');
+    }
+    return result.lhr;
+  } finally {
+    await context.close().catch(() => {});
+  }
+}
+
+
+
+
+function drain() {
+  while (active < CONCURRENCY && queue.length > 0) {
+    const { job, reply } = queue.shift();
+    active += 1;
+    run(job)
+      .then((lhr) => reply({ id: job.id, ok: true }, lhr))
+      .catch((err) => reply({ id: job.id, ok: false, error: String((err && err.stack) || err) }))
+      .finally(() => {
+        active -= 1;
+        drain();
+      });
+  }
+}
+
+
+
+
+const server = net.createServer((conn) => {
+  let buffer = '';
+  conn.setEncoding('utf8');
+  conn.on('error', () => {});
+  conn.on('data', (chunk) => {
+    buffer += chunk;
+    let index;
+    while ((index = buffer.indexOf('\n')) >= 0) {
+      const line = buffer.slice(0, index).trim();
+      buffer = buffer.slice(index + 1);
+      if (!line) continue;
+      let job;
+      try {
+        job = JSON.parse(line);
+      } catch (err) {
+        conn.write(JSON.stringify({ id: null, ok: false, error: `bad job: ${err}` }) + '\n');
+        continue;
+      }
+      queue.push({
+        job,
+        reply: (resp, lhr) => {
+          if (conn.destroyed) return;
+          conn.write(JSON.stringify(resp) + '\n');
+          if (lhr) conn.write(JSON.stringify(lhr) + '\n');
+        },
+      });
+      drain();
+    }
+  });
+});
+
+
+
+
+// replace any stale socket from a previous run
+if (fs.existsSync(SOCKET)) fs.unlinkSync(SOCKET);
+server.listen(SOCKET, () => {
+  console.log(`lighthouse runner listening on ${SOCKET} (concurrency ${CONCURRENCY})`);
+  getBrowser().catch((err) => console.error(`chrome launch failed -> ${err}`));
+});
+
+const shutdown = async () => {
+  server.close();
+  if (browser) await browser.close().catch(() => {});
+  process.exit(0);
+};
+process.on('SIGTERM', shutdown);
+process.on('SIGINT', shutdown);
@@ -0,0 +1,562 @@
+from .driver import driver_init, quit_driver
+from cursion import settings
+from datetime import datetime
+import atexit, os, threading
+
+
+
+
+
+
+class DriverPool():
+    """
+    Per-process pool of warm selenium drivers keyed by
+    (browser, window_size, device, scale_factor).
+
+    Drivers are health checked and reset (cookies, storage,
+    tabs, logs) between leases and recycled once they reach
+    `max_uses` or their process tree grows past `max_rss_mb`.
+
+    Args:
+        'max_uses'      : int,
+        'max_idle'      : int,
+        'max_idle_time' : int,
+        'max_rss_mb'    : int
+
+    Use `lease()` & `release()` to borrow and return a driver
+
+    Returns:
+        `DriverPool` object
+    """
+
+
+
+
+    def __init__(
+            self,
+            max_uses        : int=20,
+            max_idle        : int=1,
+            max_idle_time   : int=300,
+            max_rss_mb      : int=1024
+        ):
+
+        # pool configs
+        self.max_uses       = max_uses
+        self.max_idle       = max_idle
+        self.max_idle_time  = max_idle_time
+        self.max_rss_mb     = max_rss_mb
+
+        # idle entries (oldest first) & leased entries by id(driver)
+        self.idle   = []
+        self.leased = {}
+        self.lock   = threading.Lock()
+
+        # running counters
+        self.counters = {
+            'created'   : 0,
+            'reused'    : 0,
+            'recycled'  : 0,
+            'discarded' : 0,
+        }
+
+
+
+
+    def _key(
+            self,
+            browser         : str='chrome',
+            window_size     : str='1920,1080',
+            device          : str='Windows 10 PC',
+            scale_factor    : float=0.5
+        ) -> tuple:
+        return (
+            str(browser or 'chrome'),
+            str(window_size or '1920,1080'),
+            str(device or 'Windows 10 PC'),
+            str(scale_factor)
+        )
+
+
+
+
+    def _process_rss_mb(self, driver: object) -> float:
+        """
+        Sums the resident memory of the driver service
+        process and all of its children (the browser)
+        by reading /proc.
+
+        Returns: float (MB) or None if unavailable
+        """
+        try:
+            root = driver.service.process.pid
+        except Exception:
+            return None
+
+        # build a pid -> ppid map
+        parents = {}
+        try:
+            for pid in os.listdir('/proc'):
+                if not pid.isdigit():
+                    continue
+                try:
+                    with open(f'/proc/{pid}/stat', 'r') as f:
+                        stat = f.read()
+                    # ppid is the 2nd field after the ")" of the comm name
+                    parents[int(pid)] = int(stat.rsplit(')', 1)[1].split()[1])
+                except Exception:
+                    continue
+        except Exception:
+            return None
+
+        # collect the process tree
+        tree = [root]
+        i = 0
+        while i < len(tree):
+            tree += [p for p, pp in parents.items() if pp == tree[i]]
+            i += 1
+
+        # sum VmRSS in kB
+        total = 0
+        for pid in tree:
+            try:
+                with open(f'/proc/{pid}/status', 'r') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            total += int(line.split()[1])
+                            break
+            except Exception:
+                continue
+
+        return round(total / 1024, 2)
+
+
+
+
+    def _is_healthy(self, driver: object) -> bool:
+        """
+        Confirms the driver session still responds.
+
+        Returns: bool
+        """
+        try:
+            driver.window_handles
+            return driver.execute_script('return 1') == 1
+        except Exception:
+            return False
+
+
+
+
+    def _reset(self, entry: dict) -> bool:
+        """
+        Clears cookies, storage, extra tabs, buffered logs,
+        window size & implicit waits so the next lease
+        starts from a blank session. Storage is only 
+        cleared for the current origin, so authenticated 
+        runs (Caser, AutoCaser) don't use pooled drivers.
+
+        Returns: bool (True if reset succeeded)
+        """
+        driver = entry['driver']
+        browser = entry['key'][0]
+        sizes = entry['key'][1].split(',')
+
+        try:
+            # close any extra tabs or windows
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+
+            # clear storage for the current origin
+            try:
+                driver.execute_script(
+                    'try{window.localStorage.clear();window.sessionStorage.clear();}catch(e){}'
+                )
+            except Exception:
+                pass
+
+            # clear cookies, cache & origin data
+            driver.delete_all_cookies()
+            if browser != 'firefox':
+                driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+                driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+                try:
+                    origin = driver.execute_script('return window.location.origin')
+                    if origin and origin.startswith('http'):
+                        driver.execute_cdp_cmd('Storage.clearDataForOrigin', {
+                            'origin': origin, 'storageTypes': 'all'
+                        })
+                except Exception:
+                    pass
+
+            # navigate away & reset viewport
+            driver.get('about:blank')
+            driver.implicitly_wait(0)
+            driver.set_window_size(int(sizes[0]), int(sizes[1]))
+
+            # drain buffered logs so the next lease only sees its own
+            if browser != 'firefox':
+                for log_type in ['browser', 'performance']:
+                    try:
+                        driver.get_log(log_type)
+                    except Exception:
+                        pass
+
+            return True
+
+        except Exception as e:
+            print(f'unable to reset pooled driver -> {e}')
+            return False
+
+
+
+
+    def _should_recycle(self, entry: dict) -> bool:
+        """
+        Decides if the entry has exceeded its
+        max_uses or max_rss_mb.
+
+        Returns: bool
+        """
+        if entry['uses'] >= self.max_uses:
+            return True
+        rss = self._process_rss_mb(entry['driver'])
+        entry['rss_mb'] = rss
+        if rss is not None and self.max_rss_mb and rss > self.max_rss_mb:
+            return True
+        return False
+
+
+
+
+    def _discard(self, entry: dict, counter: str='discarded') -> None:
+        self.counters[counter] += 1
+        try:
+            quit_driver(entry['driver'])
+        except Exception as e:
+            print(e)
+
+
+
+
+    def _create(self, key: tuple) -> dict:
+        driver = driver_init(
+            browser=key[0],
+            window_size=key[1],
+            device=key[2],
+            scale_factor=float(key[3])
+        )
+        with self.lock:
+            self.counters['created'] += 1
+        return {
+            'key'       : key,
+            'driver'    : driver,
+            'uses'      : 0,
+            'rss_mb'    : None,
+            'created'   : datetime.now(),
+            'released'  : None,
+        }
+
+
+
+
+    def _evict_stale(self) -> list:
+        # must be called with self.lock held
+        stale = []
+        now = datetime.now()
+        for entry in list(self.idle):
+            if (now - entry['released']).total_seconds() > self.max_idle_time:
+                self.idle.remove(entry)
+                stale.append(entry)
+        return stale
+
+
+
+
+    def lease(
+            self,
+            browser         : str='chrome',
+            window_size     : str='1920,1080',
+            device          : str='Windows 10 PC',
+            scale_factor    : float=0.5
+        ) -> object:
+        """
+        Returns a warm driver matching the passed configs
+        or starts a new one if none are idle.
+
+        Args:
+            'browser'       : str,
+            'window_size'   : str,
+            'device'        : str,
+            'scale_factor'  : float
+
+        Returns: driver object
+        """
+        key = self._key(browser, window_size, device, scale_factor)
+        entry = None
+
+        # find a matching idle driver
+        with self.lock:
+            stale = self._evict_stale()
+            for e in self.idle:
+                if e['key'] == key:
+                    entry = e
+                    self.idle.remove(e)
+                    break
+        for e in stale:
+            self._discard(e, 'recycled')
+
+        # confirm the idle driver is still usable
+        if entry is not None and not self._is_healthy(entry['driver']):
+            self._discard(entry)
+            entry = None
+
+        if entry is None:
+            entry = self._create(key)
+        else:
+            with self.lock:
+                self.counters['reused'] += 1
+
+        entry['uses'] += 1
+        with self.lock:
+            self.leased[id(entry['driver'])] = entry
+        return entry['driver']
+
+
+
+
+    def release(self, driver: object=None, discard: bool=False) -> None:
+        """
+        Returns the driver to the pool, or quits it if
+        it is unhealthy, past its limits or `discard` is True.
+
+        Args:
+            'driver'    : object,
+            'discard'   : bool
+
+        Returns: None
+        """
+        if driver is None:
+            return None
+
+        with self.lock:
+            entry = self.leased.pop(id(driver), None)
+
+        # not a pooled driver
+        if entry is None:
+            quit_driver(driver)
+            return None
+
+        if discard or not self._is_healthy(driver):
+            self._discard(entry)
+            return None
+
+        if self._should_recycle(entry):
+            self._discard(entry, 'recycled')
+            return None
+
+        if not self._reset(entry):
+            self._discard(entry)
+            return None
+
+        # add to idle, evicting the oldest over max_idle
+        entry['released'] = datetime.now()
+        evicted = []
+        with self.lock:
+            self.idle.append(entry)
+            while len(self.idle) > self.max_idle:
+                evicted.append(self.idle.pop(0))
+        for e in evicted:
+            self._discard(e, 'recycled')
+
+        return None
+
+
+
+
+    def warm(
+            self,
+            browser         : str='chrome',
+            window_size     : str='1920,1080',
+            device          : str='Windows 10 PC',
+            scale_factor    : float=0.5
+        ) -> None:
+        """
+        Pre-launches an idle driver for the passed configs.
+
+        Returns: None
+        """
+        key = self._key(browser, window_size, device, scale_factor)
+        try:
+            entry = self._create(key)
+        except Exception as e:
+            print(f'unable to warm driver pool -> {e}')
+            return None
+        entry['released'] = datetime.now()
+        evicted = []
+        with self.lock:
+            self.idle.append(entry)
+            while len(self.idle) > self.max_idle:
+                evicted.append(self.idle.pop(0))
+        for e in evicted:
+            self._discard(e, 'recycled')
+        return None
+
+
+
+
+    def stats(self) -> dict:
+        """
+        Returns current pool counters & entries.
+
+        Returns: dict
+        """
+        with self.lock:
+            return {
+                **self.counters,
+                'idle'  : len(self.idle),
+                'leased': len(self.leased),
+                'pid'   : os.getpid(),
+                'entries': [
+                    {
+                        'key'   : list(e['key']),
+                        'uses'  : e['uses'],
+                        'rss_mb': e['rss_mb'],
+                        'state' : state,
+                    }
+                    for state, entries in (('idle', self.idle), ('leased', list(self.leased.values())))
+                    for e in entries
+                ],
+            }
+
+
+
+
+    def close(self) -> None:
+        """
+        Quits all idle & leased drivers.
+
+        Returns: None
+        """
+        with self.lock:
+            entries = self.idle + list(self.leased.values())
+            self.idle = []
+            self.leased = {}
+        for entry in entries:
+            try:
+                quit_driver(entry['driver'])
+            except Exception:
+                pass
+        return None
+
+
+
+
+# pool for this process, re-created after fork
+_pool = None
+_pool_pid = None
+
+
+
+
+def get_pool() -> DriverPool:
+    """
+    Returns the `DriverPool` for the current process.
+
+    Returns: `DriverPool`
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = DriverPool(
+            max_uses=settings.DRIVER_POOL_MAX_USES,
+            max_idle=settings.DRIVER_POOL_MAX_IDLE,
+            max_idle_time=settings.DRIVER_POOL_MAX_IDLE_TIME,
+            max_rss_mb=settings.DRIVER_POOL_MAX_RSS_MB,
+        )
+        _pool_pid = os.getpid()
+    return _pool
+
+
+
+
+def lease_driver(
+        browser         : str='chrome',
+        window_size     : str='1920,1080',
+        device          : str='Windows 10 PC',
+        scale_factor    : float=0.5,
+        pooled          : bool=True
+    ) -> object:
+    """
+    Leases a driver from the process pool, or
+    starts a new one if pooling is disabled or 
+    `pooled` is False. Pass `pooled=False` for runs 
+    that log in or use account secrets: a reset only 
+    clears the last origin's storage, so data from 
+    other origins could reach the next lease. 
+    `release_driver()` quits unpooled drivers.
+
+    Args:
+        'browser'       : str,
+        'window_size'   : str,
+        'device'        : str,
+        'scale_factor'  : float,
+        'pooled'        : bool
+
+    Returns: driver object
+    """
+    if not settings.DRIVER_POOL_ENABLED or not pooled:
+        return driver_init(
+            browser=browser or 'chrome',
+            window_size=window_size or '1920,1080',
+            device=device or 'Windows 10 PC',
+            scale_factor=scale_factor
+        )
+    return get_pool().lease(
+        browser=browser,
+        window_size=window_size,
+        device=device,
+        scale_factor=scale_factor
+    )
+
+
+
+
+def release_driver(driver: object=None, discard: bool=False) -> None:
+    """
+    Returns a leased driver to the process pool,
+    or quits it if pooling is disabled.
+
+    Args:
+        'driver'    : object,
+        'discard'   : bool
+
+    Returns: None
+    """
+    if driver is None:
+        return None
+    if not settings.DRIVER_POOL_ENABLED:
+        quit_driver(driver)
+        return None
+    get_pool().release(driver, discard=discard)
+    return None
+
+
+
+
+def close_pool() -> None:
+    """
+    Quits all drivers held by this process.
+
+    Returns: None
+    """
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+    return None
+
+
+
+
+# quit pooled drivers when the process exits
+atexit.register(close_pool)
@@ -1,12 +1,13 @@
 from ..models import *
 from cursion import settings
+from .storage import upload_file, get_url
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
 from reportlab.lib.colors import HexColor
 from reportlab.pdfgen import canvas
 from django.utils import timezone
 from datetime import timedelta
-import os, boto3, textwrap, requests
+import os, textwrap, requests
 
 
 
@@ -73,13 +74,6 @@ class Report():
         self.y = 9
         self.y_marg = .04
 
-        # define s3 instance
-        self.s3 = boto3.client('s3', aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-            aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-            region_name=str(settings.AWS_S3_REGION_NAME), 
-            endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
-        )
-
         # report-window settings
         self.lookback_days = self.get_lookback_days()
         self.window_start = timezone.now() - timedelta(days=self.lookback_days)
@@ -123,13 +117,9 @@ class Report():
         self.c.save()
         remote_path = f'static/sites/{self.report.site.id}/{self.report.id}.pdf'
         # uploading package to remote s3 
-        with open(self.local_path, 'rb') as data:
-            self.s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME),
-                remote_path, ExtraArgs={
-                    'ACL': 'public-read', 'ContentType': 'application/pdf'}
-            )
+        upload_file(self.local_path, remote_path, content_type='application/pdf')
         # building and saving report_url
-        report_url = f'{settings.AWS_S3_URL_PATH}/{remote_path}#toolbar=0'
+        report_url = f'{get_url(remote_path)}#toolbar=0'
         self.report.path = report_url
         self.report.save()
         os.remove(self.local_path)
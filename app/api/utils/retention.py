@@ -0,0 +1,231 @@
+from ..queue import redis_client
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import datetime, timezone as tz
+from cursion import settings
+import time, json, re
+
+
+
+
+
+
+def _checkpoint_key(scope: str=None, label: str=None) -> str:
+    return f'retention:{scope or "all"}:{label}'
+
+
+
+
+def get_checkpoint(scope: str=None, label: str=None) -> dict:
+    """
+    Returns the saved progress for the scope & label
+    (e.g. {'last': <iso time_created>, 'deleted': int}),
+    or None if no run is in progress.
+    """
+    try:
+        data = redis_client.get(_checkpoint_key(scope, label))
+        return json.loads(data) if data else None
+    except Exception as e:
+        print(f'retention checkpoint read failed -> {e}')
+        return None
+
+
+
+
+def set_checkpoint(scope: str=None, label: str=None, data: dict=None) -> None:
+    try:
+        key = _checkpoint_key(scope, label)
+        if data is None:
+            redis_client.delete(key)
+            return None
+        redis_client.set(key, json.dumps(data), ex=settings.RETENTION_CHECKPOINT_TTL)
+    except Exception as e:
+        print(f'retention checkpoint write failed -> {e}')
+    return None
+
+
+
+
+def delete_in_chunks(
+        queryset: object=None,
+        label: str=None,
+        scope: str=None,
+        chunk_size: int=None,
+        rows_per_sec: int=None,
+        before_delete: callable=None
+    ) -> int:
+    """
+    Deletes the rows matched by `queryset` oldest first,
+    `chunk_size` primary keys at a time, each chunk in its
+    own short transaction. After every chunk progress is
+    checkpointed in redis so an interrupted run resumes
+    from the last `time_created`, and the loop sleeps as
+    needed to stay under `rows_per_sec`.
+
+    Args:
+        'queryset'      : QuerySet (must have `time_created`),
+        'label'         : str, name used for checkpoints & logs,
+        'scope'         : str, e.g. account id (None for all),
+        'chunk_size'    : int (defaults to RETENTION_CHUNK_SIZE),
+        'rows_per_sec'  : int (defaults to RETENTION_ROWS_PER_SEC,
+                          0 for unlimited),
+        'before_delete' : callable, called with each chunk's
+                          queryset inside its transaction (e.g.
+                          `release_scan_artifacts`)
+
+    Returns:
+        int (number of rows deleted, excluding cascades)
+    """
+    chunk_size = chunk_size or settings.RETENTION_CHUNK_SIZE
+    rows_per_sec = settings.RETENTION_ROWS_PER_SEC if rows_per_sec is None else rows_per_sec
+    model = queryset.model
+
+    # resume from the last checkpoint
+    checkpoint = get_checkpoint(scope, label) or {}
+    deleted = int(checkpoint.get('deleted', 0))
+    if checkpoint.get('last'):
+        queryset = queryset.filter(time_created__gte=datetime.fromisoformat(checkpoint['last']))
+
+    start = time.monotonic()
+    removed = 0
+    while True:
+        rows = list(
+            queryset.order_by('time_created', 'id')
+            .values_list('id', 'time_created')[:chunk_size]
+        )
+        if not rows:
+            break
+
+        with transaction.atomic():
+            chunk = model.objects.filter(id__in=[row[0] for row in rows])
+            if before_delete is not None:
+                before_delete(chunk)
+            chunk.delete()
+
+        removed += len(rows)
+        deleted += len(rows)
+        set_checkpoint(scope, label, {
+            'last': rows[-1][1].isoformat(),
+            'deleted': deleted,
+        })
+
+        # stay within the rows/sec budget
+        if rows_per_sec:
+            ahead = (removed / rows_per_sec) - (time.monotonic() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+        if len(rows) < chunk_size:
+            break
+
+    # run finished, clear progress
+    set_checkpoint(scope, label, None)
+    print(f'retention deleted {deleted} {label} rows ({scope or "all"})')
+    return deleted
+
+
+
+
+def expired_partitions(table: str=None, max_date: datetime=None) -> list:
+    """
+    Lists the range partitions of `table` (partitioned on
+    `time_created`) whose upper bound is at or before
+    `max_date`. Returns [] if the table is not partitioned.
+
+    Args:
+        'table'     : str, parent table name (e.g. 'api_log'),
+        'max_date'  : datetime
+
+    Returns:
+        list of str (partition table names)
+    """
+    sql = '''
+        SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+        FROM pg_inherits
+        JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+        JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+        WHERE parent.relname = %s
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        # e.g. "FOR VALUES FROM ('2025-01-01 00:00:00+00') TO ('2025-02-01 00:00:00+00')"
+        match = re.search(r"TO \('([^']+)'\)", bound or '')
+        if not match:
+            continue
+        try:
+            upper = datetime.fromisoformat(match.group(1))
+        except ValueError:
+            continue
+        if timezone.is_naive(upper):
+            upper = timezone.make_aware(upper, tz.utc)
+        if upper <= max_date:
+            partitions.append(name)
+    return partitions
+
+
+
+
+def drop_expired_partitions(table: str=None, max_date: datetime=None) -> list:
+    """
+    Drops every partition of `table` returned by
+    `expired_partitions()`, detaching it first so the
+    parent is only briefly locked.
+
+    Args:
+        'table'     : str,
+        'max_date'  : datetime
+
+    Returns:
+        list of str (dropped partitions)
+    """
+    dropped = []
+    for name in expired_partitions(table, max_date):
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+            cursor.execute(f'DROP TABLE "{name}"')
+        dropped.append(name)
+        print(f'retention dropped partition {name}')
+    return dropped
+
+
+
+
+def delete_expired(
+        queryset: object=None,
+        label: str=None,
+        scope: str=None,
+        max_date: datetime=None,
+        before_delete: callable=None
+    ) -> int:
+    """
+    Removes expired rows, first dropping whole partitions
+    when the model's table is listed in
+    RETENTION_PARTITIONED_TABLES (only for unscoped runs,
+    as partitions span accounts; scheduled retention runs
+    per account & drops partitions in the global
+    `drop_old_partitions` task), then deleting whatever
+    remains in chunks.
+
+    Args:
+        'queryset'  : QuerySet, already filtered to expired rows,
+        'label'     : str,
+        'scope'     : str, e.g. account id (None for all),
+        'max_date'  : datetime, the expiry cutoff,
+        'before_delete' : callable, see `delete_in_chunks()`
+                      (partitions are not dropped when set)
+
+    Returns:
+        int (number of rows deleted by chunks)
+    """
+    table = queryset.model._meta.db_table
+    if (scope is None and max_date and before_delete is None and 
+            table in settings.RETENTION_PARTITIONED_TABLES):
+        try:
+            drop_expired_partitions(table, max_date)
+        except Exception as e:
+            print(f'partition drop failed for {table} -> {e}')
+    return delete_in_chunks(queryset, label=label, scope=scope, before_delete=before_delete)
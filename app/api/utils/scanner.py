@@ -1,19 +1,20 @@
-from .driver import (
-    driver_init, quit_driver, 
-    get_data
-)
+from .driver import get_data
+from .pool import lease_driver, release_driver
 from ..models import *
 from .alerter import Alerter
 from .lighthouse import Lighthouse
 from .security import Security
 from .imager import Imager
 from .updater import update_flowrun
-from .manager import record_task
+from .manager import record_task, record_readiness
+from .leases import lease_heartbeat
 from .tester import Tester
+from .storage import upload_bytes, put_artifact
 from django.core.cache import cache
+from django.db import transaction
 from datetime import datetime
 from cursion import settings
-import os, uuid, boto3, random, time
+import uuid
 
 
 
@@ -77,7 +78,7 @@ class Scanner():
         sec_data = None
         
         # running scan steps with selenium driver
-        driver = driver_init(
+        driver = lease_driver(
             browser=self.scan.configs.get('browser', 'chrome'),
             window_size=self.scan.configs['window_size'], 
             device=self.scan.configs['device']
@@ -99,8 +100,8 @@ class Scanner():
         if 'security' in self.scan.type or 'full' in self.scan.type:
             sec_data = Security(scan=self.scan, driver=driver).get_data()
 
-        # quiting selenium instance
-        quit_driver(driver)
+        # releasing selenium instance
+        release_driver(driver)
 
         # updating Scan object
         if html is not None:
@@ -158,7 +159,7 @@ def update_scan_score(scan: object) -> object:
 
     # save to scan
     scan.score = score
-    scan.save()
+    scan.save(update_fields=['score'])
         
     # returning scan
     return scan
@@ -231,7 +232,7 @@ def update_page_info(scan: object) -> object:
 
 def save_html(html: str, scan: object) -> object:
     """
-    Saves html page source as a '.txt' file and uploads 
+    Uploads html page source as a '.txt' file 
     to s3. Then saves the remote uri to the `scan` obj.
 
     Args:
@@ -241,37 +242,17 @@ def save_html(html: str, scan: object) -> object:
     Returns: `Scan` <obj>
     """
 
-    # setup boto3 configuration
-    s3 = boto3.client(
-        's3', aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-        aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-        region_name=str(settings.AWS_S3_REGION_NAME), 
-        endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
-    )
-    
-    # save html data as text file
-    file_id = uuid.uuid4()
-    with open(f'{file_id}.txt', 'w') as fp:
-        fp.write(html)
-    
-    # upload to s3 and return url
-    html_file = os.path.join(settings.BASE_DIR, f'{file_id}.txt')
-    remote_path = f'static/sites/{scan.site.id}/{scan.page.id}/{scan.id}/{file_id}.txt'
-    root_path = settings.AWS_S3_URL_PATH
-    html_url = f'{root_path}/{remote_path}'
-
-    # upload to s3
-    with open(html_file, 'rb') as data:
-        s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME), 
-            remote_path, ExtraArgs={'ACL': 'public-read', 'ContentType': "text/plain"}
-        )
+    # upload from memory to s3, deduplicated by content
+    if settings.ARTIFACT_STORE_ENABLED:
+        html_url = put_artifact(html, ext='txt', content_type='text/plain', previous=scan.html)
+    else:
+        file_id = uuid.uuid4()
+        remote_path = f'static/sites/{scan.site.id}/{scan.page.id}/{scan.id}/{file_id}.txt'
+        html_url = upload_bytes(html, remote_path, content_type='text/plain')
     
     # save to scan obj
     scan.html = html_url
-    scan.save()
-
-    # remove local copy
-    os.remove(html_file)
+    scan.save(update_fields=['html'])
 
     # return scan
     return scan
@@ -279,6 +260,76 @@ def save_html(html: str, scan: object) -> object:
 
 
 
+def get_pending_components(scan: object) -> list:
+    """
+    Lists the requested components of the `Scan` 
+    which have not saved their data yet.
+
+    Args:
+        scan: object
+
+    Returns:
+        list of components (html, logs, lighthouse, security, images)
+    """
+
+    # setting defaults
+    pending = []
+
+    # checking for each scan type completion
+    if 'html' in scan.type or 'full' in scan.type:
+        if scan.html == None or scan.html == '':
+            pending.append('html')
+
+    if 'logs' in scan.type or 'full' in scan.type:
+        if scan.logs == None or scan.logs == '':
+            pending.append('logs')
+
+    if 'lighthouse' in scan.type or 'full' in scan.type:
+        if scan.lighthouse.get('scores').get('average') == None and scan.lighthouse.get('failed') == None:
+            pending.append('lighthouse')
+
+    if 'security' in scan.type or 'full' in scan.type:
+        if scan.security.get('scores').get('average') == None and scan.security.get('failed') == None:
+            pending.append('security')
+
+    if 'images' in scan.type or 'vrt' in scan.type or 'full' in scan.type:
+        if scan.images == None or scan.images == '':
+            pending.append('images')
+
+    # return pending
+    return pending
+
+
+
+
+def claim_scan_completion(scan_id: str=None) -> tuple:
+    """
+    Locks the `Scan` row and, if no components are pending 
+    and the scan is not yet completed, sets `time_completed`. 
+    Components save their data before calling this, so 
+    with the lock exactly one caller (the last component 
+    to finish) claims the completion, without waiting for 
+    the other components' writes.
+
+    Args:
+        scan_id: str
+
+    Returns:
+        tuple (`Scan` <obj>, claimed <bool>)
+    """
+
+    with transaction.atomic():
+        scan = Scan.objects.select_for_update().get(id=scan_id)
+        if scan.time_completed is not None or get_pending_components(scan):
+            return scan, False
+        scan.time_completed = datetime.now()
+        scan.save(update_fields=['time_completed'])
+
+    return scan, True
+
+
+
+
 def check_scan_completion(
         scan: object,
         sender: str=None, 
@@ -290,7 +341,9 @@ def check_scan_completion(
     """
     Method that checks if the scan has finished all 
     components. If so, method also updates Scan, Site, 
-    & Page info.
+    & Page info. Called by every component once its data 
+    is saved; see `claim_scan_completion()` for how only 
+    the last one proceeds.
 
     Args:
         scan: object,
@@ -303,37 +356,11 @@ def check_scan_completion(
     Returns: `Scan` <obj>
     """
 
-    # sleeping random for DB update
-    time.sleep(random.uniform(0.1, 2))
-
-    # setting defaults
-    finished = True
-
-    # checking for each scan type completion
-    if 'html' in scan.type or 'full' in scan.type:
-        if scan.html == None or scan.html == '':
-            finished = False
-
-    if 'logs' in scan.type or 'full' in scan.type:
-        if scan.logs == None or scan.logs == '':
-            finished = False
-
-    if 'lighthouse' in scan.type or 'full' in scan.type:
-        if scan.lighthouse.get('scores').get('average') == None and scan.lighthouse.get('failed') == None:
-            finished = False
-
-    if 'security' in scan.type or 'full' in scan.type:
-        if scan.security.get('scores').get('average') == None and scan.security.get('failed') == None:
-            finished = False
-
-    if 'images' in scan.type or 'vrt' in scan.type or 'full' in scan.type:
-        if scan.images == None or scan.images == '':
-            finished = False
+    # only the last component to finish continues
+    scan, finished = claim_scan_completion(scan.id)
 
     # deciding if done
     if finished is True:
-        scan.time_completed = datetime.now()
-        scan.save()
 
         # update assoc site, page, & scan score
         update_scan_score(scan)
@@ -366,7 +393,6 @@ def check_scan_completion(
 
         # update flowrun
         if flowrun_id and flowrun_id != 'None':
-            time.sleep(random.uniform(0.1, 5))
             update_flowrun(**{
                 'flowrun_id': str(flowrun_id),
                 'node_index': node_index,
@@ -407,7 +433,6 @@ def check_scan_completion(
             try:
                 # update flowrun
                 if flowrun_id and flowrun_id != 'None':
-                    time.sleep(random.uniform(0.1, 5))
                     update_flowrun(**{
                         'flowrun_id': str(flowrun_id),
                         'node_index': node_index,
@@ -438,7 +463,8 @@ def check_scan_completion(
                 
                 print('\n---------------\nScan Complete\nStarting Test...\n---------------\n')
                 test = Test.objects.get(id=test_id)
-                updated_test = Tester(test=test).run_test()
+                with lease_heartbeat('test', test_id):
+                    updated_test = Tester(test=test).run_test()
 
                 # update flowrun
                 if flowrun_id and flowrun_id != 'None':
@@ -504,7 +530,7 @@ def _html_and_logs(
     try:
         # get html and logs using selenium
         # init driver & get data
-        driver = driver_init(
+        driver = lease_driver(
             browser=scan.configs.get('browser', 'chrome'),
             window_size=scan.configs['window_size'], 
             device=scan.configs['device']
@@ -517,6 +543,7 @@ def _html_and_logs(
             min_wait_time=int(scan.configs['min_wait_time']),
             interval=int(scan.configs['interval'])
         )
+        record_readiness(scan_id, 'html', getattr(driver, 'readiness', None))
         if 'html' in scan.type or 'full' in scan.type:
             html = driver_data['html']
             scan = Scan.objects.get(id=scan_id)
@@ -525,8 +552,8 @@ def _html_and_logs(
             logs = driver_data['logs']
             scan = Scan.objects.get(id=scan_id)
             scan.logs = logs
-            scan.save()
-        quit_driver(driver)
+            scan.save(update_fields=['logs'])
+        release_driver(driver)
         
         # setting flowrun log
         message = f'completed html and logs component for {scan.page.page_url} | scan_id: {scan_id}'
@@ -537,9 +564,9 @@ def _html_and_logs(
         # setting flowrun log
         message = f'html and logs component failed for {scan.page.page_url} | scan_id: {scan_id}'
 
-        # try to quit selenium session
+        # try to discard selenium session
         try:
-            quit_driver(driver)
+            release_driver(driver, discard=True)
         except:
             pass
 
@@ -595,20 +622,24 @@ def _vrt(
             'message': f'starting images component for {scan.page.page_url} | scan_id: {scan_id}',
         })
     
+    # setting defaults
+    driver = None
+
     try:
         # run Imager using selenium
-        driver = driver_init(
+        driver = lease_driver(
             window_size=scan.configs.get('window_size', '1920,1080'), 
             device=scan.configs.get('device', 'desktop'),
             browser=scan.configs.get('browser', 'chrome')
         )
         images = Imager(scan=scan).scan_vrt(driver=driver)
-        quit_driver(driver)
+        record_readiness(scan_id, 'images', getattr(driver, 'readiness', None))
+        release_driver(driver)
         
         # updating Scan object
         scan = Scan.objects.get(id=scan_id)
         scan.images = images
-        scan.save()
+        scan.save(update_fields=['images'])
 
         # setting flowrun log
         message = f'completed images component for {scan.page.page_url} | scan_id: {scan_id}'
@@ -618,6 +649,12 @@ def _vrt(
 
         # setting flowrun log
         message = f'html and logs component failed for {scan.page.page_url} | scan_id: {scan_id}'
+
+        # try to discard selenium session
+        try:
+            release_driver(driver, discard=True)
+        except:
+            pass
     
     # update flowrun
     if flowrun_id and flowrun_id != 'None':
@@ -680,14 +717,14 @@ def _lighthouse(
         # updating Scan object
         scan = Scan.objects.get(id=scan_id)
         scan.lighthouse = lh_data
-        scan.save()
+        scan.save(update_fields=['lighthouse'])
 
         # setting flowrun log
         message = f'completed lighthouse component for {scan.page.page_url} | scan_id: {scan_id}'
         
     except Exception as e:
         scan.lighthouse['failed'] = True
-        scan.save()
+        scan.save(update_fields=['lighthouse'])
         print(e)
 
         # setting flowrun log
@@ -750,20 +787,22 @@ def _security(
 
     try:
         # running security
-        sec_data = Security(scan=scan).get_data()
+        security = Security(scan=scan)
+        sec_data = security.get_data()
+        record_readiness(scan_id, 'security', getattr(security.driver, 'readiness', None))
         print(f'SECURITY failure_status -> {sec_data.get('failed')}')
 
         # updating Scan object
         scan = Scan.objects.get(id=scan_id)
         scan.security = sec_data
-        scan.save()
+        scan.save(update_fields=['security'])
 
         # setting flowrun log
         message = f'completed security component for {scan.page.page_url} | scan_id: {scan_id}'
 
     except Exception as e:
         scan.security['failed'] = True
-        scan.save()
+        scan.save(update_fields=['security'])
         print(e)
 
         # setting flowrun log
@@ -785,3 +824,169 @@ def _security(
 
     # returning updated scan
     return scan
+
+
+
+
+def get_browser_components(scan_type: list=[]) -> list:
+    """
+    Returns the requested `Scan` components which load 
+    the page in a selenium driver and can therefore share 
+    a single browser session.
+
+    Args:
+        scan_type : list
+
+    Returns:
+        list of components ('html', 'images', 'security')
+    """
+
+    # setting defaults
+    components = []
+
+    # checking for each browser based type
+    if 'html' in scan_type or 'logs' in scan_type or 'full' in scan_type:
+        components.append('html')
+    if 'images' in scan_type or 'vrt' in scan_type or 'full' in scan_type:
+        components.append('images')
+    if 'security' in scan_type or 'full' in scan_type:
+        components.append('security')
+
+    # return components
+    return components
+
+
+
+
+def _browser(
+        scan_id: str=None,
+        test_id: str=None,
+        alert_id: str=None,
+        flowrun_id: str=None,
+        node_index: str=None,
+        components: list=None
+    ) -> object:
+    """
+    Method to run the 'html', 'logs', 'images', & 'security' 
+    components of the scan using a single driver and page load. 
+    Each component is persisted separately so a failure in one 
+    does not discard the others.
+
+    Args:
+        scan_id     : str,
+        test_id     : str,
+        alert_id    : str,
+        flowrun_id  : str,
+        node_index  : str,
+        components  : list (defaults to all requested browser components)
+
+    Returns: `Scan` <obj>
+    """
+
+    # retrieve scan
+    scan = Scan.objects.get(id=scan_id)
+
+    # setting defaults
+    driver = None
+    driver_data = None
+    components = components or get_browser_components(scan.type)
+    messages = []
+
+    # update flowrun
+    if flowrun_id and flowrun_id != 'None':
+        update_flowrun(**{
+            'flowrun_id': flowrun_id,
+            'node_index': node_index,
+            'message': f'starting {", ".join(components)} components for {scan.page.page_url} | scan_id: {scan_id}',
+        })
+
+    try:
+        # lease driver & load page once
+        driver = lease_driver(
+            browser=scan.configs.get('browser', 'chrome'),
+            window_size=scan.configs.get('window_size', '1920,1080'),
+            device=scan.configs.get('device', 'desktop')
+        )
+        driver.get(scan.page.page_url)
+        driver_data = get_data(
+            driver=driver,
+            browser=scan.configs.get('browser', 'chrome'),
+            max_wait_time=int(scan.configs['max_wait_time']),
+            min_wait_time=int(scan.configs['min_wait_time']),
+            interval=int(scan.configs['interval'])
+        )
+        record_readiness(scan_id, 'browser', getattr(driver, 'readiness', None))
+    except Exception as e:
+        print(e)
+
+    # persist html & logs
+    if 'html' in components:
+        try:
+            if driver_data is None:
+                raise Exception('page data unavailable')
+            if 'html' in scan.type or 'full' in scan.type:
+                scan = Scan.objects.get(id=scan_id)
+                save_html(driver_data['html'], scan)
+            if 'logs' in scan.type or 'full' in scan.type:
+                scan = Scan.objects.get(id=scan_id)
+                scan.logs = driver_data['logs']
+                scan.save(update_fields=['logs'])
+            messages.append('completed html and logs component')
+        except Exception as e:
+            print(e)
+            messages.append('html and logs component failed')
+
+    # run security before images so the performance 
+    # logs still reflect the initial page load
+    if 'security' in components:
+        try:
+            scan = Scan.objects.get(id=scan_id)
+            if driver_data is None:
+                raise Exception('page data unavailable')
+            sec_data = Security(scan=scan, driver=driver).get_data(page_data=driver_data)
+            print(f'SECURITY failure_status -> {sec_data.get("failed")}')
+            messages.append('completed security component')
+        except Exception as e:
+            scan.security['failed'] = True
+            scan.save(update_fields=['security'])
+            print(e)
+            messages.append('security component failed')
+
+    # capture images from the already loaded page
+    if 'images' in components:
+        try:
+            if driver_data is None:
+                raise Exception('page data unavailable')
+            scan = Scan.objects.get(id=scan_id)
+            images = Imager(scan=scan).scan_vrt(driver=driver, loaded=True)
+            scan = Scan.objects.get(id=scan_id)
+            scan.images = images
+            scan.save(update_fields=['images'])
+            messages.append('completed images component')
+        except Exception as e:
+            print(e)
+            messages.append('images component failed')
+
+    # release selenium session, discarding it if the page never loaded
+    try:
+        release_driver(driver, discard=(driver_data is None))
+    except:
+        pass
+
+    # update flowrun
+    if flowrun_id and flowrun_id != 'None':
+        update_flowrun(**{
+            'flowrun_id': flowrun_id,
+            'node_index': node_index,
+            'message': f'{", ".join(messages)} for {scan.page.page_url} | scan_id: {scan_id}',
+        })
+
+    # update scan score
+    scan = Scan.objects.get(id=scan_id)
+    update_scan_score(scan)
+
+    # checking if scan is done
+    scan = check_scan_completion(scan, components[0], test_id, alert_id, flowrun_id, node_index)
+
+    # returning updated scan
+    return scan
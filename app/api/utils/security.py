@@ -1,10 +1,12 @@
-from .driver import driver_init, get_data, quit_driver
+from .driver import get_data
+from .pool import lease_driver, release_driver
+from .storage import upload_json, put_json_artifact
 from cursion import settings
 from ..models import Scan
 from bs4 import BeautifulSoup
 from datetime import datetime, timezone
 from urllib.parse import urljoin, urlparse
-import boto3, json, os, uuid
+import json, uuid
 import tldextract
 
 
@@ -39,20 +41,12 @@ class Security():
         self._driver_provided = driver is not None
 
         # setup driver
-        self.driver = driver_init(
+        self.driver = lease_driver(
             browser=self.scan.configs.get('browser', 'chrome'),
             window_size=self.scan.configs['window_size'],
             device=self.scan.configs['device']
         ) if not driver else driver
 
-        # setup boto3 configurations
-        self.s3 = boto3.client(
-            's3', aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-            aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-            region_name=str(settings.AWS_S3_REGION_NAME),
-            endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
-        )
-
         # data shapes
         self.categories = ['transport', 'browser', 'scripts', 'forms', 'compliance']
         self.category_titles = {
@@ -100,24 +94,31 @@ class Security():
 
 
 
-    def extractor(self):
+    def extractor(self, page_data=None):
         """
         Using self.driver, extracts all required data
         to be used by the security auditors.
 
+        Args:
+            page_data : dict (optional 'html' & 'logs' already 
+                captured from self.driver's current page load)
+
         Returns:
             self.data
         """
 
         # using self.driver, extract html & logs
-        self.driver.get(self.page.page_url)
-        data = get_data(
-            driver=self.driver,
-            browser=self.scan.configs.get('browser', 'chrome'),
-            max_wait_time=int(self.scan.configs.get('max_wait_time', 30)),
-            min_wait_time=int(self.scan.configs.get('min_wait_time', 3)),
-            interval=int(self.scan.configs.get('interval', 1)),
-        )
+        # unless they were captured by the caller
+        data = page_data
+        if data is None:
+            self.driver.get(self.page.page_url)
+            data = get_data(
+                driver=self.driver,
+                browser=self.scan.configs.get('browser', 'chrome'),
+                max_wait_time=int(self.scan.configs.get('max_wait_time', 30)),
+                min_wait_time=int(self.scan.configs.get('min_wait_time', 3)),
+                interval=int(self.scan.configs.get('interval', 1)),
+            )
         html = data.get('html')
         logs = data.get('logs', [])
 
@@ -1204,26 +1205,13 @@ class Security():
         Upload full payload JSON to S3 and return public URL.
         """
 
-        file_id = uuid.uuid4()
-        local_path = os.path.join(settings.BASE_DIR, f'{file_id}.json')
-
-        with open(local_path, 'w') as fp:
-            json.dump(payload, fp)
+        # deduplicated by content
+        if settings.ARTIFACT_STORE_ENABLED:
+            return put_json_artifact(payload, previous=(self.scan.security or {}).get('audits'))
 
+        file_id = uuid.uuid4()
         remote_path = f'static/sites/{self.site.id}/{self.page.id}/{self.scan.id}/{file_id}.json'
-        root_path = settings.AWS_S3_URL_PATH
-        audits_url = f'{root_path}/{remote_path}'
-
-        with open(local_path, 'rb') as data:
-            self.s3.upload_fileobj(
-                data,
-                str(settings.AWS_STORAGE_BUCKET_NAME),
-                remote_path,
-                ExtraArgs={'ACL': 'public-read', 'ContentType': 'application/json'}
-            )
-
-        os.remove(local_path)
-        return audits_url
+        return upload_json(payload, remote_path)
 
 
 
@@ -1242,13 +1230,16 @@ class Security():
 
 
 
-    def get_data(self):
+    def get_data(self, page_data=None):
         """
         Main entrypoint to extract, evaluate, score, upload, persist.
+
+        Args:
+            page_data : dict (optional, see self.extractor())
         """
 
         try:
-            artifacts = self.extractor()
+            artifacts = self.extractor(page_data=page_data)
             audits = self.run_security_audits(artifacts)
             scores = self.score_security_audits(audits)
             audits_payload = self.build_audits_by_category(audits)
@@ -1278,7 +1269,7 @@ class Security():
         finally:
             if not self._driver_provided and self.driver is not None:
                 try:
-                    quit_driver(self.driver)
+                    release_driver(self.driver)
                 except Exception:
                     pass
 
@@ -0,0 +1,622 @@
+from cursion import settings
+from ..models import Artifact
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from datetime import timedelta
+from hashlib import sha256
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+import boto3, io, json, os, threading, gzip
+
+
+
+
+
+
+# process wide clients, re-created after fork
+_client = None
+_resource = None
+_pid = None
+_lock = threading.Lock()
+
+
+
+
+def _config() -> Config:
+    return Config(
+        max_pool_connections=settings.STORAGE_MAX_POOL_CONNECTIONS,
+        retries={'max_attempts': 5, 'mode': 'standard'},
+    )
+
+
+
+
+def _credentials() -> dict:
+    return {
+        'aws_access_key_id': str(settings.AWS_ACCESS_KEY_ID),
+        'aws_secret_access_key': str(settings.AWS_SECRET_ACCESS_KEY),
+        'region_name': str(settings.AWS_S3_REGION_NAME),
+        'endpoint_url': str(settings.AWS_S3_ENDPOINT_URL),
+    }
+
+
+
+
+def _check_pid() -> None:
+    # boto3 clients are not fork safe
+    global _client, _resource, _pid
+    if _pid != os.getpid():
+        _client = None
+        _resource = None
+        _pid = os.getpid()
+
+
+
+
+def get_client() -> object:
+    """
+    Returns the process wide, connection pooled
+    boto3 s3 client (thread safe).
+
+    Returns:
+        boto3 s3 client
+    """
+    global _client
+    with _lock:
+        _check_pid()
+        if _client is None:
+            _client = boto3.session.Session().client('s3', config=_config(), **_credentials())
+        return _client
+
+
+
+
+def get_resource() -> object:
+    """
+    Returns the process wide boto3 s3 resource
+    (for bucket level operations).
+
+    Returns:
+        boto3 s3 resource
+    """
+    global _resource
+    with _lock:
+        _check_pid()
+        if _resource is None:
+            _resource = boto3.session.Session().resource('s3', config=_config(), **_credentials())
+        return _resource
+
+
+
+
+def get_url(remote_path: str) -> str:
+    # public url of the object
+    return f'{settings.AWS_S3_URL_PATH}/{remote_path}'
+
+
+
+
+def upload_bytes(
+        data: object=None,
+        remote_path: str=None,
+        content_type: str='application/octet-stream',
+        public: bool=True,
+        extra: dict=None
+    ) -> str:
+    """
+    Uploads the in-memory data without touching disk, using
+    a single put_object or a streamed multipart upload past
+    STORAGE_MULTIPART_THRESHOLD.
+
+    Args:
+        'data'          : bytes, str or file-like object,
+        'remote_path'   : str,
+        'content_type'  : str,
+        'public'        : bool (public-read ACL),
+        'extra'         : dict (additional ExtraArgs)
+
+    Returns:
+        str (public url)
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    args = {'ContentType': content_type, **(extra or {})}
+    if public:
+        args['ACL'] = 'public-read'
+
+    # small buffers go in one request
+    if isinstance(data, (bytes, bytearray)) and len(data) < settings.STORAGE_MULTIPART_THRESHOLD:
+        get_client().put_object(
+            Bucket=str(settings.AWS_STORAGE_BUCKET_NAME),
+            Key=remote_path, Body=data, **args
+        )
+        return get_url(remote_path)
+
+    # larger data & file-like objects are streamed
+    if isinstance(data, (bytes, bytearray)):
+        data = io.BytesIO(data)
+    get_client().upload_fileobj(
+        data, str(settings.AWS_STORAGE_BUCKET_NAME), remote_path,
+        ExtraArgs=args,
+        Config=TransferConfig(multipart_threshold=settings.STORAGE_MULTIPART_THRESHOLD)
+    )
+    return get_url(remote_path)
+
+
+
+
+def upload_json(
+        obj: object=None, 
+        remote_path: str=None, 
+        public: bool=True, 
+        extra: dict=None
+    ) -> str:
+    """
+    Serializes & uploads the object as json.
+
+    Returns:
+        str (public url)
+    """
+    return upload_bytes(
+        json.dumps(obj).encode('utf-8'), remote_path,
+        content_type='application/json', public=public, extra=extra
+    )
+
+
+
+
+def upload_file(
+        path: str=None,
+        remote_path: str=None,
+        content_type: str='application/octet-stream',
+        public: bool=True
+    ) -> str:
+    """
+    Streams a file which is already on disk (e.g. a
+    browser screenshot) to s3.
+
+    Returns:
+        str (public url)
+    """
+    with open(path, 'rb') as data:
+        return upload_bytes(data, remote_path, content_type, public)
+
+
+
+
+def upload_many(uploads: list=None) -> list:
+    """
+    Runs several uploads concurrently on the pooled client.
+
+    Args:
+        'uploads' : list of dicts of `upload_bytes()` kwargs,
+            or of `upload_file()` kwargs when 'path' is passed
+
+    Returns:
+        list of str (public urls, in order)
+    """
+    uploads = uploads or []
+    if len(uploads) <= 1:
+        return [_upload(u) for u in uploads]
+    workers = min(len(uploads), settings.STORAGE_UPLOAD_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_upload, uploads))
+
+
+
+
+def _upload(kwargs: dict) -> str:
+    if 'path' in kwargs:
+        return upload_file(**kwargs)
+    return upload_bytes(**kwargs)
+
+
+
+
+def download_bytes(remote_path: str=None) -> bytes:
+    """
+    Downloads the object into memory.
+
+    Returns:
+        bytes
+    """
+    buffer = io.BytesIO()
+    get_client().download_fileobj(
+        str(settings.AWS_STORAGE_BUCKET_NAME), remote_path, buffer
+    )
+    return buffer.getvalue()
+
+
+
+
+def download_file(remote_path: str=None, local_path: str=None) -> str:
+    """
+    Downloads the object to local_path.
+
+    Returns:
+        str (local_path)
+    """
+    with open(local_path, 'wb') as data:
+        get_client().download_fileobj(
+            str(settings.AWS_STORAGE_BUCKET_NAME), remote_path, data
+        )
+    return local_path
+
+
+
+
+def list_prefix(prefix: str=None) -> iter:
+    """
+    Yields the key of every object under `prefix`,
+    listing with list_objects_v2 pages of 1000.
+
+    Args:
+        'prefix' : str (e.g. 'static/sites/{site_id}/')
+
+    Returns:
+        generator of str
+    """
+    paginator = get_client().get_paginator('list_objects_v2')
+    pages = paginator.paginate(
+        Bucket=str(settings.AWS_STORAGE_BUCKET_NAME), 
+        Prefix=prefix, PaginationConfig={'PageSize': 1000}
+    )
+    for page in pages:
+        for obj in page.get('Contents', []):
+            yield obj['Key']
+
+
+
+
+def delete_keys(keys: list=None) -> int:
+    """
+    Deletes up to 1000 keys with a single 
+    DeleteObjects request.
+
+    Args:
+        'keys' : list of str
+
+    Returns:
+        int (number of objects deleted)
+    """
+    if not keys:
+        return 0
+    resp = get_client().delete_objects(
+        Bucket=str(settings.AWS_STORAGE_BUCKET_NAME), 
+        Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+    )
+    for error in resp.get('Errors', []):
+        print(f'failed to delete {error.get("Key")} -> {error.get("Message")}')
+    return len(keys) - len(resp.get('Errors', []))
+
+
+
+
+def delete_prefix(prefix: str=None) -> int:
+    """
+    Deletes every object under `prefix` via 
+    `delete_prefixes()`.
+
+    Args:
+        'prefix' : str (e.g. 'static/sites/{site_id}/')
+
+    Returns:
+        int (number of objects deleted)
+    """
+    return delete_prefixes([prefix])
+
+
+
+
+def delete_prefixes(prefixes: list=None, children: dict=None) -> int:
+    """
+    Lists each prefix concurrently on the pooled client,
+    collecting the keys in one shared buffer which is 
+    flushed with a DeleteObjects request every 1000 keys
+    (so many small prefixes share requests). Failures are
+    logged & skipped so one bad prefix or batch does not
+    block the rest.
+
+    With `children` only the keys under the listed child 
+    "directories" of each prefix are deleted, so many rows
+    sharing a parent (e.g. the scans of a page) cost one
+    listing of the parent instead of one per row.
+
+    Args:
+        'prefixes' : list of str,
+        'children' : dict {<prefix>: set of str}, e.g.
+                     {'static/sites/{site}/{page}/': {<scan_id>, ...}}
+
+    Returns:
+        int (number of objects deleted)
+    """
+    prefixes = list(dict.fromkeys(p for p in (prefixes or []) if p))
+    prefixes += [p for p in (children or {}) if p and p not in prefixes]
+    if not prefixes:
+        return 0
+
+    buffer = []
+    lock = threading.Lock()
+    deleted = [0]
+
+    def _flush(keys: list) -> None:
+        try:
+            count = delete_keys(keys)
+        except Exception as e:
+            print(f'failed to delete {len(keys)} objects -> {e}')
+            return None
+        with lock:
+            deleted[0] += count
+        return None
+
+    def _list(prefix: str) -> None:
+        allowed = (children or {}).get(prefix)
+        try:
+            for key in list_prefix(prefix):
+                if allowed is not None and key[len(prefix):].split('/', 1)[0] not in allowed:
+                    continue
+                batch = None
+                with lock:
+                    buffer.append(key)
+                    if len(buffer) >= 1000:
+                        batch = buffer[:1000]
+                        del buffer[:1000]
+                if batch:
+                    _flush(batch)
+        except Exception as e:
+            print(f'failed to list prefix {prefix} -> {e}')
+        return None
+
+    workers = min(len(prefixes), settings.STORAGE_DELETE_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(_list, prefixes))
+
+    # remaining partial batch
+    _flush(buffer)
+    return deleted[0]
+
+
+
+
+def remote_path_from_url(url: str) -> str:
+    # 'https://.../static/sites/...' -> 'static/sites/...'
+    return f'static{url.split("static", 1)[1]}'
+
+
+
+
+def artifact_id_from_url(url: str=None) -> str:
+    # sha256 of an artifact url or None if not an artifact
+    if not url or '/static/artifacts/' not in str(url):
+        return None
+    return str(url).rsplit('/', 1)[-1].split('.')[0]
+
+
+
+
+def _replace_artifact(previous: str=None, url: str=None) -> str:
+    # the caller's old artifact loses its reference
+    # only once the new one is referenced
+    if previous:
+        release_artifacts([previous])
+    return url
+
+
+
+
+def put_artifact(
+        data: object=None,
+        ext: str='txt',
+        content_type: str='text/plain',
+        previous: str=None
+    ) -> str:
+    """
+    Stores the payload gzipped under its sha256 in 
+    'static/artifacts/{sha[:2]}/{sha}.{ext}', uploading it
+    only if no identical blob exists, and adds a reference
+    to its `Artifact` (unless `previous` is already this
+    artifact's url, e.g. on a retried task). A different
+    `previous` artifact is released.
+
+    Objects are served with 'Content-Encoding: gzip' so
+    browsers & requests decode them transparently.
+
+    Args:
+        'data'          : bytes or str,
+        'ext'           : str,
+        'content_type'  : str,
+        'previous'      : str (url currently held by the caller)
+
+    Returns:
+        str (public url)
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    sha = sha256(data).hexdigest()
+
+    # already referenced by the caller
+    if artifact_id_from_url(previous) == sha:
+        return previous
+
+    with transaction.atomic():
+        artifact = Artifact.objects.select_for_update().filter(id=sha).first()
+        if artifact is not None:
+            Artifact.objects.filter(id=sha).update(
+                refs=F('refs') + 1, time_updated=timezone.now()
+            )
+            return _replace_artifact(previous, get_url(artifact.path))
+
+        # new blob, compress (deterministically) & upload
+        path = f'static/artifacts/{sha[:2]}/{sha}.{ext}'
+        body = gzip.compress(data, compresslevel=6, mtime=0)
+        upload_bytes(
+            body, path, content_type=content_type, 
+            extra={
+                'ContentEncoding': 'gzip',
+                'CacheControl': 'public, max-age=31536000, immutable'
+            }
+        )
+        try:
+            with transaction.atomic():
+                Artifact.objects.create(
+                    id=sha, path=path, content_type=content_type,
+                    size=len(data), stored_size=len(body), refs=1
+                )
+        except IntegrityError:
+            # created concurrently with the same content
+            Artifact.objects.filter(id=sha).update(
+                refs=F('refs') + 1, time_updated=timezone.now()
+            )
+
+    return _replace_artifact(previous, get_url(path))
+
+
+
+
+def put_json_artifact(obj: object=None, previous: str=None) -> str:
+    """
+    Serializes & stores the object via `put_artifact()`.
+
+    Returns:
+        str (public url)
+    """
+    return put_artifact(
+        json.dumps(obj).encode('utf-8'), ext='json', 
+        content_type='application/json', previous=previous
+    )
+
+
+
+
+def retain_artifact(url: str=None) -> bool:
+    """
+    Adds a reference to an existing artifact so another
+    object can share it (e.g. a cached lighthouse audit).
+
+    Args:
+        'url' : str
+
+    Returns:
+        bool (False if `url` is not a stored artifact)
+    """
+    sha = artifact_id_from_url(url)
+    if sha is None:
+        return False
+    updated = Artifact.objects.filter(id=sha).update(
+        refs=F('refs') + 1, time_updated=timezone.now()
+    )
+    return updated > 0
+
+
+
+
+def release_artifacts(urls: list=None) -> None:
+    """
+    Removes one reference from each artifact in `urls`
+    (non-artifact urls are ignored). Unreferenced blobs
+    are deleted by `delete_orphaned_artifacts()`.
+
+    Args:
+        'urls' : list of str
+
+    Returns:
+        None
+    """
+    counts = Counter(i for i in (artifact_id_from_url(u) for u in (urls or [])) if i)
+
+    # one UPDATE per distinct count, in batches
+    groups = {}
+    for sha, count in counts.items():
+        groups.setdefault(count, []).append(sha)
+    for count, ids in groups.items():
+        for i in range(0, len(ids), 1000):
+            Artifact.objects.filter(id__in=ids[i:i+1000]).update(
+                refs=F('refs') - count, time_updated=timezone.now()
+            )
+    return None
+
+
+
+
+def scan_artifact_urls(scans: object=None) -> list:
+    """
+    Lists the artifact urls (html, lighthouse & security 
+    audits) referenced by the `Scan` queryset without
+    loading the rows.
+
+    Args:
+        'scans' : QuerySet of `Scan`
+
+    Returns:
+        list of str
+    """
+    urls = []
+    rows = scans.values_list('html', 'lighthouse__audits', 'security__audits')
+    for row in rows.iterator(chunk_size=2000):
+        urls += [url for url in row if isinstance(url, str)]
+    return urls
+
+
+
+
+def release_scan_artifacts(scans: object=None) -> None:
+    """
+    Collects the artifact urls of the `Scan` queryset &
+    releases them once the surrounding transaction commits.
+    Call right before deleting the scans (directly or 
+    through a cascade), as bulk deletes send no signals.
+
+    Args:
+        'scans' : QuerySet of `Scan`
+
+    Returns:
+        None
+    """
+    urls = [url for url in scan_artifact_urls(scans) if artifact_id_from_url(url)]
+    if urls:
+        transaction.on_commit(lambda: release_artifacts(urls))
+    return None
+
+
+
+
+def delete_orphaned_artifacts(grace: int=None, limit: int=1000) -> int:
+    """
+    Deletes unreferenced artifacts (refs <= 0) which have
+    not been touched for `grace` seconds. Each row is locked
+    while its object is deleted so a concurrent 
+    `put_artifact()` either re-references it first or 
+    re-uploads it after.
+
+    Args:
+        'grace' : int (defaults to ARTIFACT_ORPHAN_GRACE),
+        'limit' : int
+
+    Returns:
+        int (number deleted)
+    """
+    grace = settings.ARTIFACT_ORPHAN_GRACE if grace is None else grace
+    max_date = timezone.now() - timedelta(seconds=grace)
+    ids = list(
+        Artifact.objects.filter(refs__lte=0, time_updated__lte=max_date)
+        .values_list('id', flat=True)[:limit]
+    )
+    deleted = 0
+    for sha in ids:
+        with transaction.atomic():
+            artifact = (
+                Artifact.objects.select_for_update(skip_locked=True)
+                .filter(id=sha, refs__lte=0).first()
+            )
+            if artifact is None:
+                continue
+            get_client().delete_object(
+                Bucket=str(settings.AWS_STORAGE_BUCKET_NAME), Key=artifact.path
+            )
+            artifact.delete()
+            deleted += 1
+    return deleted
@@ -1,11 +1,17 @@
 from ..models import *
 from datetime import datetime
 from .imager import Imager
-from cursion import settings
 from difflib import SequenceMatcher
 from .issuer import Issuer
-import os, json, random, \
-string, re, requests, uuid, boto3
+from .cacher import get_cacher
+from .storage import upload_json
+from .differ import (
+    TokenStream, TreeBuilder, similarity, diff_html,
+    diff_trees, micro_delta, tokenize_html, 
+    stream_lines, feed_lines, dump_tree, load_tree
+)
+import json, random, \
+string, requests, uuid
 
 
 
@@ -39,101 +45,108 @@ class Tester():
         self.post_scan_logs = []
         self.delta_html_post = []
         self.delta_html_pre = []
+        self.pre_scan_tree = None
+        self.post_scan_tree = None
+        self.tree_delta = None
 
-        # setup boto3 configurations
-        self.s3 = boto3.client(
-            's3', aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-            aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-            region_name=str(settings.AWS_S3_REGION_NAME), 
-            endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
+        # html comparison mode ('tokens' or 'tree')
+        self.tree_mode = (
+            (getattr(self.test.post_scan, 'configs', None) or {}).get('html_diff_mode') == 'tree'
         )
 
+        # cache for artifacts derived from each scan
+        self.cacher = get_cacher()
+
+
+
+
+
+    def scan_html(self, scan: object) -> tuple:
+        # streams & tokenizes the scan's html from remote s3
+        # into a bounded memory `TokenStream` (see utils.differ)
+        # & builds its DOM tree in tree_mode, reusing cached
+        # artifacts when the scan was already tested
+
+        stream = None
+        tree = None
+
+        # checking cache
+        if self.cacher:
+            stream = self.cacher.get_stream(scan.id, 'html_tokens', scan.html, TokenStream.load)
+            if stream is not None and self.tree_mode:
+                data = self.cacher.get(scan.id, 'html_tree', scan.html)
+                if data is not None:
+                    tree = load_tree(data)
+        if stream is not None and (tree is not None or not self.tree_mode):
+            return stream, tree
+        if stream is not None:
+            stream.close()
+
+        # also building the DOM tree from the same stream
+        builder = TreeBuilder() if self.tree_mode else None
+        lines = stream_lines(scan.html)
+        if builder is not None:
+            lines = feed_lines(lines, builder)
+        stream = TokenStream(tokenize_html(lines))
+        if builder is not None:
+            tree = builder.close_tree()
+
+        # saving to cache
+        if self.cacher:
+            self.cacher.put_stream(scan.id, 'html_tokens', scan.html, stream.dump)
+            if tree is not None:
+                self.cacher.put(scan.id, 'html_tree', scan.html, dump_tree(tree))
+
+        return stream, tree
+
 
 
 
     def clean_html(self) -> None:
         # cleans both pre_ and post_ html
         # and prepares them for comparison
+        self.pre_scan_html, self.pre_scan_tree = self.scan_html(self.test.pre_scan)
+        self.post_scan_html, self.post_scan_tree = self.scan_html(self.test.post_scan)
+        return None
 
-        # retrieveing data from remote s3
-        pre_scan_html_raw = requests.get(self.test.pre_scan.html).text
-        post_scan_html_raw = requests.get(self.test.post_scan.html).text
-        pre_scan_html = pre_scan_html_raw.splitlines()
-        post_scan_html = post_scan_html_raw.splitlines()
-
-        # setting watch lists
-        white_list = ['csrfmiddlewaretoken', '<!DOCTYPE html>',]
-        tags = [
-            '<head', '<script', '<div', '<p', '<h1', '<wbr', '<ul', '<tr', '<u', '<title', '<iframe',  
-            '<section', '<source', '<style', '<q', '<option', '<nav', '<menu', '<mark', '<map', '<meta', '<keygen', '<link',
-            '<li', '<legend', '<label', '<input', '<img', '<i', '<hr', '<hgroup', '<h2', '<h3', '<h4', '<h5', '<h6', '<form', 
-            '<footer', '<figure', '<fieldset', '<embed', '<em', '<dt', '<dl', '<dialog', '<dfn', '<details', '<del', '<dd', 
-            '<datalist', '<data', '<colgroup', '<col', '<code', '<cite', '<caption', '<canvas', '<button', '<body', '<blockquote',
-            '<bdo', '<bdi', '<base', '<pre', '<b', '<br', '<audio', '<aside', '<article', '<area', '<address', '<abbr', '<a',
-            '<!DOCTYPE html>', '</head', '</script', '</div', '</p', '</h1', '</wbr', '</ul', '</tr', '</u', '</title', '</iframe',  
-            '</section', '</source', '</style', '</q', '</option', '</nav', '</menu', '</mark', '</map', '</meta', '</keygen', '</link',
-            '</li', '</legend', '</label', '</input', '</img', '</i', '</hr', '</hgroup', '</h2', '</h3', '</h4', '</h5', '</h6', '</form', 
-            '</footer', '</figure', '</fieldset', '</embed', '</em', '</dt', '</dl', '</dialog', '</dfn', '</details', '</del', '</dd', 
-            '</datalist', '</data', '</colgroup', '</col', '</code', '</cite', '</caption', '</canvas', '</button', '</body', '</blockquote',
-            '</bdo', '</bdi', '</base', '</pre', '</b', '</br', '</audio', '</aside', '</article', '</area', '</address', '</abbr', '</a',
-        ]
-
-        # clean pre_scan_html
-        for line in pre_scan_html:
-            for item in white_list:
-                if item in line:
-                    pre_scan_html.remove(line)
-        for line in pre_scan_html:
-            new_line = line.replace('\t', '').replace('\\', '').replace('"\"', '')
-            subStrings = re.split('>', new_line)
-            for sub in subStrings:
-                if sub not in tags:
-                    self.pre_scan_html.append((sub+'>'))
-        
-        # clean post_scan_html
-        for line in post_scan_html:
-            for item in white_list:
-                if item in line:
-                    post_scan_html.remove(line)
-        for line in post_scan_html:
-            new_line = line.replace('\t', '').replace('\\', '').replace('"\"', '')
-            subStrings = re.split('>', new_line)
-            for sub in subStrings:
-                if sub not in tags:
-                    self.post_scan_html.append((sub+'>'))
 
-        return None
 
 
+    def scan_logs(self, scan: object) -> list:
+        # returns the ordered fingerprint of each 
+        # of the scan's logs, reusing cached ones
 
-    
-    def clean_logs(self) -> None:
-        # cleans both pre_ and post_ logs
-        # and prepares them for comparison
-         
-        # setting defaults
-        pre_scan_logs_json = self.test.pre_scan.logs
-        post_scan_logs_json = self.test.post_scan.logs
-        order = ("level", "source", "message")
+        # checking cache
+        if self.cacher:
+            logs = self.cacher.get_json(scan.id, 'logs')
+            if logs is not None:
+                return logs
 
-        # cleaning pre_scan_logs
-        for log in pre_scan_logs_json:
+        # cleaning logs
+        logs = []
+        order = ("level", "source", "message")
+        for log in (scan.logs or []):
             new_log = {}
             for label in order:
                 for key in log:
                     if key == label:
                         new_log[label] = log.get(key)
-            self.pre_scan_logs.append(json.dumps(new_log))
+            logs.append(json.dumps(new_log))
+
+        # saving to cache
+        if self.cacher:
+            self.cacher.put_json(scan.id, 'logs', obj=logs)
+
+        return logs
 
-        # cleaning post_scan_logs
-        for log in post_scan_logs_json:
-            new_log = {}
-            for label in order:
-                for key in log:
-                    if key == label:
-                        new_log[label] = log.get(key)
-            self.post_scan_logs.append(json.dumps(new_log))
 
+
+    
+    def clean_logs(self) -> None:
+        # cleans both pre_ and post_ logs
+        # and prepares them for comparison
+        self.pre_scan_logs = self.scan_logs(self.test.pre_scan)
+        self.post_scan_logs = self.scan_logs(self.test.post_scan)
         return None
 
 
@@ -141,15 +154,15 @@ class Tester():
 
     def compare_html(self) -> float:
         # calculates the similarity of pre and post html
-        # using SequenceMatcher()
+        # using a histogram diff
 
         # clean html first
         self.clean_html()
         
         # calculate score
-        html_raw_score = SequenceMatcher(
-            None, self.pre_scan_html, self.post_scan_html
-        ).ratio()
+        html_raw_score = similarity(
+            self.pre_scan_html.hashes, self.post_scan_html.hashes
+        )
 
         # return score
         return html_raw_score if html_raw_score >= 0 else 0
@@ -181,41 +194,15 @@ class Tester():
         # also generates the micro differences 
         # using self.post_proc_html()
 
-        # calculate macro difference 
-        num_html_delta = len(self.pre_scan_html) - len(self.post_scan_html)
-        num_html_ratio = len(self.pre_scan_html) / len(self.post_scan_html)
-        if num_html_ratio > 1:
-            num_html_ratio = len(self.post_scan_html) / len(self.pre_scan_html)
-        
-        # building data for post_proc_html()
-        for line in self.post_scan_html:
-            if line not in self.pre_scan_html:
-                self.delta_html_post.append(line)
-        for line in self.pre_scan_html:
-            if line not in self.post_scan_html:
-                self.delta_html_pre.append(line)
-
-        # get pre_mciro_delta in html
-        pre_micro_delta = self.post_proc_html(
-            self.delta_html_pre, 
-            self.delta_html_post
-        )
+        # calculate deltas
+        data = diff_html(self.pre_scan_html, self.post_scan_html)
+        self.delta_html_post = data['delta_html_post']
+        self.delta_html_pre = data['delta_html_pre']
 
-        # get post_mciro_delta in html
-        post_micro_delta = self.post_proc_html(
-            self.delta_html_post, 
-            self.delta_html_pre
-        )
-            
-        # formatting data
-        data = {
-            "num_html_delta": num_html_delta,
-            "delta_html_post": self.delta_html_post,
-            "delta_html_pre": self.delta_html_pre,
-            "num_html_ratio": num_html_ratio if num_html_ratio >= 0 else 0,
-            "pre_micro_delta": pre_micro_delta,
-            "post_micro_delta": post_micro_delta,
-        }
+        # add structural delta in tree mode
+        if self.tree_mode:
+            self.tree_delta = diff_trees(self.pre_scan_tree, self.post_scan_tree)
+            data['tree'] = self.tree_delta
 
         # return updated data
         return data
@@ -226,31 +213,7 @@ class Tester():
     def post_proc_html(self, primary_list: list, secondary_list: list) -> dict:
         # generates a list of 8 char long chunks that are in 
         # the primary_list but not in the secondary_list
-
-        # setting defaults
-        delta_parsed = []
-        delta_parsed_diff = []
-        secondary_str = ''.join(str(i) for i in secondary_list)
-
-        # breaking html elements into small 8 chars chunks
-        for line in primary_list:
-            subStrings = re.findall('.{1,8}', line)
-            for sub in subStrings:
-                delta_parsed.append(sub)
-
-        # checking if small chunk is in other scan
-        for block in delta_parsed:
-            if block != None and block != '' and block not in secondary_str:
-                delta_parsed_diff.append(block)
-
-        # formatting data
-        data = {
-            "delta_parsed": delta_parsed,
-            "delta_parsed_diff": delta_parsed_diff,
-        }
-
-        # returning updated data
-        return data
+        return micro_delta(primary_list, secondary_list)
 
 
 
@@ -259,16 +222,12 @@ class Tester():
         # Calculates a score by comparing 
         # post_delta_parsed_diff & pre_delta_parsed_diff
 
-        # building pre_delta_parsed_diff
-        pre_delta_parsed_diff = []
-        for line in self.pre_scan_html:
-            subStrings = re.findall('.{1,8}', line)
-            for sub in subStrings:
-                pre_delta_parsed_diff.append(sub)
+        # pre_scan_html chunks counted while streaming
+        pre_chunks = self.pre_scan_html.chunks
         
         # calculate score
-        diff_length = len(pre_delta_parsed_diff) - len(post_delta_parsed_diff)
-        diff_score = diff_length / len(pre_delta_parsed_diff)
+        diff_length = pre_chunks - len(post_delta_parsed_diff)
+        diff_score = diff_length / pre_chunks
 
         # return score
         return diff_score if diff_score >= 0 else 0
@@ -398,6 +357,19 @@ class Tester():
             # calculate difference in averages
             average_delta = current_average - old_average 
 
+            # discount noise within the multi-run variance bands
+            bands = self.lighthouse_bands()
+            if bands:
+                seo_delta = self.band_delta(seo_delta, bands.get('seo'))
+                accessibility_delta = self.band_delta(accessibility_delta, bands.get('accessibility'))
+                performance_delta = self.band_delta(performance_delta, bands.get('performance'))
+                best_practices_delta = self.band_delta(best_practices_delta, bands.get('best_practices'))
+                deltas = [seo_delta, accessibility_delta, performance_delta, best_practices_delta]
+                if post_crux is not None:
+                    crux_delta = self.band_delta(crux_delta, bands.get('crux'))
+                    deltas.append(crux_delta)
+                average_delta = sum(deltas)/len(deltas)
+
         except:
             seo_delta = None
             accessibility_delta = None 
@@ -407,6 +379,7 @@ class Tester():
             crux_delta = None
             current_average = None
             average_delta = None
+            bands = None
 
         # formatting data
         data = {
@@ -422,12 +395,55 @@ class Tester():
             }
         }
 
+        # adding variance bands
+        if bands:
+            data['bands'] = bands
+
         # returning data
         return data
 
 
 
 
+    def lighthouse_bands(self) -> dict:
+        """ 
+        Builds the noise tolerance of each LH category 
+        from the p10-p90 spread recorded by multi-run 
+        scans (`lighthouse.stats`). The tolerance is half 
+        of the wider spread of the pre_ and post_ scans.
+
+        Returns:
+            dict {<category>: float} or None when neither 
+            scan has stats
+        """
+        pre_stats = self.test.pre_scan.lighthouse.get('stats') or {}
+        post_stats = self.test.post_scan.lighthouse.get('stats') or {}
+        if not pre_stats and not post_stats:
+            return None
+
+        bands = {}
+        for cat in set(pre_stats) | set(post_stats):
+            spreads = [
+                stats[cat]['p90'] - stats[cat]['p10']
+                for stats in (pre_stats, post_stats) if cat in stats
+            ]
+            bands[cat] = round(max(spreads)/2, 1)
+        return bands
+
+
+
+
+    def band_delta(self, delta: float=None, tolerance: float=None) -> float:
+        # zero within the band, otherwise the change beyond it
+        if not tolerance:
+            return delta
+        if abs(delta) <= tolerance:
+            return 0
+        return delta - tolerance if delta > 0 else delta + tolerance
+
+
+
+
     def delta_security(self) -> dict:
         # calculate the differences in Security
         # scores between pre_ and post_ scans
@@ -658,28 +674,10 @@ class Tester():
         # Saves passed data as an s3 object and 
         # returns the remote uri as a str
 
-        # save _data s3 json file
+        # upload _data from memory as an s3 json file
         file_id = uuid.uuid4()
-        with open(f'{file_id}.json', 'w') as fp:
-            json.dump(_data, fp)
-        
-        # upload to s3 and return url
-        data_file = os.path.join(settings.BASE_DIR, f'{file_id}.json')
         remote_path = f'static/sites/{self.test.site.id}/{self.test.page.id}/{self.test.id}/{file_id}.json'
-        root_path = settings.AWS_S3_URL_PATH
-        data_file_uri = f"{root_path}/{remote_path}"
-    
-        # upload to s3
-        with open(data_file, 'rb') as data:
-            self.s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME), 
-                remote_path, ExtraArgs={'ACL': 'public-read', 'ContentType': "application/json"}
-            )
-
-        # remove local copy
-        os.remove(data_file) 
-
-        # return uri
-        return data_file_uri
+        return upload_json(_data, remote_path)
 
 
 
@@ -737,6 +735,11 @@ class Tester():
                 micro_diff_score = self.html_micro_diff_score(
                     delta_html_data['post_micro_delta']['delta_parsed_diff']
                 )
+
+                # structural score replaces the chunk based score in tree mode,
+                # html_score stays the token similarity
+                if self.tree_mode:
+                    micro_diff_score = delta_html_data['tree']['similarity']
                 
                 # weights
                 html_score_w = 1
@@ -750,6 +753,8 @@ class Tester():
                     "pre_micro_delta": delta_html_data['pre_micro_delta'],
                     "post_micro_delta": delta_html_data['post_micro_delta'],
                 }
+                if self.tree_mode:
+                    html_delta_context['tree'] = delta_html_data['tree']
 
                 # save and get s3 object uri
                 html_delta_uri = self.save_data_to_s3(_data=html_delta_context)
@@ -759,6 +764,13 @@ class Tester():
                 micro_diff_w = 0
                 num_html_w = 0
                 micro_diff_w = 0
+
+            # release spooled html tokens & trees
+            for stream in (self.pre_scan_html, self.post_scan_html):
+                if isinstance(stream, TokenStream):
+                    stream.close()
+            self.pre_scan_tree = None
+            self.post_scan_tree = None
                 
                 
         
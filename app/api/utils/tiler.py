@@ -0,0 +1,460 @@
+from skimage.metrics import structural_similarity
+from cursion import settings
+from hashlib import blake2b
+import numpy, cv2
+
+
+
+
+
+
+# ORB matches closer than this are "similar" (0 - 100)
+ORB_DISTANCE = 20
+
+
+# boxes closer than this (px) are merged into one
+BOX_MERGE_GAP = 2
+
+
+
+
+def decode_image(source: object=None) -> numpy.ndarray:
+    """
+    Decodes the image once into a BGR array.
+
+    Args:
+        'source' : str (local path) or bytes
+
+    Returns:
+        numpy.ndarray (h, w, 3)
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(numpy.frombuffer(source, numpy.uint8), cv2.IMREAD_COLOR)
+    return cv2.imread(source, cv2.IMREAD_COLOR)
+
+
+
+
+def crop_to_match(pre: numpy.ndarray, post: numpy.ndarray) -> tuple:
+    """
+    Crops both arrays (as views) to their common
+    top-left height & width.
+
+    Returns:
+        tuple (pre, post)
+    """
+    h = min(pre.shape[0], post.shape[0])
+    w = min(pre.shape[1], post.shape[1])
+    return pre[:h, :w], post[:h, :w]
+
+
+
+
+def tile_ranges(height: int, tile_height: int=None) -> list:
+    """
+    Splits `height` into horizontal bands of `tile_height`,
+    folding a short remainder into the last band so every
+    band is tall enough for SSIM's window.
+
+    Returns:
+        list of (y0, y1)
+    """
+    tile_height = max(int(tile_height or settings.VRT_TILE_HEIGHT), 16)
+    ranges = []
+    y = 0
+    while y < height:
+        y1 = min(y + tile_height, height)
+        if height - y1 < tile_height // 4:
+            y1 = height
+        ranges.append((y, y1))
+        y = y1
+    return ranges
+
+
+
+
+def tile_hash(tile: numpy.ndarray) -> bytes:
+    # exact content hash of the tile's pixels
+    return blake2b(numpy.ascontiguousarray(tile).data, digest_size=16).digest()
+
+
+
+
+def dhash(image: numpy.ndarray, size: int=8) -> str:
+    """
+    Perceptual difference hash (size x size bits) of
+    the BGR or grayscale image.
+
+    Returns:
+        str (hex)
+    """
+    small = cv2.resize(image, (size + 1, size), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return numpy.packbits(bits).tobytes().hex()
+
+
+
+
+def hash_distance(a: str, b: str) -> int:
+    # hamming distance between two hex hashes
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+
+
+def image_hashes(image: numpy.ndarray, tile_height: int=None) -> dict:
+    """
+    Builds the perceptual hash of the whole image plus a
+    perceptual & exact hash for each band (see tile_ranges).
+
+    Args:
+        'image'       : numpy.ndarray (h, w, 3),
+        'tile_height' : int (defaults to VRT_TILE_HEIGHT)
+
+    Returns:
+        'width'       : int,
+        'height'      : int,
+        'tile_height' : int,
+        'dhash'       : str,
+        'bands'       : list of {'dhash', 'digest'}
+    """
+    tile_height = int(tile_height or settings.VRT_TILE_HEIGHT)
+    height, width = image.shape[0], image.shape[1]
+    bands = []
+    for y0, y1 in tile_ranges(height, tile_height):
+        tile = image[y0:y1]
+        bands.append({
+            'dhash': dhash(tile),
+            'digest': tile_hash(tile).hex(),
+        })
+    return {
+        'width': width,
+        'height': height,
+        'tile_height': tile_height,
+        'dhash': dhash(image),
+        'bands': bands,
+    }
+
+
+
+
+def hashes_match(pre: dict=None, post: dict=None, threshold: int=None) -> bool:
+    """
+    Decides if two images are the same from their stored
+    `image_hashes()`. Images match when every band is
+    pixel identical, or when `threshold` > 0 and the whole
+    image & every band are within `threshold` bits.
+
+    Args:
+        'pre'       : dict,
+        'post'      : dict,
+        'threshold' : int (defaults to VRT_HASH_THRESHOLD)
+
+    Returns:
+        bool
+    """
+    if not pre or not post:
+        return False
+    threshold = settings.VRT_HASH_THRESHOLD if threshold is None else threshold
+    for key in ('width', 'height', 'tile_height'):
+        if pre.get(key) != post.get(key):
+            return False
+    pre_bands, post_bands = pre.get('bands') or [], post.get('bands') or []
+    if not pre_bands or len(pre_bands) != len(post_bands):
+        return False
+
+    # pixel identical
+    if all(a['digest'] == b['digest'] for a, b in zip(pre_bands, post_bands)):
+        return True
+
+    # perceptually identical
+    if threshold <= 0:
+        return False
+    if hash_distance(pre['dhash'], post['dhash']) > threshold:
+        return False
+    return all(
+        hash_distance(a['dhash'], b['dhash']) <= threshold 
+        for a, b in zip(pre_bands, post_bands)
+    )
+
+
+
+
+def _ssim_tile(gray1: numpy.ndarray, gray2: numpy.ndarray, keep: numpy.ndarray=None) -> tuple:
+    # returns (mean ssim, ssim map or None) for the tile
+    # averaged over the `keep` (unmasked) pixels only
+    win = min(7, gray1.shape[0], gray1.shape[1])
+    win = win if win % 2 else win - 1
+    if win < 3:
+        same = numpy.array_equal(gray1, gray2)
+        return (1.0 if same else 0.0), None
+    score, full = structural_similarity(gray1, gray2, win_size=win, full=True)
+    if keep is not None:
+        score = full[keep].mean()
+    return float(score), full
+
+
+
+
+def _orb_tile(
+        orb: object, 
+        matcher: object, 
+        gray1: numpy.ndarray, 
+        gray2: numpy.ndarray,
+        keep: numpy.ndarray=None
+    ) -> float:
+    # ratio of similar ORB matches (0 - 100) for the tile
+    # with keypoints limited to the `keep` pixels
+    search = keep.astype('uint8') * 255 if keep is not None else None
+    kp_a, desc_a = orb.detectAndCompute(gray1, search)
+    kp_b, desc_b = orb.detectAndCompute(gray2, search)
+    if desc_a is None and desc_b is None:
+        return 100.0
+    if desc_a is None or desc_b is None:
+        return 0.0
+    matches = matcher.match(desc_a, desc_b)
+    if len(matches) == 0:
+        return 100.0
+    similar = [m for m in matches if m.distance < ORB_DISTANCE]
+    return (len(similar) / len(matches)) * 100
+
+
+
+
+def _tile_mask(masks: list, y0: int, y1: int, width: int) -> numpy.ndarray:
+    # boolean (y1-y0, width) array, True where a mask covers
+    # the tile, or None if no mask intersects it
+    mask = None
+    for x0, my0, x1, my1 in masks:
+        top, bottom = max(my0, y0), min(my1, y1)
+        left, right = max(x0, 0), min(x1, width)
+        if top >= bottom or left >= right:
+            continue
+        if mask is None:
+            mask = numpy.zeros((y1 - y0, width), dtype=bool)
+        mask[top - y0:bottom - y0, left:right] = True
+    return mask
+
+
+
+
+def _tile_boxes(full: numpy.ndarray, y0: int) -> list:
+    # bounding boxes of the tile's low ssim regions
+    diff = (numpy.clip(full, 0, 1) * 255).astype('uint8')
+    _, thresh = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = []
+    for contour in contours:
+        (x, y, w, h) = cv2.boundingRect(contour)
+        boxes.append([x, y + y0, x + w, y + y0 + h])
+    return boxes
+
+
+
+
+def region_boxes(regions: list, width: int=None, height: int=None) -> list:
+    """
+    Converts stored mask regions ({'x', 'y', 'width', 'height'}
+    in image px) into [x0, y0, x1, y1] boxes clipped to the image.
+
+    Returns:
+        list of [x0, y0, x1, y1]
+    """
+    boxes = []
+    for r in (regions or []):
+        try:
+            x0, y0 = int(r['x']), int(r['y'])
+            x1, y1 = x0 + int(r['width']), y0 + int(r['height'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        x0, y0 = max(x0, 0), max(y0, 0)
+        if width is not None:
+            x1 = min(x1, width)
+        if height is not None:
+            y1 = min(y1, height)
+        if x1 > x0 and y1 > y0:
+            boxes.append([x0, y0, x1, y1])
+    return boxes
+
+
+
+
+def merge_boxes(boxes: list, gap: int=BOX_MERGE_GAP) -> list:
+    """
+    Merges overlapping or touching boxes (e.g. a region
+    split across a tile seam) into one.
+
+    Args:
+        'boxes' : list of [x0, y0, x1, y1],
+        'gap'   : int
+
+    Returns:
+        list of [x0, y0, x1, y1]
+    """
+    boxes = sorted([list(b) for b in boxes], key=lambda b: b[1])
+    changed = True
+    while changed:
+        changed = False
+        merged = []
+        for box in boxes:
+            for other in merged:
+                # boxes are sorted by y0 so only look at
+                # ones which still reach this box
+                if other[3] + gap < box[1]:
+                    continue
+                if other[0] - gap <= box[2] and box[0] - gap <= other[2]:
+                    other[0] = min(other[0], box[0])
+                    other[1] = min(other[1], box[1])
+                    other[2] = max(other[2], box[2])
+                    other[3] = max(other[3], box[3])
+                    changed = True
+                    break
+            else:
+                merged.append(box)
+        boxes = sorted(merged, key=lambda b: b[1])
+    return boxes
+
+
+
+
+def draw_boxes(image: numpy.ndarray, boxes: list) -> numpy.ndarray:
+    """
+    Draws each box onto the image (in place).
+
+    Returns:
+        numpy.ndarray
+    """
+    for x0, y0, x1, y1 in boxes:
+        cv2.rectangle(image, (x0, y0), (x1, y1), (0, 255, 0), 2)
+    return image
+
+
+
+
+def compare_images(
+        pre: numpy.ndarray=None,
+        post: numpy.ndarray=None,
+        pre_gray: numpy.ndarray=None,
+        post_gray: numpy.ndarray=None,
+        tile_height: int=None,
+        masks: list=None
+    ) -> dict:
+    """
+    Compares two decoded, equally sized BGR images in
+    horizontal tiles so memory stays bounded by the tile
+    size. Tiles with identical hashes or fully covered by
+    `masks` are skipped. The rest get SSIM, pixel difference
+    & ORB scores over their unmasked pixels, aggregated 
+    weighted by unmasked area.
+
+    Args:
+        'pre'         : numpy.ndarray (h, w, 3),
+        'post'        : numpy.ndarray (h, w, 3),
+        'pre_gray'    : numpy.ndarray (h, w) (optional),
+        'post_gray'   : numpy.ndarray (h, w) (optional),
+        'tile_height' : int (defaults to VRT_TILE_HEIGHT),
+        'masks'       : list of [x0, y0, x1, y1] to ignore
+
+    Returns:
+        'ssim_score'  : float (0 - 1),
+        'pil_score'   : float (0 - 100),
+        'cv2_score'   : float (0 - 100),
+        'boxes'       : list of [x0, y0, x1, y1],
+        'regions'     : list of per tile scores,
+        'tiles'       : int,
+        'skipped'     : int
+    """
+    if pre.shape != post.shape:
+        raise Exception('images are not comparable')
+
+    height, width = pre.shape[0], pre.shape[1]
+    ranges = tile_ranges(height, tile_height)
+    masks = masks or []
+    orb = cv2.ORB_create()
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+
+    # running area weighted totals
+    total = 0
+    ssim_total = 0.0
+    pixel_total = 0.0
+    orb_total = 0.0
+    skipped = 0
+    boxes = []
+    regions = []
+
+    for y0, y1 in ranges:
+        tile1 = pre[y0:y1]
+        tile2 = post[y0:y1]
+        region = {
+            'y0': y0, 'y1': y1, 'masked': 0.0, 'skipped': False,
+            'ssim_score': 1.0, 'pil_score': 100.0, 'cv2_score': 100.0,
+        }
+        regions.append(region)
+
+        # ignored pixels
+        mask = _tile_mask(masks, y0, y1, width)
+        keep = None
+        area = (y1 - y0) * width
+        if mask is not None:
+            keep = ~mask
+            area = int(keep.sum())
+            region['masked'] = round(1 - (area / ((y1 - y0) * width)), 4)
+
+        # fully masked or identical tiles are not scored
+        if area == 0:
+            region['skipped'] = True
+            skipped += 1
+            continue
+        total += area
+        if tile_hash(tile1) == tile_hash(tile2):
+            ssim_total += area
+            pixel_total += area * 100
+            orb_total += area * 100
+            region['skipped'] = True
+            skipped += 1
+            continue
+
+        gray1 = pre_gray[y0:y1] if pre_gray is not None else cv2.cvtColor(tile1, cv2.COLOR_BGR2GRAY)
+        gray2 = post_gray[y0:y1] if post_gray is not None else cv2.cvtColor(tile2, cv2.COLOR_BGR2GRAY)
+
+        # blank out masked pixels so they never differ
+        if mask is not None:
+            gray2 = gray2.copy()
+            gray2[mask] = gray1[mask]
+
+        # structural similarity & changed regions
+        score, full = _ssim_tile(gray1, gray2, keep)
+        region['ssim_score'] = score
+        ssim_total += area * score
+        if full is not None and score < 1:
+            if mask is not None:
+                full[mask] = 1
+            boxes += _tile_boxes(full, y0)
+
+        # mean absolute pixel difference
+        diff = cv2.absdiff(tile1, tile2)
+        diff = diff[keep] if keep is not None else diff
+        diff = diff.mean() / 255 * 100
+        region['pil_score'] = 100 - diff
+        pixel_total += area * (100 - diff)
+
+        # feature matching
+        region['cv2_score'] = _orb_tile(orb, matcher, gray1, gray2, keep)
+        orb_total += area * region['cv2_score']
+
+    # nothing left to compare
+    if total == 0:
+        total = 1
+        ssim_total, pixel_total, orb_total = 1.0, 100.0, 100.0
+
+    return {
+        'ssim_score': ssim_total / total,
+        'pil_score': pixel_total / total,
+        'cv2_score': orb_total / total,
+        'boxes': merge_boxes(boxes),
+        'regions': regions,
+        'tiles': len(ranges),
+        'skipped': skipped,
+    }
@@ -0,0 +1,142 @@
+from ..models import Account
+from ..queue import get_account_limits, invalidate_account
+from django.db import connection
+import json
+
+
+
+
+
+
+def has_allowance(account_id: str=None, resource: str=None, amount: int=1) -> bool:
+    """
+    Cheap check (no db query when the plan is cached)
+    that `amount` more of `resource` fits within
+    `{resource}_allowed`. `increment_usage(..., limit=True)`
+    makes the authoritative check.
+
+    Args:
+        'account_id'    : str,
+        'resource'      : str, e.g. 'scans', 'tests'
+        'amount'        : int
+
+    Returns:
+        bool
+    """
+    plan = get_account_limits(str(account_id))
+    if plan is None:
+        return False
+    usage = plan['usage']
+    return (int(usage.get(resource, 0)) + amount) <= int(usage.get(f'{resource}_allowed', 0))
+
+
+
+
+def increment_usage(
+        account_id: str=None,
+        resource: str=None,
+        amount: int=1,
+        limit: bool=False
+    ) -> dict:
+    """
+    Atomically adds `amount` to `Account.usage.{resource}`
+    with a single `jsonb_set` UPDATE (no read-modify-write
+    of the row). With `limit`, the update only applies if
+    the result stays within `{resource}_allowed`.
+
+    Args:
+        'account_id'    : str,
+        'resource'      : str,
+        'amount'        : int,
+        'limit'         : bool
+
+    Returns:
+        dict {'value': int, 'allowed': int}, or None if
+        the limit was reached (or no account matched)
+    """
+    allowed = f'{resource}_allowed'
+    condition = ''
+    params = [[resource], resource, amount, str(account_id)]
+    if limit:
+        condition = 'AND COALESCE((usage->>%s)::int, 0) + %s <= COALESCE((usage->>%s)::int, 0)'
+        params += [resource, amount, allowed]
+    params += [resource, allowed]
+
+    sql = f'''
+        UPDATE {Account._meta.db_table}
+        SET usage = jsonb_set(
+            COALESCE(usage, '{{}}'::jsonb), %s,
+            to_jsonb(COALESCE((usage->>%s)::int, 0) + %s)
+        )
+        WHERE id = %s {condition}
+        RETURNING (usage->>%s)::int, COALESCE((usage->>%s)::int, 0)
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+
+    invalidate_account(str(account_id))
+    if row is None:
+        return None
+    return {'value': row[0], 'allowed': row[1]}
+
+
+
+
+def update_usage(account_id: str=None, deltas: dict=None) -> None:
+    """
+    Atomically applies several +/- deltas to
+    `Account.usage` in one UPDATE (floored at 0),
+    e.g. {'sites_allowed': -1, 'schedules_allowed': -1}.
+
+    Args:
+        'account_id'    : str,
+        'deltas'        : dict {<key>: int}
+
+    Returns: None
+    """
+    expression = "COALESCE(usage, '{}'::jsonb)"
+    params = []
+    for key, delta in (deltas or {}).items():
+        expression = (
+            f'jsonb_set({expression}, %s, '
+            f'to_jsonb(GREATEST(COALESCE((usage->>%s)::int, 0) + %s, 0)))'
+        )
+        params += [[key], key, int(delta)]
+    if not params:
+        return None
+
+    sql = f'UPDATE {Account._meta.db_table} SET usage = {expression} WHERE id = %s'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [str(account_id)])
+
+    invalidate_account(str(account_id))
+    return None
+
+
+
+
+def reset_usage(account_id: str=None, values: dict=None, meta: dict=None) -> None:
+    """
+    Atomically overwrites keys of `Account.usage` (and
+    optionally `Account.meta`) without touching the
+    rest of the row.
+
+    Args:
+        'account_id'    : str,
+        'values'        : dict, e.g. {'scans': 0, 'tests': 0}
+        'meta'          : dict, merged into `Account.meta`
+
+    Returns: None
+    """
+    sql = f'''
+        UPDATE {Account._meta.db_table}
+        SET usage = COALESCE(usage, '{{}}'::jsonb) || %s::jsonb,
+            meta = COALESCE(meta, '{{}}'::jsonb) || %s::jsonb
+        WHERE id = %s
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [json.dumps(values or {}), json.dumps(meta or {}), str(account_id)])
+
+    invalidate_account(str(account_id))
+    return None
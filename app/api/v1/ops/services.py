@@ -1,6 +1,10 @@
 from django.contrib.auth.models import User
 from django_celery_beat.models import CrontabSchedule, PeriodicTask
-from django.db.models import Q
+from django.db.models import Q, F, Value, CharField
+from django.db import transaction
+from django.db.models.functions import Cast
+from django.db.models.fields.json import KeyTextTransform
+from django.contrib.postgres.search import TrigramWordSimilarity
 from functools import reduce
 from django.http import HttpResponse
 from django.utils import timezone
@@ -15,12 +19,15 @@ from redis.exceptions import RedisError
 from cursion import settings
 from .serializers import *
 from ...tasks import *
+from ...queue import get_account_limits
+from ...utils.usage import update_usage
 from ...models import *
 from ...utils.reporter import Report as R
 from ...utils.devices import devices
 from ...utils.issuer import Issuer
+from ...utils.storage import upload_json, release_scan_artifacts
 from datetime import datetime, timedelta
-import json, boto3, os, requests, uuid, secrets, operator
+import json, requests, uuid, secrets, operator
 
 
 ON_DEMAND_QUEUE = getattr(settings, 'CELERY_QUEUE_ON_DEMAND', 'on_demand')
@@ -86,8 +93,7 @@ def decrement_resource(account: object, resource: str) -> None:
     """
 
     # remove 1 from account.usage[{resource}]
-    account.usage[f'{resource}'] -= 1
-    account.save()
+    update_usage(account.id, {f'{resource}': -1})
 
     # return None
     return None
@@ -191,8 +197,9 @@ def check_permissions_and_usage(
         'status':   : object
     """
 
-    # get account from member
-    account = member.account
+    # get account plan (cached) from member
+    account_id = str(member.account_id)
+    plan = get_account_limits(account_id) or {'type': None, 'usage': {}, 'admin': False}
 
     # set default 
     allowed = True
@@ -246,9 +253,9 @@ def check_permissions_and_usage(
 
         # retrieve obj
         if id_type not in ['scan', 'test']:
-            objs = eval(f'{obj_str}.objects.filter(id="{id}", account__id="{account.id}")')
+            objs = eval(f'{obj_str}.objects.filter(id="{id}", account__id="{account_id}")')
         if id_type in ['scan', 'test']:
-            objs = eval(f'{obj_str}.objects.filter(id="{id}", site__account__id="{account.id}")')
+            objs = eval(f'{obj_str}.objects.filter(id="{id}", site__account__id="{account_id}")')
         
         # return False if not found
         if len(objs) == 0:
@@ -319,10 +326,10 @@ def check_permissions_and_usage(
 
 
     # handle special cases for site and page
-    if (resource == 'site' or resource == 'page') and account.user.username != 'admin':
+    if (resource == 'site' or resource == 'page') and not plan['admin']:
         # check existance
         if url:
-            if eval(f'{resource.capitalize()}.objects.filter(account__id="{account.id}", {resource}_url="{url}").exists()'):
+            if eval(f'{resource.capitalize()}.objects.filter(account__id="{account_id}", {resource}_url="{url}").exists()'):
                 return {
                     'allowed': False,
                     'error': f'{resource} exists',
@@ -332,7 +339,7 @@ def check_permissions_and_usage(
 
         # check usage for page only
         if resource == 'page' and id_type == 'site' and action == 'add':
-            if account.usage['pages_allowed'] == Page.objects.filter(site__id=id).count():
+            if plan['usage']['pages_allowed'] == Page.objects.filter(site__id=id).count():
                 return {
                     'allowed': False,
                     'error': f'max pages reached',
@@ -342,27 +349,25 @@ def check_permissions_and_usage(
             
 
     # check for cloud / enterprise plan
-    if (account.type == 'enterprise') and resource == 'site' and account.user.username != 'admin' :
+    if (plan['type'] == 'enterprise') and resource == 'site' and not plan['admin']:
         
         # add to sites_allowed only for enterprise and cloud plans
-        if action == 'add' and account.usage['sites_allowed'] == Site.objects.filter(account=account).count():
-            account.usage['sites_allowed'] += 1
-            account.usage['schedules_allowed'] += 1
-            account.save()
+        if action == 'add' and plan['usage']['sites_allowed'] == Site.objects.filter(account__id=account_id).count():
+            update_usage(account_id, {'sites_allowed': 1, 'schedules_allowed': 1})
             
             # update price for sub if enterprise
-            if account.type == 'enterprise':
-                update_sub_price.apply_async(kwargs={'account_id': str(account.id)}, queue=ON_DEMAND_QUEUE, routing_key=ON_DEMAND_QUEUE)
+            if plan['type'] == 'enterprise':
+                update_sub_price.apply_async(kwargs={'account_id': account_id}, queue=ON_DEMAND_QUEUE, routing_key=ON_DEMAND_QUEUE)
 
 
     # check usage if action is 'add'
-    if action == 'add' and resource in usage_list and account.user.username != 'admin':
+    if action == 'add' and resource in usage_list and not plan['admin']:
 
         # check if usage allows for 'add'
-        if (int(account.usage[f'{resource}s']) >= int(account.usage[f'{resource}s_allowed'])):
+        if (int(plan['usage'][f'{resource}s']) >= int(plan['usage'][f'{resource}s_allowed'])):
             
             # return UPGRADE_REQUIRED if not cloud
-            if account.type != 'cloud':
+            if plan['type'] != 'cloud':
                 return {
                     'allowed': False,
                     'error': f'max {resource}s reached',
@@ -491,8 +496,7 @@ def create_or_update_site(request: object=None) -> object:
     )
     
     # updated accounts usage
-    account.usage['sites'] += 1
-    account.save()
+    update_usage(account.id, {'sites': 1})
 
     # create process obj
     process = Process.objects.create(
@@ -792,17 +796,17 @@ def delete_site(request: object=None, id: str=None, user: object=None) -> object
     for page in Page.objects.filter(site=site):
         Issue.objects.filter(affected__icontains=str(page.id)).delete()
     
-    # remove site
-    site.delete()
+    # remove site (releasing its scans' artifacts)
+    with transaction.atomic():
+        release_scan_artifacts(Scan.objects.filter(site=site))
+        site.delete()
 
     # decrememt resouce in account
     decrement_resource(account=account, resource='sites')
 
     # update account if enterprise or cloud
     if account.type == 'enterprise' or account.type == 'cloud':
-        account.usage['sites_allowed'] -= 1
-        account.usage['schedules_allowed'] -= 1
-        account.save()
+        update_usage(account.id, {'sites_allowed': -1, 'schedules_allowed': -1})
 
         # update billing for enterprise
         if account.type == 'enterprise':
@@ -1379,8 +1383,10 @@ def delete_page(request: object=None, id: str=None, user: object=None) -> object
     # remove any associated Issues
     Issue.objects.filter(affected__icontains=str(id)).delete()
 
-    # remove page
-    page.delete()
+    # remove page (releasing its scans' artifacts)
+    with transaction.atomic():
+        release_scan_artifacts(Scan.objects.filter(page=page))
+        page.delete()
 
     # format and return
     data = {'message': 'Page deleted'}
@@ -2027,7 +2033,9 @@ def delete_scan(request: object=None, id: str=None, user: object=None) -> object
 
     # delete scan
     page_id = str(scan.page.id)
-    scan.delete()
+    with transaction.atomic():
+        release_scan_artifacts(Scan.objects.filter(id=scan.id))
+        scan.delete()
 
     # update page and site
     update_site_and_page_info.apply_async(
@@ -3976,8 +3984,7 @@ def create_or_update_schedule(request: object=None, **kwargs) -> object:
             )
 
             # updated accounts usage
-            account.usage['schedules'] += 1
-            account.save()
+            update_usage(account.id, {'schedules': 1})
 
     # deciding on response type
     if request:
@@ -5130,37 +5137,10 @@ def save_case_steps(steps: dict, case_id: str) -> dict:
         'url'       : str
     """
 
-    # setup boto3 configurations
-    s3 = boto3.client(
-        's3', aws_access_key_id=str(settings.AWS_ACCESS_KEY_ID),
-        aws_secret_access_key=str(settings.AWS_SECRET_ACCESS_KEY),
-        region_name=str(settings.AWS_S3_REGION_NAME), 
-        endpoint_url=str(settings.AWS_S3_ENDPOINT_URL)
-    )
-
-    # saving as json file temporarily
+    # upload from memory to s3
     steps_id = uuid.uuid4()
-    with open(f'{steps_id}.json', 'w') as fp:
-        json.dump(steps, fp)
-    
-    # seting up paths
-    steps_file = os.path.join(settings.BASE_DIR, f'{steps_id}.json')
     remote_path = f'static/cases/{case_id}/{steps_id}.json'
-    root_path = settings.AWS_S3_URL_PATH
-    steps_url = f'{root_path}/{remote_path}'
-
-    # upload to s3
-    with open(steps_file, 'rb') as data:
-        s3.upload_fileobj(data, str(settings.AWS_STORAGE_BUCKET_NAME), 
-            remote_path, ExtraArgs={
-                'ACL': 'public-read', 
-                'ContentType': 'application/json',
-                'CacheControl': 'max-age=0'
-            }
-        )
-
-    # remove local copy
-    os.remove(steps_file)
+    steps_url = upload_json(steps, remote_path, extra={'CacheControl': 'max-age=0'})
 
     # format data
     data = {
@@ -7605,9 +7585,10 @@ def get_log(request: object=None, id: str=None) -> object:
 
 def search_resources(request: object=None) -> object:
     """
-    This method will search for any `Page` or `Site`
-    that is associated with the user's `Account` and
-    matches the query string.
+    This method will search for any `Site`, `Page`, `Case`,
+    `Issue` or `Flow` that is associated with the user's 
+    `Account` and matches the query string, ranked by 
+    trigram similarity in a single query.
 
     Expects:
         'query': <str> the query string
@@ -7633,11 +7614,6 @@ def search_resources(request: object=None) -> object:
     resources = member.permissions.get('resources', [])
     allowed_ids = [item['id'] for item in member.permissions.get('sites')]
     data = []
-    cases = []
-    pages = []
-    sites = []
-    issues = []
-    flows = []
 
     # check action permissons
     if 'get' not in actions:
@@ -7649,111 +7625,58 @@ def search_resources(request: object=None) -> object:
     resource_type = query.replace('https://', '').replace('http://', '').split(':')[0]
     query = query.replace('https://', '').replace('http://', '').split(':')[-1]
 
-    # search for sites
-    if (resource_type == 'site' or resource_type == query) and 'site' in resources:
-        sites = Site.objects.filter(account=account).filter(
-            site_url__icontains=query
-        )
-        # filter out all non permisioned
-        if len(allowed_ids) > 0:
-            sites = sites.filter(id__in=allowed_ids)
-
-    # search for pages
-    if (resource_type == 'page' or resource_type == query) and 'page' in resources:
-        pages = Page.objects.filter(account=account).filter(
-            page_url__icontains=query
-        )
-        # filter out all non permisioned
-        if len(allowed_ids) > 0:
-            pages = pages.filter(site__id__in=allowed_ids)
-
-    # search for cases
-    if (resource_type == 'case' or resource_type == query) and 'case' in resources:
-        cases = Case.objects.filter(account=account).filter(
-            title__icontains=query
-        )
-        # filter out all non permisioned
-        if len(allowed_ids) > 0:
-            cases = cases.filter(site__id__in=allowed_ids)
-
-    # search for issues
-    if (resource_type == 'issue' or resource_type == query) and 'issue' in resources:
-        issues = Issue.objects.filter(account=account).filter(
-            title__icontains=query
-        )
-        # filter out all non permisioned
-        if len(allowed_ids) > 0:
-            new_ids = allowed_ids
-            for id in allowed_ids:
-                for page in Page.objects.filter(site__id=id):
-                    new_ids.append(str(page.id))
-            issues = issues.filter(affected__id__in=new_ids)
-
-    # search for flows
-    if (resource_type == 'flow' or resource_type == query) and 'flow' in resources:
-        flows = Flow.objects.filter(account=account).filter(
-            title__icontains=query
+    # per type querysets (permission scoping stays in SQL)
+    parts = []
+    def _add_part(kind: str=None, queryset: object=None, field: str=None) -> None:
+        if not (resource_type == kind or resource_type == query) or kind not in resources:
+            return None
+        limit = 11 if resource_type == kind else (3 if kind == 'flow' else 4)
+        parts.append(
+            queryset.filter(**{f'{field}__icontains': query})
+            .annotate(
+                label=F(field), 
+                kind=Value(kind, output_field=CharField()),
+                rank=TrigramWordSimilarity(query, field)
+            )
+            .values('id', 'label', 'kind', 'rank')
+            .order_by('-rank')[:limit]
         )
 
-    # adding first several sites if present
-    i = 0
-    sites_allowed = 10 if resource_type == 'site' else 3
-    while i <= sites_allowed and i <= (len(sites)-1):
-        data.append({
-            'str': str(sites[i].site_url),
-            'path': f'/site/{sites[i].id}',
-            'id'  : str(sites[i].id),
-            'type': 'site',
-        })
-        i+=1
-    
-    # adding first several pages if present
-    i = 0
-    max_pages = 10 if resource_type == 'page' else 3
-    while i <= max_pages and i <= (len(pages)-1):
-        data.append({
-            'str': str(pages[i].page_url),
-            'path': f'/page/{pages[i].id}',
-            'id'  : str(pages[i].id),
-            'type': 'page',
-        })
-        i+=1
-    
-    # adding first several cases if present
-    i = 0
-    max_cases = 10 if resource_type == 'case' else 3
-    while i <= max_cases and i <= (len(cases)-1):
-        data.append({
-            'str': str(cases[i].title),
-            'path': f'/case/{cases[i].id}',
-            'id'  : str(cases[i].id),
-            'type': 'case',
-        })
-        i+=1
-    
-    # adding first several issues if present
-    i = 0
-    max_issues = 10 if resource_type == 'issue' else 3
-    while i <= max_issues and i <= (len(issues)-1):
-        data.append({
-            'str': str(issues[i].title),
-            'path': f'/issue/{issues[i].id}',
-            'id'  : str(issues[i].id),
-            'type': 'issue',
-        })
-        i+=1
-
-    # adding first several flows if present
-    i = 0
-    max_flows = 10 if resource_type == 'flows' else 2
-    while i <= max_flows and i <= (len(flows)-1):
+    # scope each type to the account & allowed sites
+    sites = Site.objects.filter(account=account)
+    pages = Page.objects.filter(account=account)
+    cases = Case.objects.filter(account=account)
+    issues = Issue.objects.filter(account=account)
+    flows = Flow.objects.filter(account=account)
+    if len(allowed_ids) > 0:
+        sites = sites.filter(id__in=allowed_ids)
+        pages = pages.filter(site__id__in=allowed_ids)
+        cases = cases.filter(site__id__in=allowed_ids)
+        page_ids = Page.objects.filter(site__id__in=allowed_ids).annotate(
+            str_id=Cast('id', output_field=CharField())
+        ).values('str_id')
+        issues = issues.alias(
+            affected_id=KeyTextTransform('id', 'affected')
+        ).filter(Q(affected_id__in=allowed_ids) | Q(affected_id__in=page_ids))
+
+    _add_part('site', sites, 'site_url')
+    _add_part('page', pages, 'page_url')
+    _add_part('case', cases, 'title')
+    _add_part('issue', issues, 'title')
+    _add_part('flow', flows, 'title')
+
+    # run one ranked query across all types
+    results = []
+    if len(parts) > 0:
+        results = parts[0].union(*parts[1:], all=True).order_by('-rank') if len(parts) > 1 else parts[0]
+
+    for result in results:
         data.append({
-            'str': str(flows[i].title),
-            'path': f'/flow/{flows[i].id}',
-            'id'  : str(flows[i].id),
-            'type': 'flow',
+            'str': str(result['label']),
+            'path': f'/{result["kind"]}/{result["id"]}',
+            'id'  : str(result['id']),
+            'type': result['kind'],
         })
-        i+=1
     
     # return response
     response = Response(data, status=status.HTTP_200_OK)
@@ -1,8 +1,11 @@
 from __future__ import absolute_import, unicode_literals
 from celery import Celery
-from celery.signals import worker_shutdown
+from celery.signals import (
+    worker_shutdown, worker_process_init, 
+    worker_process_shutdown
+)
 from django.conf import settings
-import cursion, os, time
+import cursion, os, time, threading
 
 
 
@@ -42,6 +45,27 @@ def debug_task(self):
 def on_worker_shutdown(**kwargs):
     print(f'- WORKER SHUTTING DOWN - \n{kwargs}')
 
+# pre-launch a pooled driver for each worker process
+@worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    if settings.DRIVER_POOL_ENABLED and settings.DRIVER_POOL_WARM:
+        from api.utils.pool import get_pool
+        threading.Thread(
+            target=get_pool().warm,
+            kwargs={
+                'browser': settings.CONFIGS['browser'],
+                'window_size': settings.CONFIGS['window_size'],
+                'device': settings.CONFIGS['device'],
+            },
+            daemon=True
+        ).start()
+
+# quit pooled drivers before the worker process exits
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(**kwargs):
+    from api.utils.pool import close_pool
+    close_pool()
+
     
 
 
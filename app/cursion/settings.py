@@ -294,6 +294,7 @@ CONFIGS = {
     'end_on_fail': True,
     'ai_analysis': False,
     'api_priority': False,
+    'html_diff_mode': 'tokens',
 }
 
 
@@ -307,3 +308,124 @@ TYPES = ['html', 'logs', 'images', 'lighthouse', 'security']
 
 # Global max attempts
 MAX_ATTEMPTS = 3
+
+
+# Run html, logs, images, & security scan components 
+# in one shared browser session (one driver per Scan)
+SCAN_SINGLE_BROWSER = False if os.environ.get('SCAN_SINGLE_BROWSER') == 'False' else True
+
+
+# Per-process pool of warm selenium drivers
+DRIVER_POOL_ENABLED = False if os.environ.get('DRIVER_POOL_ENABLED') == 'False' else True
+DRIVER_POOL_WARM = True if os.environ.get('DRIVER_POOL_WARM') == 'True' else False
+DRIVER_POOL_MAX_USES = int(os.environ.get('DRIVER_POOL_MAX_USES', 20))
+DRIVER_POOL_MAX_IDLE = int(os.environ.get('DRIVER_POOL_MAX_IDLE', 1))
+DRIVER_POOL_MAX_IDLE_TIME = int(os.environ.get('DRIVER_POOL_MAX_IDLE_TIME', 300))
+DRIVER_POOL_MAX_RSS_MB = int(os.environ.get('DRIVER_POOL_MAX_RSS_MB', 1024))
+
+
+# Page readiness detection (see api.utils.driver.driver_wait)
+READINESS_QUIET_MS = int(os.environ.get('READINESS_QUIET_MS', 500))
+READINESS_POLL_MS = int(os.environ.get('READINESS_POLL_MS', 250))
+READINESS_DOM_SETTLE_TIME = int(os.environ.get('READINESS_DOM_SETTLE_TIME', 3))
+
+
+# Cache for artifacts derived from scans (see api.utils.cacher)
+# backend is one of 'disk', 'redis' or 'none'
+ARTIFACT_CACHE_BACKEND = os.environ.get('ARTIFACT_CACHE_BACKEND', 'disk')
+ARTIFACT_CACHE_DIR = os.environ.get('ARTIFACT_CACHE_DIR', os.path.join(BASE_DIR, 'temp/cache'))
+ARTIFACT_CACHE_MAX_MB = int(os.environ.get('ARTIFACT_CACHE_MAX_MB', 1024))
+ARTIFACT_CACHE_TTL = int(os.environ.get('ARTIFACT_CACHE_TTL', 86400))
+ARTIFACT_CACHE_EVICT_EVERY = int(os.environ.get('ARTIFACT_CACHE_EVICT_EVERY', 100))
+ARTIFACT_CACHE_EVICT_INTERVAL = int(os.environ.get('ARTIFACT_CACHE_EVICT_INTERVAL', 300))
+# never falls back to the broker, point this at a dedicated
+# instance (with an allkeys-lru maxmemory policy) in production
+ARTIFACT_CACHE_REDIS_URL = os.environ.get('ARTIFACT_CACHE_REDIS_URL', 'redis://redis:6379/1')
+
+
+# Height (px) of each band compared by the tiled VRT engine
+VRT_TILE_HEIGHT = int(os.environ.get('VRT_TILE_HEIGHT', 1024))
+
+
+# Max perceptual hash distance (bits) for test_vrt to treat
+# screenshots as identical; 0 only skips pixel identical ones
+VRT_HASH_THRESHOLD = int(os.environ.get('VRT_HASH_THRESHOLD', 0))
+
+
+# Shared S3 client & uploads (see api.utils.storage)
+STORAGE_MAX_POOL_CONNECTIONS = int(os.environ.get('STORAGE_MAX_POOL_CONNECTIONS', 32))
+STORAGE_MULTIPART_THRESHOLD = int(os.environ.get('STORAGE_MULTIPART_THRESHOLD', 8 * 1024 * 1024))
+STORAGE_UPLOAD_WORKERS = int(os.environ.get('STORAGE_UPLOAD_WORKERS', 8))
+STORAGE_DELETE_WORKERS = int(os.environ.get('STORAGE_DELETE_WORKERS', 8))
+
+
+# Content-addressed, gzipped storage of scan html & audits
+# (see api.utils.storage.put_artifact); unreferenced blobs are
+# deleted after ARTIFACT_ORPHAN_GRACE seconds
+ARTIFACT_STORE_ENABLED = False if os.environ.get('ARTIFACT_STORE_ENABLED') == 'False' else True
+ARTIFACT_ORPHAN_GRACE = int(os.environ.get('ARTIFACT_ORPHAN_GRACE', 3600))
+
+
+# Data retention (see api.utils.retention); rows are deleted
+# RETENTION_CHUNK_SIZE at a time, at most RETENTION_ROWS_PER_SEC
+# (0 = unlimited). Tables listed in RETENTION_PARTITIONED_TABLES
+# (comma separated, e.g. 'api_log') are range partitioned on
+# time_created and have expired partitions dropped
+RETENTION_CHUNK_SIZE = int(os.environ.get('RETENTION_CHUNK_SIZE', 1000))
+RETENTION_ROWS_PER_SEC = int(os.environ.get('RETENTION_ROWS_PER_SEC', 5000))
+RETENTION_CHECKPOINT_TTL = int(os.environ.get('RETENTION_CHECKPOINT_TTL', 172800))
+RETENTION_PARTITIONED_TABLES = [
+    t.strip() for t in os.environ.get('RETENTION_PARTITIONED_TABLES', '').split(',') if t.strip()
+]
+
+
+# Long-lived Lighthouse runner (api/utils/node/lighthouse-runner.mjs)
+# started alongside celery workers; scans fall back to the CLI
+# when its socket is missing
+LIGHTHOUSE_RUNNER_ENABLED = False if os.environ.get('LIGHTHOUSE_RUNNER_ENABLED') == 'False' else True
+LIGHTHOUSE_RUNNER_SOCKET = os.environ.get('LIGHTHOUSE_RUNNER_SOCKET', '/tmp/lighthouse-runner.sock')
+LIGHTHOUSE_RUNNER_TIMEOUT = int(os.environ.get('LIGHTHOUSE_RUNNER_TIMEOUT', 300))
+
+
+# Lighthouse result cache, keyed by page url, device & throttling
+# config and a content fingerprint; opt-in per scan with
+# configs.lighthouse_cache (defaults to LIGHTHOUSE_CACHE_DEFAULT)
+LIGHTHOUSE_CACHE_DEFAULT = True if os.environ.get('LIGHTHOUSE_CACHE_DEFAULT') == 'True' else False
+LIGHTHOUSE_CACHE_TTL = int(os.environ.get('LIGHTHOUSE_CACHE_TTL', 21600))
+LIGHTHOUSE_CACHE_MAX_RESOURCES = int(os.environ.get('LIGHTHOUSE_CACHE_MAX_RESOURCES', 8))
+
+
+# Lighthouse runs aggregated per scan (configs.lighthouse_runs);
+# with more than one, scores are the per category medians and
+# p10/p90 are stored in scan.lighthouse.stats
+LIGHTHOUSE_RUNS = int(os.environ.get('LIGHTHOUSE_RUNS', 1))
+LIGHTHOUSE_MAX_RUNS = int(os.environ.get('LIGHTHOUSE_MAX_RUNS', 5))
+
+
+# Leases held by queued & running scan and test tasks (api.models.TaskLease);
+# leases are created when tasks are queued (allowing TASK_LEASE_QUEUE_TTL
+# in the queue), workers renew them every TASK_LEASE_HEARTBEAT seconds and
+# redeliver_failed_tasks only looks at leases that have expired
+TASK_LEASE_TTL = int(os.environ.get('TASK_LEASE_TTL', 300))
+TASK_LEASE_QUEUE_TTL = int(os.environ.get('TASK_LEASE_QUEUE_TTL', 1800))
+TASK_LEASE_HEARTBEAT = int(os.environ.get('TASK_LEASE_HEARTBEAT', 60))
+TASK_LEASE_SWEEP_LIMIT = int(os.environ.get('TASK_LEASE_SWEEP_LIMIT', 500))
+
+
+# Fair share dispatch (api.queue): tasks over their account's
+# concurrency are parked in per account ready lists and released
+# in weighted round-robin order as slots free up
+FAIR_SHARE_DISPATCH_BATCH = int(os.environ.get('FAIR_SHARE_DISPATCH_BATCH', 50))
+FAIR_SHARE_RESERVE_TTL = int(os.environ.get('FAIR_SHARE_RESERVE_TTL', 900))
+
+
+# Cached account plans (type & usage) and resource -> account
+# lookups used by the queue layer & usage checks (api.queue);
+# plans are also dropped whenever the Account is saved
+ACCOUNT_CACHE_TTL = int(os.environ.get('ACCOUNT_CACHE_TTL', 300))
+ACCOUNT_LOOKUP_TTL = int(os.environ.get('ACCOUNT_LOOKUP_TTL', 3600))
+
+
+# Batch Stripe meter events (api.utils.meter) per account,
+# sent every minute by the flush_meter_events task
+METER_BATCH_ENABLED = False if os.environ.get('METER_BATCH_ENABLED') == 'False' else True
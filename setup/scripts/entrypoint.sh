@@ -44,6 +44,9 @@ if [[ $1 == *"celery"* ]]
     if [[ -n "$CONCURRENCY" ]]; then
       EXTRA_ARGS="--concurrency=$CONCURRENCY"
     fi
+    if [[ "$LIGHTHOUSE_RUNNER_ENABLED" != "False" ]]; then
+      node api/utils/node/lighthouse-runner.mjs &
+    fi
     celery -A cursion worker -E --loglevel=info -O fair --hostname=celery@$(hostname) -Q "$QUEUES" $EXTRA_ARGS
 fi
 